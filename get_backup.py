@@ -1,18 +1,85 @@
 #!/home/bv/bvenv/bin/python
 """
-This script will set the database name for backup.
+This script will set the database name for backup. murcs_Get.py runs in bulk load mode.
+The snapshot is built under a temporary name. When murcs_Get.py ends without error, the snapshot is checked: sqlite
+integrity check, unique natural keys, rows in the main tables and no main table that shrinks below SNAPSHOT_MIN_RATIO
+(default 0.5) of the latest snapshot. Then it is renamed to its final name and the latest link is pointed to it, so
+readers always get a complete snapshot.
+With --memory the database is built in memory and written to DBDIR at the end.
+With --incremental the most recent snapshot in DBDIR is used as previous snapshot for murcs_Get.py.
+With --resume an interrupted run on today's database is continued, the database is not rebuilt.
 """
+import argparse
 import datetime
+import glob
 import logging
 import os
 import platform
+import sys
 from lib import my_env
+from lib.localstore import sqliteUtils
 from lib.my_env import run_script
 
+# Tables that must have rows in a snapshot.
+required_tables = ["version", "site", "person", "server", "solution"]
+
+parser = argparse.ArgumentParser(description="Create a Murcs snapshot database.")
+parser.add_argument("--incremental", action="store_true",
+                    help="Copy unchanged servers and solutions from the most recent snapshot.")
+parser.add_argument("--resume", action="store_true", help="Continue an interrupted run on today's database.")
+parser.add_argument("--memory", action="store_true", help="Build the database in memory.")
+args = parser.parse_args()
+
 cfg = my_env.init_env("bellavista", __file__)
+dbdir = os.getenv("DBDIR")
 dbname = "{host}_{date}.db".format(host=platform.node(), date=datetime.datetime.now().strftime("%Y%m%d"))
-os.environ["LOCALDB"] = dbname
+tmpname = "{db}.tmp".format(db=dbname)
+latest = os.path.join(dbdir, "{host}_latest.db".format(host=platform.node()))
+os.environ["LOCALDB"] = tmpname
 (fp, filename) = os.path.split(__file__)
-for script in ["rebuild_sqlite.py", "murcs_Get.py"]:
-    logging.info("Run script: {s}".format(s=script))
-    run_script(fp, script)
+get_args = ["--bulk"]
+if args.memory:
+    get_args.append("--memory")
+if args.incremental:
+    snapshots = [db for db in glob.glob(os.path.join(dbdir, "{host}_*.db".format(host=platform.node())))
+                 if os.path.basename(db) != dbname and not os.path.islink(db)]
+    if snapshots:
+        get_args += ["--previous", max(snapshots, key=os.path.getmtime)]
+    else:
+        logging.warning("No previous snapshot found, full collection required.")
+if args.resume and os.path.isfile(os.path.join(dbdir, tmpname)):
+    get_args.append("--resume")
+else:
+    logging.info("Run script: rebuild_sqlite.py")
+    if run_script(fp, "rebuild_sqlite.py").returncode != 0:
+        logging.error("rebuild_sqlite.py failed, no snapshot created.")
+        sys.exit(1)
+logging.info("Run script: murcs_Get.py {a}".format(a=" ".join(get_args)))
+if run_script(fp, "murcs_Get.py", *get_args).returncode != 0:
+    logging.error("murcs_Get.py failed, {db} is not published, use --resume to continue.".format(db=tmpname))
+    sys.exit(1)
+
+# Check the snapshot before it is published.
+lcl = sqliteUtils()
+problems = lcl.integrity_check()
+problems += ["Table {t} has duplicate values for natural key {c}".format(t=tablename, c=", ".join(cols))
+             for tablename, cols in lcl.check_unique_keys()]
+counts = lcl.get_counts()
+lcl.dbConn.close()
+problems += ["Table {t} has no rows".format(t=table) for table in required_tables if not counts.get(table)]
+if os.path.isfile(latest):
+    min_ratio = float(os.getenv("SNAPSHOT_MIN_RATIO", 0.5))
+    prev = sqliteUtils(latest)
+    prev_counts = prev.get_counts()
+    prev.dbConn.close()
+    problems += ["Table {t} has {c} rows, latest snapshot has {p} rows".format(t=table, c=counts.get(table, 0),
+                                                                               p=prev_counts[table])
+                 for table in required_tables if counts.get(table, 0) < prev_counts.get(table, 0) * min_ratio]
+if problems:
+    for problem in problems:
+        logging.error(problem)
+    logging.error("Snapshot {db} is not published.".format(db=tmpname))
+    sys.exit(1)
+my_env.publish_file(os.path.join(dbdir, tmpname), os.path.join(dbdir, dbname), link=latest)
+logging.info("Snapshot {db} is published, rows per table: {c}".format(db=dbname, c=counts))
+logging.info("End application")
@@ -2,6 +2,8 @@
 This module consolidates database access for BellaVista project.
 """
 
+import atexit
+import datetime
 import logging
 import os
 import pymysql
@@ -9,9 +11,76 @@ import sqlite3
 from sqlalchemy import Column, Integer, Text, create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.pool import StaticPool
 
 Base = declarative_base()
 
+# Pragmas for a bulk load: no fsync, larger page cache (in KiB) and temporary tables in memory. WAL journal keeps the
+# database consistent if the process is killed, so an interrupted load can be resumed.
+bulk_pragmas = ["journal_mode = WAL", "synchronous = OFF", "cache_size = -65536", "temp_store = MEMORY"]
+
+# Natural keys, a unique index is created after the load (sqliteUtils.create_indexes). A network interface ID is
+# unique per server only.
+unique_keys = [
+    ("person", ["email"]),
+    ("server", ["serverId"]),
+    ("site", ["siteId"]),
+    ("software", ["softwareId"]),
+    ("softinst", ["softwareInstanceId"]),
+    ("solution", ["solutionId"]),
+    ("solinst", ["solutionInstanceId"]),
+    ("soltosol", ["solutionToSolutionId"]),
+    ("netiface", ["serverId", "networkInterfaceId"])
+]
+# Indexes on the columns that link tables, created after the load.
+indexes = [
+    ("contactserver", ["serverId"]),
+    ("contactserver", ["email"]),
+    ("contactsolution", ["solutionId"]),
+    ("contactsolution", ["email"]),
+    ("ipaddress", ["serverId"]),
+    ("serverproperty", ["serverId"]),
+    ("softinst", ["serverId"]),
+    ("softinst", ["softwareId"]),
+    ("solinst", ["solutionId"]),
+    ("solinstcomp", ["solutionId"]),
+    ("solinstcomp", ["solutionInstanceId"]),
+    ("solinstcomp", ["serverId"]),
+    ("solinstcomp", ["softwareInstanceId"]),
+    ("solinstproperty", ["solutionId"]),
+    ("solutionproperty", ["solutionId"]),
+    ("soltosol", ["fromSolutionId"]),
+    ("soltosol", ["toSolutionId"]),
+    ("progress", ["stage", "objectId"])
+]
+
+# Tables that are not copied by a refresh, they describe the extraction run.
+refresh_skip = ["progress"]
+
+server_query = "SELECT * FROM server WHERE serverId=?"
+softinst_os_query = """
+    SELECT i.softwareInstanceId as softwareInstanceId, h.serverId as serverId, s.softwareId as softwareId
+    FROM softinst i
+    INNER JOIN software s on s.softwareId = i.softwareId
+    INNER JOIN server h on h.serverId=i.serverId
+    WHERE h.serverId=?
+      AND i.softwareInstanceType = 'OperatingSystem'
+"""
+# Queries that must use an index, see sqliteUtils.check_indexes.
+hot_queries = [
+    server_query,
+    softinst_os_query,
+    "SELECT * FROM softinst WHERE serverId=?",
+    "SELECT * FROM solinstcomp WHERE solutionId=?",
+    "SELECT objectId FROM progress WHERE stage = ?"
+]
+
+
+class DuplicateKeyError(Exception):
+    """
+    This exception is raised if a natural key in unique_keys has duplicate values, so rows cannot be matched on the key.
+    """
+
 
 class ContactServer(Base):
     """
@@ -69,6 +138,7 @@ class NetworkIpAddress(Base):
     ipAddressType = Column(Text)
     name = Column(Text)
     netmask = Column(Text)
+    serverId = Column(Text)
     serverNetworkInterface = Column(Text)
     serverNetworkInterfaceId = Column(Text)
     vCenterNIC = Column(Text)
@@ -121,6 +191,18 @@ class Person(Base):
     title = Column(Text)
 
 
+class Progress(Base):
+    """
+    Table containing the progress of the Murcs extraction. A row is added for every stage and for every object that
+    is done, so an interrupted extraction can be resumed.
+    """
+    __tablename__ = "progress"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    stage = Column(Text)
+    objectId = Column(Text)
+    doneAt = Column(Text)
+
+
 class Server(Base):
     """
     Table containing the Server Information.
@@ -474,12 +556,18 @@ class sqliteUtils:
     specific table.
     """
 
-    def __init__(self):
+    def __init__(self, db=None):
         """
         To drop a database in sqlite3, you need to delete the file.
+
+        :param db: Full path of the database, default LOCALDB in DBDIR.
         """
-        self.db = os.path.join(os.getenv("DBDIR"), os.getenv("LOCALDB"))
+        self.db = db or os.path.join(os.getenv("DBDIR"), os.getenv("LOCALDB"))
         self.dbConn, self.cur = self._connect2db()
+        self.bulk = False
+        self.memory = False
+        self.attached = {}
+        self.columns = {}
 
     def _connect2db(self):
         """
@@ -497,6 +585,145 @@ class sqliteUtils:
         else:
             return False, False
 
+    def attach(self, db, alias="prev"):
+        """
+        This method attaches another sqlite database to the connection. Tables of the attached database are available
+        as alias.tablename.
+
+        :param db: Full path of the database to attach.
+        :param alias: Schema name for the attached database.
+        :return:
+        """
+        self.dbConn.execute("ATTACH DATABASE ? AS {a}".format(a=alias), (db,))
+        self.attached[alias] = db
+        logging.info("Database {db} attached as {a}".format(db=db, a=alias))
+        return
+
+    def commit(self):
+        """
+        This method commits the rows of a stage.
+
+        :return:
+        """
+        self.dbConn.commit()
+        return
+
+    def check_unique_keys(self):
+        """
+        This method checks that the natural keys in unique_keys are enforced by a unique index.
+
+        :return: List of (tablename, cols) tuples from unique_keys that have no unique index.
+        """
+        return [(tablename, cols) for tablename, cols in unique_keys if not self._is_unique(tablename, cols)]
+
+    def check_indexes(self):
+        """
+        This method checks with EXPLAIN QUERY PLAN that the queries in hot_queries use an index for every table.
+
+        :return: List of plan steps that scan a table, empty list if all queries use indexes.
+        """
+        scans = []
+        for query in hot_queries:
+            params = (None,) * query.count("?")
+            for row in self.dbConn.execute("EXPLAIN QUERY PLAN {q}".format(q=query), params).fetchall():
+                detail = row[-1]
+                if detail.startswith("SCAN") and "COVERING INDEX" not in detail:
+                    scans.append("{d} in query {q}".format(d=detail, q=" ".join(query.split())))
+        return scans
+
+    def _check_memory(self):
+        """
+        Internal method to continue the load on disk if the in-memory database is larger than the memory ceiling.
+
+        :return:
+        """
+        if self.memory:
+            size = self.dbConn.execute("PRAGMA page_count").fetchone()[0] * \
+                   self.dbConn.execute("PRAGMA page_size").fetchone()[0]
+            if size > self.memory_limit * 1024 * 1024:
+                logging.warning("Database in memory is {s:.0f} MB, limit is {l} MB, load continues on disk."
+                                .format(s=size / 1024 / 1024, l=self.memory_limit))
+                self.end_memory()
+        return
+
+    def _commit_at_exit(self):
+        if self.bulk:
+            self.dbConn.commit()
+        return
+
+    def _commit(self):
+        """
+        Internal method to commit after a change, except in bulk load mode.
+
+        :return:
+        """
+        if not self.bulk:
+            self.dbConn.commit()
+        return
+
+    def copy_rows(self, tablename, keycols, keys, alias="prev", uniquecol=None):
+        """
+        This method copies rows from a table in an attached database into the same table of the main database. Rows
+        are selected when one of the keycols has a value in keys. Only columns that are in both tables are copied,
+        the surrogate id is not copied.
+
+        :param tablename: Table to copy rows from and to.
+        :param keycols: Column name or list of column names to select rows on.
+        :param keys: Iterable with values for the key columns.
+        :param alias: Schema name of the attached database.
+        :param uniquecol: Optional column, rows with a value that is in the main table already are not copied.
+        :return: Number of rows copied.
+        """
+        if isinstance(keycols, str):
+            keycols = [keycols]
+        self.dbConn.execute("CREATE TEMP TABLE IF NOT EXISTS copy_keys (key TEXT)")
+        self.dbConn.execute("DELETE FROM temp.copy_keys")
+        self.dbConn.executemany("INSERT INTO temp.copy_keys (key) VALUES (?)", ((key,) for key in keys))
+        prev_cols = self.get_columns(tablename, alias)
+        columns = ", ".join("`{c}`".format(c=c) for c in self.get_columns(tablename) if c in prev_cols and c != "id")
+        where = " OR ".join("`{k}` IN (SELECT key FROM temp.copy_keys)".format(k=k) for k in keycols)
+        if uniquecol:
+            where = "({w}) AND `{u}` NOT IN (SELECT `{u}` FROM main.{t} WHERE `{u}` IS NOT NULL)"\
+                .format(w=where, u=uniquecol, t=tablename)
+        query = "INSERT INTO main.{t} ({cols}) SELECT {cols} FROM {a}.{t} WHERE {w}"\
+            .format(t=tablename, cols=columns, a=alias, w=where)
+        logging.debug("Copy query: {q}".format(q=query))
+        cnt = self.dbConn.execute(query).rowcount
+        self._commit()
+        self._check_memory()
+        logging.info("{cnt} rows copied into {t}".format(cnt=cnt, t=tablename))
+        return cnt
+
+    def create_indexes(self):
+        """
+        This method creates the indexes in unique_keys and indexes. Create the indexes after the load, so inserts do not
+        maintain the indexes. If a unique index fails on duplicate values, then the duplicates are logged and a
+        non-unique ix_ index is created for the lookups. The natural key is not enforced for this table, the caller
+        decides what to do with it.
+
+        :return: List of (tablename, cols) tuples from unique_keys that have no unique index.
+        """
+        for tablename, cols in unique_keys:
+            if self._is_unique(tablename, cols):
+                continue
+            name = "uq_{t}_{c}".format(t=tablename, c="_".join(cols))
+            # An index with this name that is not unique on these columns is replaced.
+            self.dbConn.execute("DROP INDEX IF EXISTS {n}".format(n=name))
+            try:
+                self.dbConn.execute("CREATE UNIQUE INDEX {n} ON {t} ({c})".format(n=name, t=tablename,
+                                                                                    c=", ".join(cols)))
+            except sqlite3.IntegrityError:
+                logging.error("{cnt} duplicate values for {c} in {t}, natural key is not unique."
+                              .format(cnt=self.get_duplicates(tablename, cols), c=", ".join(cols), t=tablename))
+                self.dbConn.execute("CREATE INDEX IF NOT EXISTS ix_{t}_{n} ON {t} ({c})"
+                                    .format(t=tablename, n="_".join(cols), c=", ".join(cols)))
+        for tablename, cols in indexes:
+            self.dbConn.execute("CREATE INDEX IF NOT EXISTS ix_{t}_{n} ON {t} ({c})"
+                                .format(t=tablename, n="_".join(cols), c=", ".join(cols)))
+        self._commit()
+        logging.info("{cnt} indexes created".format(cnt=len(unique_keys) + len(indexes)))
+        return self.check_unique_keys()
+
     def create_table(self, tablename, row):
         """
         This method will create a table where the fields are the row list.
@@ -515,6 +742,101 @@ class sqliteUtils:
         logging.info("Table {tn} is built".format(tn=tablename))
         return len(row)
 
+    def end_bulk(self):
+        """
+        This method commits the last stage and switches the journal back to the default, so the database is a single
+        file again.
+
+        :return:
+        """
+        self.dbConn.commit()
+        self.bulk = False
+        if self.memory:
+            return
+        self.dbConn.execute("PRAGMA journal_mode = DELETE")
+        self.dbConn.execute("PRAGMA synchronous = FULL")
+        return
+
+    def end_memory(self):
+        """
+        This method writes the in-memory database to the database file and continues on the file.
+
+        :return:
+        """
+        if self.memory:
+            self.persist()
+            self.dbConn.close()
+            self.memory = False
+            self._reconnect(*self._connect2db())
+        return
+
+    def get_changed(self, tablename, keycol, alias="prev"):
+        """
+        This method compares a table with the same table in an attached database, on changedAt and version. Rows that
+        are new or that have a different changedAt or version are changed.
+
+        :param tablename: Table to compare.
+        :param keycol: Natural key of the table.
+        :param alias: Schema name of the attached database.
+        :return: Set of keys for rows that are changed.
+        """
+        query = """
+            SELECT c.`{k}` as key
+            FROM main.{t} c
+            LEFT JOIN {a}.{t} p ON p.`{k}` = c.`{k}`
+            WHERE p.`{k}` IS NULL
+               OR p.changedAt IS NOT c.changedAt
+               OR p.version IS NOT c.version
+        """.format(t=tablename, k=keycol, a=alias)
+        return set(row["key"] for row in self.get_query(query))
+
+    def get_columns(self, tablename, schema="main"):
+        """
+        This method returns the column names of a table.
+
+        :param tablename: Name of the table
+        :param schema: main or the alias of an attached database.
+        :return: List of column names, empty list if the table does not exist.
+        """
+        query = "PRAGMA {s}.table_info({t})".format(s=schema, t=tablename)
+        return [row["name"] for row in self.get_query(query)]
+
+    def get_duplicates(self, tablename, cols, schema="main"):
+        """
+        This method counts the key values that are on more than one row. Rows with a NULL in the key are not counted,
+        like in a unique index.
+
+        :param tablename: Name of the table.
+        :param cols: List of key column names.
+        :param schema: main or the alias of an attached database.
+        :return: Number of key values with duplicates.
+        """
+        query = "SELECT count(*) FROM (SELECT 1 FROM {s}.{t} WHERE {n} GROUP BY {c} HAVING count(*) > 1)"\
+            .format(s=schema, t=tablename, n=" AND ".join("`{c}` IS NOT NULL".format(c=col) for col in cols),
+                    c=", ".join("`{c}`".format(c=col) for col in cols))
+        return self.dbConn.execute(query).fetchone()[0]
+
+    def get_counts(self):
+        """
+        This method returns the number of rows per table of the main database.
+
+        :return: Dictionary with table name as key and number of rows as value.
+        """
+        query = "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+        tables = [row[0] for row in self.dbConn.execute(query).fetchall()]
+        return {table: self.dbConn.execute("SELECT count(*) FROM {t}".format(t=table)).fetchone()[0]
+                for table in tables}
+
+    def get_done(self, stage):
+        """
+        This method returns the objects that are done for a stage of the extraction.
+
+        :param stage: Name of the stage.
+        :return: Set of objectIds that are done.
+        """
+        self.cur.execute("SELECT objectId FROM progress WHERE stage = ?", (stage,))
+        return set(row["objectId"] for row in self.cur.fetchall())
+
     def get_query(self, query):
         """
         This method will get a query and return the result of the query.
@@ -534,8 +856,7 @@ class sqliteUtils:
         :param serverId:
         :return: Dict with server record including id and serverId of the server, or False if the server does not exist.
         """
-        query = "SELECT * FROM server WHERE serverId=?"
-        self.cur.execute(query, (serverId,))
+        self.cur.execute(server_query, (serverId,))
         res = self.cur.fetchall()
         if len(res) > 0:
             return res[0]
@@ -549,15 +870,7 @@ class sqliteUtils:
         :param serverId: serverId of the server.
         :return: instance record or False if not found.
         """
-        query = """
-            SELECT i.softwareInstanceId as softwareInstanceId, h.serverId as serverId, s.softwareId as softwareId
-            FROM softinst i
-            INNER JOIN software s on s.softwareId = i.softwareId
-            INNER JOIN server h on h.serverId=i.serverId
-            WHERE h.serverId=?
-              AND i.softwareInstanceType = 'OperatingSystem'
-        """
-        self.cur.execute(query, (serverId, ))
+        self.cur.execute(softinst_os_query, (serverId, ))
         res = self.cur.fetchall()
         if len(res) > 0:
             logging.debug("OS Instance for host {hostName} found.".format(hostName=serverId))
@@ -593,35 +906,321 @@ class sqliteUtils:
         values = tuple(rowdict[key] for key in rowdict.keys())
         logging.debug("Insert query: {q}".format(q=query))
         self.dbConn.execute(query, values)
-        self.dbConn.commit()
+        self._commit()
         return
 
     def insert_rows(self, tablename, rowdict):
         """
-        This method will insert a list of dictionary rows into a table.
+        This method will insert a list of dictionary rows into a table. The rows are inserted with one executemany
+        call. Columns are the keys of the rows, a row that misses a key gets NULL for the column. A key that is not a
+        column of the table raises an OperationalError, nothing is inserted. If a row has an integrity or interface
+        error, then the rows are inserted one by one and the rows with errors are logged and skipped.
 
         :param tablename: Table Name to insert data into
         :param rowdict: List of Dictionary Rows
         :return:
         """
         if len(rowdict) > 0:
-            columns = ", ".join("`" + k + "`" for k in rowdict[0].keys())
-            values_template = ", ".join(["?"] * len(rowdict[0].keys()))
+            tablecols = self._get_table_columns(tablename)
+            keys = set().union(*rowdict)
+            unknown = sorted(keys.difference(tablecols))
+            if unknown:
+                raise sqlite3.OperationalError("table {t} has no column named {k}".format(t=tablename, k=unknown[0]))
+            cols = [col for col in tablecols if col in keys]
+            columns = ", ".join("`" + k + "`" for k in cols)
+            values_template = ", ".join(["?"] * len(cols))
             query = "insert into {tn} ({cols}) values ({vt})".format(tn=tablename, cols=columns, vt=values_template)
             logging.debug("Insert query: {q}".format(q=query))
-            # cnt = my_env.LoopInfo(tablename, 50)
-            for line in rowdict:
-                # cnt.info_loop()
-                logging.debug(line)
-                values = tuple(line[key] for key in line.keys())
-                try:
-                    self.dbConn.execute(query, values)
-                except sqlite3.IntegrityError:
-                    logging.error("Integrity Error on query {q} with values {v}".format(q=query, v=values))
-                except sqlite3.InterfaceError:
-                    logging.error("Interface error on query {q} with values {v}".format(q=query, v=values))
-            # cnt.end_loop()
+            values = [tuple(map(line.get, cols)) for line in rowdict]
+            # A savepoint in an open transaction, so the rows of a failed executemany can be rolled back.
+            if not self.dbConn.in_transaction:
+                self.dbConn.execute("BEGIN")
+            self.dbConn.execute("SAVEPOINT insert_rows")
+            try:
+                self.dbConn.executemany(query, values)
+            except (sqlite3.IntegrityError, sqlite3.InterfaceError):
+                self.dbConn.execute("ROLLBACK TO insert_rows")
+                self._insert_each(query, values)
+            self.dbConn.execute("RELEASE insert_rows")
+            self._commit()
+            self._check_memory()
+        return
+
+    def _insert_each(self, query, values):
+        """
+        Internal method to insert rows one by one. Rows with an integrity or interface error are logged and skipped.
+
+        :param query: Insert query.
+        :param values: List of value tuples.
+        :return:
+        """
+        for value in values:
+            try:
+                self.dbConn.execute(query, value)
+            except sqlite3.IntegrityError:
+                logging.error("Integrity Error on query {q} with values {v}".format(q=query, v=value))
+            except sqlite3.InterfaceError:
+                logging.error("Interface error on query {q} with values {v}".format(q=query, v=value))
+        return
+
+    def _get_table_columns(self, tablename):
+        """
+        Internal method to return the columns of a table in the main database. The columns are read once per table.
+
+        :param tablename: Name of the table
+        :return: List of column names.
+        """
+        try:
+            return self.columns[tablename]
+        except KeyError:
+            self.columns[tablename] = self.get_columns(tablename)
+            return self.columns[tablename]
+
+    def integrity_check(self):
+        """
+        This method runs the sqlite integrity check on the main database.
+
+        :return: List of problems, empty list if the database is ok.
+        """
+        res = [row[0] for row in self.dbConn.execute("PRAGMA main.integrity_check").fetchall()]
+        return [] if res == ["ok"] else res
+
+    def mark_done(self, stage, objectIds):
+        """
+        This method remembers objects that are done for a stage of the extraction.
+
+        :param stage: Name of the stage.
+        :param objectIds: objectId or list of objectIds that are done.
+        :return:
+        """
+        if isinstance(objectIds, str):
+            objectIds = [objectIds]
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.dbConn.executemany("INSERT INTO progress (stage, objectId, doneAt) VALUES (?, ?, ?)",
+                                ((stage, objectId, now) for objectId in objectIds))
+        self._commit()
+        return
+
+    def persist(self):
+        """
+        This method writes the in-memory database to the database file in one pass, with the SQLite online backup API.
+        The content of the file is replaced.
+
+        :return:
+        """
+        if self.memory:
+            self.dbConn.commit()
+            disk_conn = sqlite3.connect(self.db)
+            try:
+                self.dbConn.backup(disk_conn)
+            finally:
+                disk_conn.close()
+            logging.info("Database in memory written to {db}".format(db=self.db))
+        return
+
+    def refresh(self, src):
+        """
+        This method refreshes the main database in place from a snapshot database, instead of a rebuild. Tables with a
+        natural key in unique_keys are upserted on the key: new rows are inserted, rows with changed values are updated
+        and unchanged rows are not touched. Rows of the other tables and rows with a NULL in the natural key are matched
+        on all columns, so a changed row is deleted and inserted. Identical rows are counted, the table gets as many
+        copies as the snapshot. Rows that are not in the snapshot are deleted. All statements are set-based and the
+        tables are refreshed in one transaction.
+        If a natural key has duplicate values in the database or in the snapshot, then DuplicateKeyError is raised and
+        nothing is changed. Duplicates in the database need a rebuild.
+
+        :param src: Full path of the snapshot database.
+        :return: Dictionary with table name as key and dictionary with inserted, updated and deleted rows as value.
+        """
+        failed = self.create_indexes()
+        self.attach(src, "src")
+        counts = {}
+        try:
+            failed += [(tablename, cols) for tablename, cols in unique_keys
+                       if self.get_columns(tablename, "src") and self.get_duplicates(tablename, cols, "src")]
+            if failed:
+                raise DuplicateKeyError("Duplicate values for natural key {k}, database is not refreshed."
+                                        .format(k=", ".join("{t}({c})".format(t=t, c=", ".join(c)) for t, c in failed)))
+            for tablename in [table.name for table in Base.metadata.sorted_tables if table.name not in refresh_skip]:
+                counts[tablename] = self._refresh_table(tablename)
+                logging.debug("Table {t} refreshed: {c}".format(t=tablename, c=counts[tablename]))
+        except Exception:
+            self.dbConn.rollback()
+            raise
+        else:
             self.dbConn.commit()
+        finally:
+            self.dbConn.execute("DETACH DATABASE src")
+            del self.attached["src"]
+        return counts
+
+    def _refresh_table(self, tablename):
+        """
+        Internal method to refresh a table from the table in the attached snapshot database src. Rows with a natural key
+        are upserted on the key. Rows of a table without natural key and rows with a NULL in the natural key are
+        matched on all columns, see _refresh_rows.
+
+        :param tablename: Name of the table.
+        :return: Dictionary with number of inserted, updated and deleted rows.
+        """
+        src_cols = self.get_columns(tablename, "src")
+        cols = [col for col in self.get_columns(tablename) if col != "id" and col in src_cols]
+        columns = ", ".join("`{c}`".format(c=col) for col in cols)
+        keycols = dict(unique_keys).get(tablename)
+        if not keycols:
+            return self._refresh_rows(tablename, cols)
+        counts = self._refresh_rows(tablename, cols, " OR ".join("`{k}` IS NULL".format(k=k) for k in keycols))
+        haskey = " AND ".join("`{k}` IS NOT NULL".format(k=k) for k in keycols)
+        match = " AND ".join("s.`{k}` IS {t}.`{k}`".format(k=k, t=tablename) for k in keycols)
+        query = "DELETE FROM main.{t} WHERE {h} AND NOT EXISTS (SELECT 1 FROM src.{t} s WHERE {m})"
+        counts["deleted"] += self.dbConn.execute(query.format(t=tablename, h=haskey, m=match)).rowcount
+        query = "SELECT count(*) FROM src.{t} WHERE {h} AND NOT EXISTS (SELECT 1 FROM main.{t} s WHERE {m})"
+        match = " AND ".join("s.`{k}` IS src.{t}.`{k}`".format(k=k, t=tablename) for k in keycols)
+        inserted = self.dbConn.execute(query.format(t=tablename, h=haskey, m=match)).fetchone()[0]
+        # The update is skipped for rows without changes, these rows are not counted.
+        values = [col for col in cols if col not in keycols]
+        query = "INSERT INTO main.{t} ({cols}) SELECT {cols} FROM src.{t} WHERE {h} " \
+                "ON CONFLICT ({k}) DO UPDATE SET {u} WHERE {w}"\
+            .format(t=tablename, cols=columns, h=haskey, k=", ".join("`{k}`".format(k=k) for k in keycols),
+                    u=", ".join("`{c}` = excluded.`{c}`".format(c=col) for col in values),
+                    w=" OR ".join("{t}.`{c}` IS NOT excluded.`{c}`".format(t=tablename, c=col) for col in values))
+        changed = self.dbConn.execute(query).rowcount
+        counts["inserted"] += inserted
+        counts["updated"] += changed - inserted
+        return counts
+
+    def _refresh_rows(self, tablename, cols, where=None):
+        """
+        Internal method to refresh rows that are matched on all columns. Identical rows are counted: if the snapshot
+        has a row twice and the table once, then one row is inserted. A changed row is deleted and inserted, rows that
+        are not changed keep their id.
+
+        :param tablename: Name of the table.
+        :param cols: List of columns to compare, without id.
+        :param where: Optional condition on the columns to select the rows to refresh.
+        :return: Dictionary with number of inserted, updated (always 0) and deleted rows.
+        """
+        columns = ", ".join("`{c}`".format(c=col) for col in cols)
+        where = "WHERE {w}".format(w=where) if where else ""
+        match = " AND ".join("r.`{c}` IS g.`{c}`".format(c=col) for col in cols)
+        # Rows numbered per group of identical rows, and the number of identical rows on the other side.
+        numbered = "SELECT id, {cols}, ROW_NUMBER() OVER (PARTITION BY {cols} ORDER BY id) AS rn FROM {s}.{t} {w}"
+        grouped = "SELECT {cols}, count(*) AS cnt FROM {s}.{t} {w} GROUP BY {cols}"
+        surplus = "SELECT {sel} FROM ({n}) r LEFT JOIN ({g}) g ON {m} WHERE r.rn > coalesce(g.cnt, 0)"
+        query = "DELETE FROM main.{t} WHERE id IN ({q})"\
+            .format(t=tablename, q=surplus.format(sel="r.id", m=match,
+                                                  n=numbered.format(cols=columns, s="main", t=tablename, w=where),
+                                                  g=grouped.format(cols=columns, s="src", t=tablename, w=where)))
+        deleted = self.dbConn.execute(query).rowcount
+        query = "INSERT INTO main.{t} ({cols}) {q}"\
+            .format(t=tablename, cols=columns,
+                    q=surplus.format(sel=", ".join("r.`{c}`".format(c=col) for col in cols), m=match,
+                                     n=numbered.format(cols=columns, s="src", t=tablename, w=where),
+                                     g=grouped.format(cols=columns, s="main", t=tablename, w=where)))
+        inserted = self.dbConn.execute(query).rowcount
+        return dict(inserted=inserted, updated=0, deleted=deleted)
+
+    def _is_unique(self, tablename, cols):
+        """
+        Internal method to check that a table has a unique index on exactly these columns.
+
+        :param tablename: Name of the table.
+        :param cols: List of column names.
+        :return: True if the unique index exists, False otherwise.
+        """
+        for index in self.dbConn.execute("PRAGMA main.index_list({t})".format(t=tablename)).fetchall():
+            if index[2]:
+                info = self.dbConn.execute("PRAGMA main.index_info({i})".format(i=index[1])).fetchall()
+                if [row[2] for row in info] == list(cols):
+                    return True
+        return False
+
+    def _persist_at_exit(self):
+        if self.memory:
+            self.persist()
+        return
+
+    def _reconnect(self, db_conn, cur):
+        """
+        Internal method to continue on another connection. Attached databases and bulk load pragmas are set again.
+
+        :param db_conn: New connection.
+        :param cur: Cursor on the new connection.
+        :return:
+        """
+        self.dbConn, self.cur = db_conn, cur
+        for alias, db in self.attached.items():
+            self.dbConn.execute("ATTACH DATABASE ? AS {a}".format(a=alias), (db,))
+        if self.bulk:
+            for pragma in bulk_pragmas:
+                self.dbConn.execute("PRAGMA {p}".format(p=pragma))
+        return
+
+    def remove_unfinished(self, tablename, stage, keycols=None):
+        """
+        This method removes rows that have been written for objects that are not done, to prepare for a resume of the
+        extraction. If no keycols are given, then all rows of the table are removed.
+
+        :param tablename: Table to remove rows from.
+        :param stage: Name of the stage that lists the objects that are done.
+        :param keycols: Column name or list of column names that link a row to the object.
+        :return: Number of rows removed.
+        """
+        if keycols is None:
+            cnt = self.dbConn.execute("DELETE FROM {t}".format(t=tablename)).rowcount
+        else:
+            if isinstance(keycols, str):
+                keycols = [keycols]
+            where = " OR ".join("`{k}` NOT IN (SELECT objectId FROM progress WHERE stage = ?)".format(k=k)
+                                for k in keycols)
+            query = "DELETE FROM {t} WHERE {w}".format(t=tablename, w=where)
+            cnt = self.dbConn.execute(query, (stage,) * len(keycols)).rowcount
+        self._commit()
+        if cnt > 0:
+            logging.info("{cnt} rows of unfinished objects removed from {t}".format(cnt=cnt, t=tablename))
+        return cnt
+
+    def set_bulk(self):
+        """
+        This method switches the connection to bulk load mode: the pragmas in bulk_pragmas are set and rows are not
+        committed per call. Call commit at the end of a stage and end_bulk at the end of the load.
+        If the script stops on an error, then the rows that are loaded are committed on exit, so a resume can continue
+        with the objects that are not done.
+
+        :return:
+        """
+        self.dbConn.commit()
+        for pragma in bulk_pragmas:
+            self.dbConn.execute("PRAGMA {p}".format(p=pragma))
+        self.bulk = True
+        atexit.register(self._commit_at_exit)
+        logging.info("Bulk load mode for {db}".format(db=self.db))
+        return
+
+    def set_memory(self):
+        """
+        This method moves the database into memory: the database file, if any, is copied into an in-memory connection
+        and tables that are missing are created from the SQLAlchemy schema. Call end_memory at the end of the load to
+        write the database to the file in one pass. If the database grows beyond LOCALDB_MEMORY_LIMIT MB (default
+        1024), then it is written to the file and the load continues on disk.
+        If the script stops on an error, then the database is written to the file on exit, so a resume can continue.
+
+        :return:
+        """
+        self.memory_limit = int(os.getenv("LOCALDB_MEMORY_LIMIT", 1024))
+        mem_conn = sqlite3.connect(":memory:")
+        if self.dbConn:
+            self.dbConn.commit()
+            self.dbConn.backup(mem_conn)
+            self.dbConn.close()
+        # The engine uses the in-memory connection, a new connection would be a new empty database.
+        engine = create_engine("sqlite://", poolclass=StaticPool, creator=lambda: mem_conn)
+        Base.metadata.create_all(engine)
+        mem_conn.row_factory = sqlite3.Row
+        self._reconnect(mem_conn, mem_conn.cursor())
+        self.memory = True
+        atexit.register(self._persist_at_exit)
+        logging.info("Database {db} is built in memory".format(db=self.db))
         return
 
     def rebuild(self):
@@ -659,6 +1258,180 @@ class mysqlUtils:
         self.conn = pymysql.connect(**self.msp)
         self.cur = self.conn.cursor(pymysql.cursors.DictCursor)
 
+    def create_indexes(self):
+        """
+        This method creates the indexes in unique_keys and indexes, if they do not exist. Text columns are indexed on a
+        prefix of 191 characters. A unique index on a prefix would reject different values with the same prefix, so a
+        natural key is enforced with a unique index on the generated column naturalKey: the SHA1 of the key columns,
+        NULL if a key column is NULL. If the unique index fails on duplicate values, then the duplicates are logged and
+        a non-unique ix_ index is created for the lookups.
+
+        :return: List of (tablename, cols) tuples from unique_keys that have no unique index.
+        """
+        failed = []
+        for tablename, cols in unique_keys:
+            if self._is_unique(tablename, cols):
+                continue
+            name = "uq_{t}_{c}".format(t=tablename, c="_".join(cols))
+            if self.cur.execute("SHOW COLUMNS FROM {t} LIKE 'naturalKey'".format(t=tablename)) == 0:
+                query = "ALTER TABLE {t} ADD COLUMN naturalKey CHAR(40) " \
+                        "AS (IF({n}, NULL, SHA1(JSON_ARRAY({c})))) STORED"
+                self.cur.execute(query.format(t=tablename, c=", ".join("`{c}`".format(c=col) for col in cols),
+                                              n=" OR ".join("`{c}` IS NULL".format(c=col) for col in cols)))
+            # An index with this name that is not unique on naturalKey (e.g. a unique prefix index) is replaced.
+            if self.cur.execute("SHOW INDEX FROM {t} WHERE Key_name = %s".format(t=tablename), (name,)) > 0:
+                self.cur.execute("DROP INDEX {n} ON {t}".format(n=name, t=tablename))
+            try:
+                self.cur.execute("CREATE UNIQUE INDEX {n} ON {t} (naturalKey)".format(n=name, t=tablename))
+            except pymysql.err.IntegrityError:
+                logging.error("Duplicate values for {c} in {t}, natural key is not unique."
+                              .format(c=", ".join(cols), t=tablename))
+                failed.append((tablename, cols))
+                self._create_index(tablename, cols)
+        for tablename, cols in indexes:
+            self._create_index(tablename, cols)
+        return failed
+
+    def _create_index(self, tablename, cols):
+        """
+        Internal method to create a non-unique index on a prefix of the columns, if it does not exist.
+
+        :param tablename: Name of the table.
+        :param cols: List of column names.
+        :return:
+        """
+        name = "ix_{t}_{c}".format(t=tablename, c="_".join(cols))
+        if self.cur.execute("SHOW INDEX FROM {t} WHERE Key_name = %s".format(t=tablename), (name,)) == 0:
+            self.cur.execute("CREATE INDEX {n} ON {t} ({c})"
+                             .format(n=name, t=tablename, c=", ".join("`{c}`(191)".format(c=col) for col in cols)))
+        return
+
+    def _get_engine(self):
+        conn_string = "mysql+pymysql://{u}:{p}@{h}/{db}".format(db=self.msp["db"], u=self.msp["user"],
+                                                              p=self.msp["passwd"], h=self.msp["host"])
+        return set_engine(conn_string)
+
+    def _is_unique(self, tablename, cols):
+        """
+        Internal method to check that the natural key of a table is enforced: the uq_ index is unique on naturalKey.
+
+        :param tablename: Name of the table.
+        :param cols: List of key column names.
+        :return: True if the unique index exists, False otherwise.
+        """
+        name = "uq_{t}_{c}".format(t=tablename, c="_".join(cols))
+        self.cur.execute("SHOW INDEX FROM {t} WHERE Key_name = %s".format(t=tablename), (name,))
+        return [(row["Non_unique"], row["Column_name"]) for row in self.cur.fetchall()] == [(0, "naturalKey")]
+
+    def refresh(self, lcl):
+        """
+        This method refreshes the database in place from a sqlite snapshot, instead of a rebuild. Missing tables and
+        indexes are created. Every table of the snapshot is loaded into a temporary table. Tables with a natural key in
+        unique_keys are upserted on the key: new rows are inserted, rows with changed values are updated and unchanged
+        rows are not touched. Rows of the other tables and rows with a NULL in the natural key are matched on all
+        columns, so a changed row is deleted and inserted. Identical rows are counted, the table gets as many copies as
+        the snapshot. Rows that are not in the snapshot are deleted. The tables are refreshed in one transaction.
+        Window functions are used, so MySQL 8.0 or later is required.
+        If a natural key has duplicate values in the database or in the snapshot, then DuplicateKeyError is raised and
+        nothing is changed. Duplicates in the database need a rebuild.
+
+        :param lcl: sqliteUtils object for the snapshot database.
+        :return: Dictionary with table name as key and dictionary with inserted, updated and deleted rows as value.
+        """
+        Base.metadata.create_all(self._get_engine())
+        failed = self.create_indexes()
+        failed += [(tablename, cols) for tablename, cols in unique_keys
+                   if lcl.get_columns(tablename) and lcl.get_duplicates(tablename, cols)]
+        if failed:
+            raise DuplicateKeyError("Duplicate values for natural key {k}, database is not refreshed."
+                                    .format(k=", ".join("{t}({c})".format(t=t, c=", ".join(c)) for t, c in failed)))
+        counts = {}
+        try:
+            for tablename in [table.name for table in Base.metadata.sorted_tables if table.name not in refresh_skip]:
+                counts[tablename] = self._refresh_table(tablename, lcl)
+                logging.debug("Table {t} refreshed: {c}".format(t=tablename, c=counts[tablename]))
+        except Exception:
+            self.conn.rollback()
+            raise
+        else:
+            self.conn.commit()
+        return counts
+
+    def _refresh_table(self, tablename, lcl):
+        """
+        Internal method to refresh a table from the same table in a sqlite snapshot. Rows with a natural key are
+        upserted on the key. Rows of a table without natural key and rows with a NULL in the natural key are matched on
+        all columns, see _refresh_rows.
+
+        :param tablename: Name of the table.
+        :param lcl: sqliteUtils object for the snapshot database.
+        :return: Dictionary with number of inserted, updated and deleted rows.
+        """
+        self.cur.execute("SHOW COLUMNS FROM {t}".format(t=tablename))
+        table_cols = [row["Field"] for row in self.cur.fetchall()]
+        cols = [col for col in lcl.get_columns(tablename) if col != "id" and col in table_cols]
+        columns = ", ".join("`{c}`".format(c=col) for col in cols)
+        stage = "refresh_{t}".format(t=tablename)
+        self.cur.execute("CREATE TEMPORARY TABLE {s} LIKE {t}".format(s=stage, t=tablename))
+        query = "INSERT INTO {s} ({cols}) VALUES ({v})".format(s=stage, cols=columns, v=", ".join(["%s"] * len(cols)))
+        self.cur.executemany(query, [tuple(row) for row in
+                                     lcl.get_query("SELECT {cols} FROM {t}".format(cols=columns, t=tablename))])
+        keycols = dict(unique_keys).get(tablename)
+        if not keycols:
+            counts = self._refresh_rows(tablename, stage, cols)
+            self.cur.execute("DROP TEMPORARY TABLE {s}".format(s=stage))
+            return counts
+        counts = self._refresh_rows(tablename, stage, cols, " OR ".join("`{k}` IS NULL".format(k=k) for k in keycols))
+        match = " AND ".join("t.`{k}` <=> s.`{k}`".format(k=k) for k in keycols)
+        haskey = " AND ".join("{a}.`{k}` IS NOT NULL".format(a="{a}", k=k) for k in keycols)
+        counts["deleted"] += self.cur.execute("DELETE t FROM {t} t LEFT JOIN {s} s ON {m} WHERE s.id IS NULL AND {h}"
+                                              .format(t=tablename, s=stage, m=match, h=haskey.format(a="t")))
+        self.cur.execute("SELECT count(*) AS cnt FROM {s} s LEFT JOIN {t} t ON {m} WHERE t.id IS NULL AND {h}"
+                         .format(t=tablename, s=stage, m=match, h=haskey.format(a="s")))
+        inserted = self.cur.fetchone()["cnt"]
+        # Affected rows is 1 for an inserted row, 2 for an updated row and 0 for a row without changes.
+        values = [col for col in cols if col not in keycols]
+        changed = self.cur.execute("INSERT INTO {t} ({cols}) SELECT {cols} FROM {s} s WHERE {h} "
+                                   "ON DUPLICATE KEY UPDATE {u}"
+                                   .format(t=tablename, s=stage, cols=columns, h=haskey.format(a="s"),
+                                           u=", ".join("`{c}` = VALUES(`{c}`)".format(c=col) for col in values)))
+        self.cur.execute("DROP TEMPORARY TABLE {s}".format(s=stage))
+        counts["inserted"] += inserted
+        counts["updated"] += (changed - inserted) // 2
+        return counts
+
+    def _refresh_rows(self, tablename, stage, cols, where=None):
+        """
+        Internal method to refresh rows that are matched on all columns. Identical rows are counted: if the snapshot
+        has a row twice and the table once, then one row is inserted. A changed row is deleted and inserted, rows that
+        are not changed keep their id.
+
+        :param tablename: Name of the table.
+        :param stage: Temporary table with the rows of the snapshot.
+        :param cols: List of columns to compare, without id.
+        :param where: Optional condition on the columns to select the rows to refresh.
+        :return: Dictionary with number of inserted, updated (always 0) and deleted rows.
+        """
+        columns = ", ".join("`{c}`".format(c=col) for col in cols)
+        where = "WHERE {w}".format(w=where) if where else ""
+        match = " AND ".join("r.`{c}` <=> g.`{c}`".format(c=col) for col in cols)
+        # Rows numbered per group of identical rows, and the number of identical rows on the other side.
+        numbered = "SELECT id, {cols}, ROW_NUMBER() OVER (PARTITION BY {cols} ORDER BY id) AS rn FROM {t} {w}"
+        grouped = "SELECT {cols}, count(*) AS cnt FROM {t} {w} GROUP BY {cols}"
+        surplus = "SELECT {sel} FROM ({n}) r LEFT JOIN ({g}) g ON {m} WHERE r.rn > COALESCE(g.cnt, 0)"
+        query = "DELETE t FROM {t} t JOIN ({q}) d ON d.id = t.id"\
+            .format(t=tablename, q=surplus.format(sel="r.id", m=match,
+                                                  n=numbered.format(cols=columns, t=tablename, w=where),
+                                                  g=grouped.format(cols=columns, t=stage, w=where)))
+        deleted = self.cur.execute(query)
+        query = "INSERT INTO {t} ({cols}) {q}"\
+            .format(t=tablename, cols=columns,
+                    q=surplus.format(sel=", ".join("r.`{c}`".format(c=col) for col in cols), m=match,
+                                     n=numbered.format(cols=columns, t=stage, w=where),
+                                     g=grouped.format(cols=columns, t=tablename, w=where)))
+        inserted = self.cur.execute(query)
+        return dict(inserted=inserted, updated=0, deleted=deleted)
+
     def rebuild(self):
         """
         This function will drop and recreate the database. Then it will call SQLAlchemy to recreate the tables.
@@ -666,9 +1439,6 @@ class mysqlUtils:
         :return:
         """
         db = self.msp["db"]
-        user = self.msp["user"]
-        passwd = self.msp["passwd"]
-        host = self.msp["host"]
         query = "DROP DATABASE IF EXISTS {db}".format(db=db)
         logging.info(query)
         self.cur.execute(query)
@@ -676,9 +1446,7 @@ class mysqlUtils:
         logging.info(query)
         self.cur.execute(query)
         # Now use sqlalchemy connection to build database
-        conn_string = "mysql+pymysql://{u}:{p}@{h}/{db}".format(db=db, u=user, p=passwd, h=host)
-        engine = set_engine(conn_string)
-        Base.metadata.create_all(engine)
+        Base.metadata.create_all(self._get_engine())
 
 
 def init_session(db, echo=False):
@@ -26,6 +26,26 @@ solInst_prop2dict = dict(
 
 disc_sw = []    # List of softwareIds that have been discovered.
 
+"""
+Tables that are filled from the server details and from the solution details, with the column that links a row to the
+server or the solution. These rows can be copied from a previous snapshot if the server or solution did not change.
+"""
+srv_detail_tables = dict(
+    netiface="serverId",
+    ipaddress="serverId",
+    contactserver="serverId",
+    serverproperty="serverId",
+    softinst="serverId"
+)
+sol_detail_tables = dict(
+    solinst="solutionId",
+    solinstcomp="solutionId",
+    solinstproperty="solutionId",
+    contactsolution="solutionId",
+    solutionproperty="solutionId",
+    soltosol=["fromSolutionId", "toSolutionId"]
+)
+
 
 def fmo_hostName(fqdn):
     """
@@ -130,13 +150,21 @@ def handle_solutionInstance(solinstdict, solId):
 
 
 def handle_solToSol(soltosoldict, solToSol_done):
+    """
+    This method handles the solution to solution relations of a solution. Each relation shows up for the from and
+    the to solution, so relations that are in solToSol_done are skipped.
+
+    :param soltosoldict: List of solution to solution relations.
+    :param solToSol_done: Set of solutionToSolutionIds that have been handled already. New Ids are added.
+    :return: List of relations that have not been handled before.
+    """
     remember_res = []
     if len(soltosoldict) > 0:
         for cnt in range(len(soltosoldict)):
             solToSolId = soltosoldict[cnt]["solutionToSolutionId"]
             # Make sure to capture only first appearance of solToSolId
             if solToSolId not in solToSol_done:
-                solToSol_done.append(solToSolId)
+                solToSol_done.add(solToSolId)
                 soltosoldict[cnt]["fromSolutionId"] = handle_solution(soltosoldict[cnt].pop("fromSolution"))
                 soltosoldict[cnt]["toSolutionId"] = handle_solution(soltosoldict[cnt].pop("toSolution"))
                 # Todo: handle solutionToSolution Properties!
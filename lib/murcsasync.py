@@ -0,0 +1,528 @@
+"""
+This module consolidates the Murcs Rest Calls for asyncio applications.
+"""
+import asyncio
+import base64
+import contextvars
+import logging
+import time
+import aiohttp
+import yarl
+from collections import deque
+from multidict import CIMultiDict, CIMultiDictProxy
+from urllib.parse import urlencode
+from lib.murcsrest import AdaptiveLimiter, MurcsBatch, MurcsRestBase, overload_status, retry_status
+
+# Status and latency of the last call of the task. The batch sets a dictionary, the calls of the task (hedged calls
+# included) update it.
+last_call = contextvars.ContextVar("last_call", default=None)
+
+
+class AsyncAdaptiveLimiter(AdaptiveLimiter):
+    """
+    This class is the AdaptiveLimiter for coroutines. It needs to be created in the event loop that uses it.
+    """
+
+    def __init__(self, initial, ceiling, latency_factor=3.0):
+        super().__init__(initial, ceiling, latency_factor)
+        self.cond = asyncio.Condition()
+
+    async def acquire(self):
+        """
+        This method waits until a call can be launched within the limit.
+
+        :return: Start time of the call.
+        """
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.inflight < int(self.limit))
+            self.inflight += 1
+        return time.monotonic()
+
+    async def release(self, started, failed=False, endpoint=None):
+        """
+        This method registers the end of a call and adjusts the limit.
+
+        :param started: Start time of the call, as returned by acquire.
+        :param failed: True if Murcs failed or was overloaded for the call.
+        :param endpoint: Endpoint of the call, e.g. ("servers/{id}", "GET"). Latencies are compared per endpoint.
+        :return:
+        """
+        async with self.cond:
+            self.inflight -= 1
+            self._adjust(started, time.monotonic(), failed, endpoint)
+            self.cond.notify_all()
+
+
+class AsyncResponse:
+    """
+    This class has the status, headers and body of a call. The body is read before the connection is released, so the
+    response can be used after the call.
+    """
+
+    def __init__(self, method, url, status, headers, content, request_info=None):
+        """
+        :param method: GET, PUT or DELETE
+        :param url: Full url of the call, with query string.
+        :param status: http status of the response.
+        :param headers: Response headers.
+        :param content: Response body (bytes).
+        :param request_info: aiohttp RequestInfo of the call, calculated from method and url if not given.
+        """
+        self.status = status
+        self.headers = headers
+        self.content = content
+        if request_info is None:
+            request_info = aiohttp.RequestInfo(yarl.URL(url), method, CIMultiDictProxy(CIMultiDict()), yarl.URL(url))
+        self.request_info = request_info
+
+    def raise_for_status(self):
+        """
+        This method raises ClientResponseError for a 4xx or 5xx status. The message is the response body, Murcs
+        explains the error in the body.
+
+        :return:
+        """
+        if self.status >= 400:
+            raise aiohttp.ClientResponseError(self.request_info, (), status=self.status,
+                                              message=self.content.decode("utf-8", "replace"), headers=self.headers)
+
+
+class AsyncMurcsBatch(MurcsBatch):
+    """
+    This class is the MurcsBatch for AsyncMurcsRest. It is used with async with, the calls are sent on exit of the
+    context:
+
+        async with client.batch() as batch:
+            for rec in records:
+                batch.add_softInst_calc(rec["softId"], rec["serverId"])
+        failed = [item for item in batch.report if item["error"]]
+
+    At most workers calls of the batch are sent at the same time.
+    """
+
+    def __enter__(self):
+        raise TypeError("Use async with for a batch of AsyncMurcsRest")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            await self.run()
+        else:
+            logging.error("Batch with {c} calls is not sent because of {e!r}".format(c=len(self.queue), e=exc_val))
+
+    async def run(self):
+        """
+        This method sends the calls that are queued. The calls are removed from the queue and their results are added
+        to the report.
+
+        :return: List with the result for every call.
+        """
+        jobs = self._take()
+        if self.dry_run:
+            return []
+        if self.ordered:
+            results = [None] * len(jobs)
+            for todo in self._levels(jobs, results):
+                for idx, result in zip(todo, await self._call_all([jobs[idx] for idx in todo])):
+                    results[idx] = result
+        else:
+            results = await self._call_all(jobs)
+        return self._add_report(results)
+
+    async def _call_all(self, jobs):
+        """
+        Internal method to send calls concurrently, at most workers at the same time.
+
+        :param jobs: List of (queued call, journal entry, callback) tuples.
+        :return: List with the result for every call.
+        """
+        slots = asyncio.Semaphore(self.workers)
+
+        async def call(job):
+            async with slots:
+                return await self._call(job)
+
+        return await self.client.run_all(call(job) for job in jobs)
+
+    async def _call(self, job):
+        """
+        Internal method to send one call of the batch, see MurcsBatch._call.
+
+        :param job: Tuple with queued call (operation name, method, args and kwargs), journal entry and callback.
+        :return: Dictionary with operation, args, kwargs, status, latency and error.
+        """
+        (name, func, args, kwargs), entry, callback = job
+        call = dict(status=None, latency=None)
+        token = last_call.set(call)
+        error = None
+        try:
+            await func(*args, **kwargs)
+        except aiohttp.ClientResponseError as e:
+            error = e.message
+        except Exception as e:
+            error = "{e!r}".format(e=e)
+        finally:
+            last_call.reset(token)
+        return self._result(job, call["status"], call["latency"], error)
+
+
+class AsyncMurcsRest(MurcsRestBase):
+    """
+    This class offers the methods of MurcsRest as coroutines, e.g. await client.get_server(serverId) or
+    await client.add_softInst(softInstId, payload). URL and payload calculation, deadlines, hedging, caches, recording
+    and metrics are shared with MurcsRest (see MurcsRestBase), the calls are sent with an aiohttp session.
+    Number of calls in flight is controlled by the adaptive limiter, so thousands of calls can be scheduled at once.
+    The client needs to be used in a running event loop:
+
+        async with AsyncMurcsRest() as client:
+            servers = await client.run_all(client.get_server(serverId) for serverId in serverIds)
+    """
+
+    def __init__(self, cache_size=None):
+        """
+        The init procedure will set-up the Murcs Rest parameters, see MurcsRestBase. The aiohttp session and the
+        limiter are created on first use, in the event loop of the caller.
+
+        :param cache_size: Number of GET responses in the read-through cache, default MURCS_CACHE_SIZE.
+        """
+        super().__init__(cache_size)
+        self.session = None
+        self.inflight = None
+        self.counter = dict(requests=0, connections=0, reused=0)
+        self.headers = {'Accept': 'application/json'}
+        if self.user:
+            credentials = "{u}:{p}".format(u=self.user, p=self.passwd or "").encode("latin1")
+            self.headers["Authorization"] = "Basic {c}".format(c=base64.b64encode(credentials).decode("ascii"))
+
+    async def _get_session(self):
+        """
+        Internal method to return the aiohttp session. Session and concurrency budget are created on first use.
+
+        :return: aiohttp ClientSession
+        """
+        if self.session is None:
+            trace = aiohttp.TraceConfig()
+            trace.on_connection_create_end.append(self._on_connection_create)
+            trace.on_connection_reuseconn.append(self._on_connection_reuse)
+            self.session = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=aiohttp.TCPConnector(limit=self.poolsize),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                trace_configs=[trace]
+            )
+            self.inflight = AsyncAdaptiveLimiter(self.initial_workers, self.max_workers, self.latency_factor)
+        return self.session
+
+    async def _on_connection_create(self, session, ctx, params):
+        self.counter["connections"] += 1
+
+    async def _on_connection_reuse(self, session, ctx, params):
+        self.counter["reused"] += 1
+
+    async def close(self):
+        """
+        This method closes the aiohttp session.
+
+        :return:
+        """
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        await self._get_session()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    @staticmethod
+    def _set_last_call(status, latency):
+        call = last_call.get()
+        if call is not None:
+            call.update(status=status, latency=latency)
+
+    async def _request(self, method, url, **kwargs):
+        """
+        Internal method to launch a Rest call within its deadline, see MurcsRest._request. A call that does not answer
+        before the deadline is cancelled and raises DeadlineExceeded. A hedged GET call gets a second call, the call
+        that answers first is used and the other call is cancelled.
+
+        :param method: GET, PUT or DELETE
+        :param url: Full url for the call.
+        :param kwargs: Additional parameters for the aiohttp call (data, params, headers)
+        :return: AsyncResponse object.
+        """
+        started = time.monotonic()
+        deadline = self._get_deadline(started)
+        if deadline is not None and deadline <= started:
+            self._deadline_exceeded(method, url, started)
+        hedge_delay = self._get_hedge_delay(method, url)
+        if deadline is None and hedge_delay is None:
+            return await self._attempt(method, url, **kwargs)
+        pending = {asyncio.ensure_future(self._attempt(method, url, **kwargs)): False}
+        hedge_at = started + hedge_delay if hedge_delay is not None else None
+        error = None
+        try:
+            while pending:
+                until = min([t for t in [hedge_at, deadline] if t is not None], default=None)
+                timeout = None if until is None else max(0, until - time.monotonic())
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    hedged = pending.pop(task)
+                    try:
+                        r = task.result()
+                    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                        error = error or e
+                        # No second call for a call that failed.
+                        hedge_at = None
+                        continue
+                    if hedged:
+                        self.metrics.record_hedge(method, url, won=True)
+                    self._set_last_call(r.status, time.monotonic() - started)
+                    return r
+                if done:
+                    continue
+                if deadline is not None and time.monotonic() >= deadline:
+                    self._deadline_exceeded(method, url, started)
+                if hedge_at is not None:
+                    self.metrics.record_hedge(method, url)
+                    pending[asyncio.ensure_future(self._attempt(method, url, **kwargs))] = True
+                    hedge_at = None
+            self._set_last_call(None, time.monotonic() - started)
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _deadline_exceeded(self, method, url, started):
+        self._set_last_call(None, time.monotonic() - started)
+        super()._deadline_exceeded(method, url, started)
+
+    async def _attempt(self, method, url, headers=None, **kwargs):
+        """
+        Internal method to launch a Rest call on the shared session. The call is retried MURCS_RETRIES times with
+        exponential backoff on connection errors, timeouts and 5xx responses. The number of calls in flight is
+        controlled by the adaptive limiter. Every call is registered in the metrics.
+
+        :param method: GET, PUT or DELETE
+        :param url: Full url for the call.
+        :param headers: Optional dictionary with additional headers.
+        :param kwargs: Additional parameters for the aiohttp call (data, params)
+        :return: AsyncResponse object.
+        """
+        session = await self._get_session()
+        headers = dict(headers or {})
+        if method != "GET":
+            headers['Content-Type'] = 'application/json; charset=utf-8'
+        attempt = 0
+        while True:
+            started = await self.inflight.acquire()
+            failed = True
+            try:
+                r = await self._exchange(session, method, url, headers, **kwargs)
+                failed = r.status in overload_status
+                self._set_last_call(r.status, time.monotonic() - started)
+                self.metrics.record(method, url, r.status, time.monotonic() - started, len(r.content), attempt)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                self._set_last_call(None, time.monotonic() - started)
+                self.metrics.record(method, url, "error", time.monotonic() - started, 0, attempt)
+                if attempt >= self.retries:
+                    raise
+            else:
+                if r.status not in retry_status or attempt >= self.retries:
+                    return r
+            finally:
+                await self.inflight.release(started, failed, (self.metrics.endpoint(url), method))
+            await asyncio.sleep(self.backoff * (2 ** attempt))
+            attempt += 1
+
+    async def _exchange(self, session, method, url, headers, params=None, data=None):
+        """
+        Internal method to send a call and read the response. The call is answered from the recording if MURCS_REPLAY
+        is set, and recorded if MURCS_RECORD is set.
+
+        :param session: aiohttp ClientSession.
+        :param method: GET, PUT or DELETE
+        :param url: Full url for the call.
+        :param headers: Dictionary with headers for the call.
+        :param params: Optional dictionary with query parameters.
+        :param data: Optional request body.
+        :return: AsyncResponse object.
+        """
+        # Same query string as the requests session, so recordings can be used by both clients.
+        full_url = url + "?" + urlencode(params, doseq=True) if params else url
+        if self.replayer:
+            rec = self.replayer.lookup(method, full_url, data)
+            if self.replayer.speed > 0:
+                await asyncio.sleep(rec["latency"] / self.replayer.speed)
+            return AsyncResponse(method, full_url, rec["status"], CIMultiDict(rec["headers"]),
+                                 rec["body"].encode("utf-8"))
+        started = time.monotonic()
+        self.counter["requests"] += 1
+        async with session.request(method, url, params=params, data=data, headers=headers) as r:
+            content = await r.read()
+        if self.recorder:
+            self.recorder.record(method, full_url, data, r.status, r.headers, content, time.monotonic() - started)
+        return AsyncResponse(method, full_url, r.status, r.headers, content, r.request_info)
+
+    async def _send(self, method, url, msg=None, parse=None, cached=True, **kwargs):
+        """
+        Internal method to launch a Rest call and handle the response, see MurcsRest._send. On failure the response is
+        logged and a ClientResponseError is raised.
+
+        :param method: GET, PUT or DELETE
+        :param url: Full url for the call.
+        :param msg: Message to log on success.
+        :param parse: Optional function that is applied on the parsed json of a GET call.
+        :param cached: If False, then a GET call is not answered from the memory cache and not added to the memory
+        cache. The disk cache only answers after a 304 reply of Murcs, so the response is never stale.
+        :param kwargs: Additional parameters for the aiohttp call (data, params, ...)
+        :return: Murcs information as a parsed json string for GET calls, None otherwise.
+        """
+        if method == "GET":
+            if self.cache and cached:
+                body = await self.cache.get_async(url, kwargs.get("params"), lambda: self._fetch(url, **kwargs))
+            else:
+                body = await self._fetch(url, fresh=not cached, **kwargs)
+            return self._handle(body, msg, parse)
+        try:
+            body = await self._receive(method, url, **kwargs)
+        finally:
+            self._invalidate(url, kwargs.get("data"))
+        if msg and body is not None:
+            logging.info(msg)
+        return
+
+    async def _receive(self, method, url, **kwargs):
+        """
+        Internal method to launch a Rest call and return the response body, see MurcsRest._receive.
+
+        :param method: GET, PUT or DELETE
+        :param url: Full url for the call.
+        :param kwargs: Additional parameters for the aiohttp call (data, params, ...)
+        :return: Response body (bytes), None if the status is not 200.
+        """
+        r = await self._request(method, url, **kwargs)
+        return self._check(r.status, r.content, r)
+
+    async def _fetch(self, url, fresh=False, **kwargs):
+        """
+        Internal method to launch a GET call and return the response body, see MurcsRest._fetch. The disk cache files
+        are read and written in a thread, not in the event loop.
+
+        :param url: Full url for the call.
+        :param fresh: If True, then the disk cache does not use a response without asking Murcs.
+        :param kwargs: Additional parameters for the aiohttp call (params, ...)
+        :return: Response body (bytes), None if the status is not 200.
+        """
+        if not self.disk_cache:
+            return await self._receive("GET", url, **kwargs)
+        loop = asyncio.get_running_loop()
+        params = kwargs.get("params")
+        entry, headers, hit = await loop.run_in_executor(None, self.disk_cache.lookup, url, params, fresh)
+        if hit:
+            return entry[1]
+        r = await self._request("GET", url, headers=headers, **kwargs)
+        status, body = await loop.run_in_executor(None, self.disk_cache.update, url, params, entry, r.status,
+                                                  r.headers, r.content, fresh)
+        if status == 304:
+            return body
+        return self._check(status, body, r)
+
+    def batch(self, workers=None, ordered=False, journal=None, dry_run=False):
+        """
+        This method returns a context to send write calls (add_*, remove_*, update_*) concurrently. See
+        AsyncMurcsBatch and MurcsRest.batch.
+
+        :param workers: Number of calls of the batch that are sent at the same time, default max_workers.
+        :param ordered: If True, then calls are sent in dependency order.
+        :param journal: Optional murcsjournal.Journal object, calls are written to the journal before they are sent.
+        :param dry_run: If True, then calls are logged and written to the journal, but not sent.
+        :return: AsyncMurcsBatch object.
+        """
+        return AsyncMurcsBatch(self, workers, ordered, journal, dry_run)
+
+    async def run_all(self, coros):
+        """
+        This method runs a collection of coroutines concurrently and returns the results in order. The number of calls
+        in flight is limited by the adaptive limiter. If one of the coroutines fails or if run_all is cancelled,
+        then the coroutines that are still running are cancelled.
+
+        :param coros: Iterable with coroutines, e.g. client.get_server(serverId) calls.
+        :return: List of results.
+        """
+        tasks = [asyncio.ensure_future(coro) for coro in coros]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def get_connection_stats(self):
+        """
+        This method returns the connection counters of the aiohttp session.
+
+        :return: Dictionary with number of requests, connections and reused connections.
+        """
+        return dict(self.counter)
+
+    async def get_data(self, objtype, start=0, limit=100, reslist=None):
+        """
+        This method launches the Rest calls to get the murcs data for a specific object type (site, servers, ...)
+
+        :param objtype: Object type for which Murcs information is collected.
+        :param start: Offset of the return set, default 0
+        :param limit: Number of lines in the return set, default 100
+        :param reslist: Optional list, records will be appended to this list.
+        :return: List with Murcs records for the object type.
+        """
+        if reslist is None:
+            reslist = []
+        async for page in self.iter_data(objtype, page_size=limit, start=start):
+            reslist += page
+        return reslist
+
+    async def iter_data(self, objtype, page_size=100, start=0):
+        """
+        This method launches the Rest calls to get the murcs data for a specific object type and yields the records
+        page by page. Remaining pages are planned from the first page and collected concurrently, a limited number of
+        pages ahead of the caller.
+
+        :param objtype: Object type for which Murcs information is collected.
+        :param page_size: Number of records per page, default 100
+        :param start: Offset of the first record, default 0
+        :return: Async generator with a list of Murcs records for every page.
+        """
+        res = await self._get_page(objtype, start, page_size)
+        seen = set()
+        yield self._new_records(res["items"], seen)
+        pending = deque()
+        try:
+            for nextStart in range(start + page_size, res["totalResults"], page_size):
+                pending.append(asyncio.ensure_future(self._get_page(objtype, nextStart, page_size)))
+                if len(pending) >= 2 * self.max_workers:
+                    page = await pending.popleft()
+                    yield self._new_records(page["items"], seen)
+            while pending:
+                page = await pending.popleft()
+                yield self._new_records(page["items"], seen)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def get_solinst_from_solution(self, solId):
+        """
+        This method launches the Rest call to get the solution Instances for a solution. The details for every
+        solution Instance Id are collected concurrently.
+
+        :param solId: Solution Id for which the solution Instances are required.
+        :return: Murcs information as a parsed json string.
+        """
+        solInstIds = await self.get_solinstids_from_solution(solId)
+        solInstDicts = await self.run_all(self.get_solinst_details_from_solution(solId, solInstId)
+                                          for solInstId in solInstIds)
+        return [solInstDict for solInstDict in solInstDicts if isinstance(solInstDict, dict)]
@@ -0,0 +1,424 @@
+"""
+This module offers a read-through cache for the Murcs Rest GET calls. The response body is kept for a limited time
+(TTL) and the number of responses is limited (least recently used responses are dropped first). Concurrent calls for
+the same url share one call to Murcs. Write calls invalidate the responses for the objects they touch.
+Optionally responses are kept on disk as well, so they can be used by the next run.
+"""
+
+import asyncio
+import collections
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from lib.murcsmetrics import vocabulary
+
+
+class _Flight:
+    """
+    This class is a GET call in flight. Threads (or coroutines) that ask for the same url wait for the result of the
+    first one.
+    """
+
+    def __init__(self, segments, event):
+        self.segments = segments
+        self.event = event
+        self.body = None
+        self.error = None
+        self.stale = False
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self.body
+
+
+class MurcsCache:
+    """
+    This class keeps the response bodies of GET calls, keyed on url and params. The body is kept, not the parsed json,
+    so every hit returns a new object that can be modified by the caller.
+    A write call invalidates the responses that have an object ID of the write call in the path: the IDs in the path
+    of the write call and the IDs in the payload (serverId, softwareId, ...). The list pages of the collection of the
+    write call are invalidated as well. If no IDs are found, then the cache is emptied.
+    """
+
+    def __init__(self, url_loc, url_base, size=1000, ttl=300):
+        """
+        :param url_loc: Url for the Murcs Rest API.
+        :param url_base: Url for the Murcs Rest API of the client.
+        :param size: Maximum number of responses in the cache.
+        :param ttl: Number of seconds a response is valid.
+        """
+        self.url_loc = url_loc
+        self.url_base = url_base
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.flights = {}
+        self.stats = dict(hits=0, misses=0, shared=0, expired=0, evicted=0, invalidated=0, flushed=0)
+
+    def _segments(self, url):
+        """
+        Internal method to split the path of a url into segments, relative to the Murcs Rest API.
+
+        :param url: Full url.
+        :return: Tuple of path segments.
+        """
+        for prefix in [self.url_base, self.url_loc]:
+            if url.startswith(prefix):
+                url = url[len(prefix):]
+                break
+        return tuple(url.strip("/").split("/"))
+
+    def get(self, url, params, fetch):
+        """
+        This method returns the response body for a GET call. If the response is not in the cache and no other thread
+        is collecting it, then fetch is called. An exception in fetch is raised in all threads that wait for the call.
+
+        :param url: Full url for the call.
+        :param params: Parameters for the call, or None.
+        :param fetch: Function without arguments that does the call and returns the response body.
+        :return: Response body.
+        """
+        key = (url, json.dumps(params, sort_keys=True))
+        flight, leader, body = self._join(key, url, threading.Event)
+        if flight is None:
+            return body
+        if not leader:
+            flight.event.wait()
+            return flight.result()
+        try:
+            flight.body = fetch()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            self._land(key, flight)
+        return flight.body
+
+    async def get_async(self, url, params, fetch):
+        """
+        This method is get for asyncio applications: fetch is a coroutine function and coroutines that ask for the
+        same url wait in the event loop. An exception in fetch, cancellation included, is raised in all coroutines
+        that wait for the call.
+
+        :param url: Full url for the call.
+        :param params: Parameters for the call, or None.
+        :param fetch: Coroutine function without arguments that does the call and returns the response body.
+        :return: Response body.
+        """
+        key = (url, json.dumps(params, sort_keys=True))
+        flight, leader, body = self._join(key, url, asyncio.Event)
+        if flight is None:
+            return body
+        if not leader:
+            await flight.event.wait()
+            return flight.result()
+        try:
+            flight.body = await fetch()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            self._land(key, flight)
+        return flight.body
+
+    def _join(self, key, url, event):
+        """
+        Internal method to look up a response in the cache, or to join the call in flight for the response.
+
+        :param key: Tuple with url and params as json string.
+        :param url: Full url for the call.
+        :param event: Class of the event that wakes up the callers that wait for a call in flight.
+        :return: Tuple with call in flight (None if the response is in the cache), True if the caller needs to do the
+        call and the response body from the cache.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return None, False, entry[2]
+                del self.entries[key]
+                self.stats["expired"] += 1
+            flight = self.flights.get(key)
+            if flight is not None:
+                self.stats["shared"] += 1
+                return flight, False, None
+            self.stats["misses"] += 1
+            flight = _Flight(self._segments(url), event())
+            self.flights[key] = flight
+            return flight, True, None
+
+    def _land(self, key, flight):
+        """
+        Internal method to end a call in flight. The response is kept, unless the call failed or a write call during the
+        call may have changed the object. The callers that wait for the call are woken up.
+
+        :param key: Tuple with url and params as json string.
+        :param flight: Call in flight.
+        :return:
+        """
+        with self.lock:
+            if flight.error is None and not flight.stale:
+                self.entries[key] = (time.monotonic() + self.ttl, flight.segments, flight.body)
+                while len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+                    self.stats["evicted"] += 1
+            del self.flights[key]
+        flight.event.set()
+        return
+
+    def invalidate(self, url, data=None):
+        """
+        This method drops the responses for the objects that are touched by a write call. GET calls in flight for these
+        objects are not added to the cache.
+
+        :param url: Full url of the write call.
+        :param data: Payload of the write call as a json string, or None.
+        :return:
+        """
+        segments = self._segments(url)
+        ids = set(segment for segment in segments if segment not in vocabulary)
+        if data:
+            ids |= set(_get_ids(json.loads(data)))
+        if not ids:
+            self.flush()
+            return
+
+        def touched(entry_segments):
+            return (len(entry_segments) == 1 and entry_segments[0] == segments[0]) or bool(ids & set(entry_segments))
+
+        with self.lock:
+            for key in [key for key, entry in self.entries.items() if touched(entry[1])]:
+                del self.entries[key]
+                self.stats["invalidated"] += 1
+            for flight in self.flights.values():
+                if touched(flight.segments):
+                    flight.stale = True
+        return
+
+    def flush(self):
+        """
+        This method empties the cache.
+
+        :return:
+        """
+        with self.lock:
+            self.entries.clear()
+            for flight in self.flights.values():
+                flight.stale = True
+            self.stats["flushed"] += 1
+        return
+
+    def get_stats(self):
+        """
+        This method returns the cache counters. Shared calls are calls that waited for the same call in flight.
+
+        :return: Dictionary with number of entries, hits, misses, shared, expired, evicted and invalidated responses
+        and number of flushes.
+        """
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries))
+
+
+def _get_ids(payload):
+    """
+    This function returns the values of the ID attributes (serverId, softwareInstanceId, ...) in a payload, nested
+    dictionaries included.
+
+    :param payload: Parsed payload.
+    :return: List of IDs.
+    """
+    ids = []
+    if isinstance(payload, dict):
+        for key, value in payload.items():
+            if key.endswith("Id") and isinstance(value, str):
+                ids.append(value)
+            else:
+                ids += _get_ids(value)
+    elif isinstance(payload, list):
+        for value in payload:
+            ids += _get_ids(value)
+    return ids
+
+
+class MurcsDiskCache:
+    """
+    This class keeps the response bodies of GET calls on disk, gzip compressed, one file per url and params. The file
+    has a json line with url, params, validators and time of storage, followed by the response body.
+    A response with an ETag or Last-Modified header is revalidated with a conditional GET on every use: if Murcs
+    replies 304 Not Modified, then the body from disk is used. A response without validators is used without asking
+    Murcs as long as it is younger than the TTL and younger than the last write call of this cache. A fresh GET, used
+    for the pages of a list of objects, is never answered from disk without asking Murcs: only a 304 reply allows the
+    body from disk.
+    """
+
+    def __init__(self, directory, ttl=3600):
+        """
+        :param directory: Directory for the cache files. The directory is created if it does not exist.
+        :param ttl: Number of seconds a response without validators is valid.
+        """
+        self.directory = directory
+        self.ttl = ttl
+        self.written = os.path.join(directory, "written")
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.stats = dict(hits=0, revalidated=0, misses=0, stored=0)
+
+    def _filename(self, url, params):
+        key = json.dumps([url, params], sort_keys=True)
+        return os.path.join(self.directory, "{h}.gz".format(h=hashlib.sha1(key.encode("utf-8")).hexdigest()))
+
+    def _count(self, counter):
+        with self.lock:
+            self.stats[counter] += 1
+
+    def load(self, url, params):
+        """
+        This method reads the response for a GET call from disk.
+
+        :param url: Full url for the call.
+        :param params: Parameters for the call, or None.
+        :return: Tuple with the meta data dictionary and the response body, or None if the response is not on disk.
+        """
+        try:
+            with gzip.open(self._filename(url, params), "rb") as fh:
+                meta = json.loads(fh.readline().decode("utf-8"))
+                body = fh.read()
+        except (OSError, EOFError, ValueError):
+            return None
+        # The file name is a hash, check that the file is for this call.
+        if meta["url"] != url or meta["params"] != params:
+            return None
+        return meta, body
+
+    def store(self, url, params, headers, body):
+        """
+        This method writes the response for a GET call to disk. The file is replaced in one step, so a reader never
+        sees a partial file.
+
+        :param url: Full url for the call.
+        :param params: Parameters for the call, or None.
+        :param headers: Response headers.
+        :param body: Response body (bytes).
+        :return:
+        """
+        meta = dict(url=url, params=params, etag=headers.get("ETag"), lastModified=headers.get("Last-Modified"),
+                    storedAt=time.time())
+        filename = self._filename(url, params)
+        fd, tmpname = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with gzip.open(os.fdopen(fd, "wb"), "wb") as fh:
+                fh.write(json.dumps(meta).encode("utf-8") + b"\n")
+                fh.write(body)
+            os.replace(tmpname, filename)
+        except OSError:
+            logging.warning("Response for {u} not written to disk cache".format(u=url))
+            try:
+                os.remove(tmpname)
+            except OSError:
+                pass
+        return
+
+    def get(self, url, params, request, fresh=False):
+        """
+        This method returns the response body for a GET call, from disk if possible.
+
+        :param url: Full url for the call.
+        :param params: Parameters for the call, or None.
+        :param request: Function that gets a dictionary with conditional headers, does the call and returns the
+        Response object.
+        :param fresh: If True, then a response without validators is not used from disk and not stored.
+        :return: Tuple with http status of the call and response body, status is None if Murcs was not asked.
+        """
+        entry, headers, hit = self.lookup(url, params, fresh)
+        if hit:
+            return None, entry[1]
+        r = request(headers)
+        return self.update(url, params, entry, r.status_code, r.headers, r.content, fresh)
+
+    def lookup(self, url, params, fresh=False):
+        """
+        This method is the first step of get: it reads the response from disk and decides if Murcs needs to be asked.
+        Use it with update if the call cannot be done in a function, e.g. in a coroutine.
+
+        :param url: Full url for the call.
+        :param params: Parameters for the call, or None.
+        :param fresh: If True, then a response without validators is not used from disk.
+        :return: Tuple with the response on disk (meta data dictionary and body, or None), conditional headers for the
+        call and True if the body on disk can be used without asking Murcs.
+        """
+        entry = self.load(url, params)
+        headers = {}
+        if entry is not None:
+            meta, body = entry
+            if meta["etag"]:
+                headers["If-None-Match"] = meta["etag"]
+            if meta["lastModified"]:
+                headers["If-Modified-Since"] = meta["lastModified"]
+            if not (headers or fresh) and time.time() - meta["storedAt"] < self.ttl \
+                    and meta["storedAt"] > self._last_write():
+                self._count("hits")
+                return entry, headers, True
+        return entry, headers, False
+
+    def update(self, url, params, entry, status, headers, content, fresh=False):
+        """
+        This method is the second step of get: it handles the reply of Murcs and stores a new response on disk.
+
+        :param url: Full url for the call.
+        :param params: Parameters for the call, or None.
+        :param entry: Response on disk, as returned by lookup.
+        :param status: http status of the call.
+        :param headers: Response headers.
+        :param content: Response body (bytes).
+        :param fresh: If True, then a response without validators is not stored.
+        :return: Tuple with http status of the call and response body, the body is from disk for a 304 reply.
+        """
+        if status == 304 and entry is not None:
+            self._count("revalidated")
+            return status, entry[1]
+        self._count("misses")
+        if status == 200 and not (fresh and headers.get("ETag") is None and headers.get("Last-Modified") is None):
+            self.store(url, params, headers, content)
+            self._count("stored")
+        return status, content
+
+    def _last_write(self):
+        # The time of the last write call is in the file, the modification time of the file can lag behind
+        # time.time() by a clock tick.
+        try:
+            with open(self.written) as fh:
+                return float(fh.read())
+        except (OSError, ValueError):
+            return 0
+
+    def invalidate(self):
+        """
+        This method registers a write call. Responses without validators that are stored before the write call are
+        not used anymore.
+
+        :return:
+        """
+        fd, tmpname = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as fh:
+            fh.write(repr(time.time()))
+        os.replace(tmpname, self.written)
+        return
+
+    def get_stats(self):
+        """
+        This method returns the disk cache counters. Hits are responses from disk without a call, revalidated are
+        responses from disk after a 304 reply.
+
+        :return: Dictionary with number of hits, revalidated responses, misses and stored responses.
+        """
+        with self.lock:
+            return dict(self.stats)
@@ -0,0 +1,198 @@
+"""
+This module knows the dependencies between Murcs write calls. For every add_*, remove_* and update_* method of MurcsRest
+it returns the objects that the call creates or removes (provides) and the objects that the call refers to (requires).
+Objects are (object type, objectId) tuples. The dependencies are used to send a batch of write calls in levels: calls in
+a level only depend on calls in earlier levels.
+"""
+
+import collections
+import inspect
+import logging
+from lib import my_env
+
+
+def softinst_id(softId, serverId, params):
+    """
+    This function calculates the software instance Id that is used by add_softInst_calc.
+
+    :param softId: ID of the Software
+    :param serverId: ID of the Server.
+    :param params: Additional attributes for add_softInst_calc, softInstId and instSubType are used.
+    :return: softwareInstanceId
+    """
+    if 'vpc' == serverId[:len('vpc')]:
+        serverId = 'VPC' + serverId[len('vpc'):]
+    if "softInstId" in params:
+        return params["softInstId"]
+    if "instSubType" in params:
+        return "{schema} {softId} {serverId}".format(softId=softId, serverId=serverId, schema=params["instSubType"])
+    return "{softId} {serverId}".format(softId=softId, serverId=serverId)
+
+
+def _ref(payload, attrib, key):
+    """
+    This function returns the ID of an object that is referenced in a payload, e.g. payload["site"]["siteId"].
+
+    :param payload: Payload dictionary.
+    :param attrib: Name of the reference in the payload.
+    :param key: Name of the ID in the reference.
+    :return: ID or None
+    """
+    try:
+        return payload[attrib][key]
+    except (KeyError, TypeError):
+        return None
+
+
+"""
+Per write method a function that gets the call arguments by name and returns a tuple with the list of provided objects
+and the list of required objects.
+"""
+rules = dict(
+    add_person=lambda a: ([("person", a["email"])], []),
+    add_server=lambda a: ([("server", a["serverId"])],
+                          [("site", _ref(a["payload"], "site", "siteId")),
+                           ("server", _ref(a["payload"], "parentServer", "serverId"))]),
+    add_server_contact=lambda a: ([], [("server", a["serverId"]), ("person", a["personId"])]),
+    add_server_property=lambda a: ([], [("server", a["serverId"])]),
+    add_serverNetIface=lambda a: ([("iface", (a["serverId"], a["ifaceId"]))], [("server", a["serverId"])]),
+    add_serverNetIfaceIp=lambda a: ([], [("iface", (a["serverId"], a["ifaceId"]))]),
+    add_site=lambda a: ([("site", a["siteId"])], []),
+    add_soft=lambda a: ([("software", a["softId"])], []),
+    add_software_from_sol=lambda a: ([("software", "{solId} software".format(solId=a["sol_rec"]["solId"]))], []),
+    add_softInst=lambda a: ([("softInst", a["softInstId"])],
+                            [("server", _ref(a["payload"], "server", "serverId")),
+                             ("software", _ref(a["payload"], "software", "softwareId"))]),
+    add_softInst_calc=lambda a: ([("softInst", softinst_id(a["softId"], a["serverId"], a["params"]))],
+                                 [("server", a["serverId"]), ("software", a["softId"])]),
+    add_softInst_property=lambda a: ([], [("softInst", a["inst_rec"]["instId"])]),
+    add_sol=lambda a: ([("solution", a["solId"])], []),
+    add_solComp_property=lambda a: ([], [("solInst", a["solcomp_rec"]["solInstId"])]),
+    add_solInst=lambda a: ([("solInst", a["solInstId"])], [("solution", a["solId"])]),
+    add_solInstComp=lambda a: ([("solInstComp", a["solInstId"] + " " + a["softInstId"])],
+                               [("solInst", a["solInstId"]), ("softInst", a["softInstId"])]),
+    add_solToSol=lambda a: ([("solToSol", a["solToSolId"])],
+                            [("solution", a["fromSolId"]), ("solution", a["toSolId"])]),
+    add_solutionComponent=lambda a: ([("solInst", my_env.get_solinstid(a["sol_rec"]["solId"], a["env"]))],
+                                     [("solution", a["sol_rec"]["solId"])]),
+    add_solutionInstance=lambda a: ([("solInst", "{solId} solInstance".format(solId=a["sol_rec"]["solId"]))],
+                                    [("solution", a["sol_rec"]["solId"])]),
+    add_solution_contact=lambda a: ([], [("solution", a["solId"]), ("person", a["personId"])]),
+    add_solution_property=lambda a: ([], [("solution", a["solId"])]),
+    remove_person=lambda a: ([("person", a["email"])], []),
+    remove_server=lambda a: ([("server", a["serverId"])], []),
+    remove_server_property=lambda a: ([], [("server", a["serverId"])]),
+    remove_serverNetIface=lambda a: ([("iface", (a["serverId"], a["ifaceId"]))], [("server", a["serverId"])]),
+    remove_serverNetIfaceIp=lambda a: ([], [("iface", (a["serverId"], a["ifaceId"]))]),
+    remove_software=lambda a: ([("software", a["softwareId"])], []),
+    remove_softInst=lambda a: ([("softInst", a["softInstId"])],
+                               [("server", a["serverId"]), ("software", a["softId"])]),
+    remove_softInst_property=lambda a: ([], [("softInst", a["inst_rec"]["instId"])]),
+    remove_solComp_contact=lambda a: ([], [("solInst", a["solInstId"]), ("person", a["personId"])]),
+    remove_solComp_property=lambda a: ([], [("solInst", a["solcomp_rec"]["solInstId"])]),
+    remove_solInstComp=lambda a: ([("solInstComp", a["solInstId"] + " " + a["softInstId"])],
+                                  [("solInst", a["solInstId"]), ("softInst", a["softInstId"])]),
+    remove_solToSol=lambda a: ([("solToSol", a["solToSolId"])],
+                               [("solution", a["fromSolId"]), ("solution", a["toSolId"])]),
+    remove_solutionInstance=lambda a: ([("solInst", a["solInstId"])], [("solution", a["solId"])]),
+    remove_solution_contact=lambda a: ([], [("solution", a["solId"]), ("person", a["personId"])]),
+    remove_solution_property=lambda a: ([], [("solution", a["solId"])]),
+    update_solution_component=lambda a: ([], [("solInst", a["solcomp_rec"]["solInstId"])])
+)
+
+
+def get_dependencies(name, func, args, kwargs):
+    """
+    This function returns the objects that are provided and required by a write call.
+
+    :param name: Name of the MurcsRest method.
+    :param func: MurcsRest method.
+    :param args: Positional arguments of the call.
+    :param kwargs: Keyword arguments of the call.
+    :return: Tuple with set of provided objects and set of required objects.
+    """
+    try:
+        rule = rules[name]
+    except KeyError:
+        logging.warning("No dependencies known for {n}, call is sent in the first level.".format(n=name))
+        return set(), set()
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    provides, requires = rule(bound.arguments)
+    return set(provides), set(obj for obj in requires if obj[1] is not None)
+
+
+def get_levels(depends_on):
+    """
+    This function calculates the level for every call. A call that does not depend on other calls is in level 0,
+    else the level is one more than the highest level of the calls it depends on. The levels are calculated without
+    recursion (Kahn's algorithm), so long dependency chains are no problem. If calls are left that wait on each other,
+    then a dependency cycle is reported and the first of these calls is put in the level after its known dependencies.
+
+    :param depends_on: List with for every call the set of indexes of the calls that need to go first.
+    :return: List with the level of every call.
+    """
+    levels = [0] * len(depends_on)
+    waiting = [len(deps - {idx}) for idx, deps in enumerate(depends_on)]
+    dependents = [[] for _ in depends_on]
+    for idx, deps in enumerate(depends_on):
+        for dep in deps - {idx}:
+            dependents[dep].append(idx)
+    ready = collections.deque(idx for idx, cnt in enumerate(waiting) if cnt == 0)
+    done = [False] * len(depends_on)
+    todo = len(depends_on)
+    while todo:
+        if not ready:
+            # Calls in or behind a dependency cycle are left.
+            idx = min(idx for idx in range(len(depends_on)) if not done[idx])
+            logging.warning("Dependency cycle for call {i}".format(i=idx))
+            levels[idx] = 1 + max([levels[dep] for dep in depends_on[idx] if done[dep]], default=-1)
+            waiting[idx] = 0
+            ready.append(idx)
+        idx = ready.popleft()
+        done[idx] = True
+        todo -= 1
+        for other in dependents[idx]:
+            if done[other]:
+                continue
+            levels[other] = max(levels[other], levels[idx] + 1)
+            waiting[other] -= 1
+            if waiting[other] == 0:
+                ready.append(other)
+    return levels
+
+
+def plan(calls):
+    """
+    This function calculates the order of a list of write calls. Remove calls go first, in reverse dependency order:
+    a call that refers to an object goes before the removal of the object. Then add and update calls follow in
+    dependency order: the call that creates an object goes before the calls that refer to the object. Objects that are
+    not created or removed in the list of calls are supposed to be available.
+
+    :param calls: List of (name, func, args, kwargs) tuples.
+    :return: Tuple with the list of levels, each level is a list of call indexes, and the list with for every call the
+    set of indexes of the calls that need to go first.
+    """
+    deps = [get_dependencies(*call[:4]) for call in calls]
+    removes = [idx for idx, call in enumerate(calls) if call[0].startswith("remove_")]
+    others = [idx for idx, call in enumerate(calls) if not call[0].startswith("remove_")]
+    depends_on = [set() for _ in calls]
+    # Remove calls: the removal of an object waits for the removal of the calls that refer to it.
+    for idx in removes:
+        provides = deps[idx][0]
+        depends_on[idx] = set(other for other in removes if other != idx and deps[other][1] & provides)
+    # Add and update calls: a call waits for the calls that create the objects it refers to.
+    provider = {}
+    for idx in others:
+        for obj in deps[idx][0]:
+            provider.setdefault(obj, idx)
+    for idx in others:
+        depends_on[idx] = set(provider[obj] for obj in deps[idx][1] if obj in provider and provider[obj] != idx)
+    levels = get_levels(depends_on)
+    res = []
+    for group, offset in [(removes, 0), (others, max([levels[idx] for idx in removes], default=-1) + 1)]:
+        for idx in group:
+            while len(res) <= levels[idx] + offset:
+                res.append([])
+            res[levels[idx] + offset].append(idx)
+    return [level for level in res if level], depends_on
@@ -0,0 +1,189 @@
+"""
+This module offers a writer that only sends Murcs objects that differ from the local snapshot. Every payload is compared
+with the matching row in the sqlite snapshot. Only attributes that are columns of the snapshot table are compared,
+attributes in the excluded lists of lib.murcs are not compared.
+"""
+
+import logging
+from lib.murcs import excludedprops, srv_excluded, srv_prop2dict, softInst_prop2dict, solInst_prop2dict
+from lib.murcsrest import MurcsBatch
+
+
+class DiffWriter:
+    """
+    This class has the add_* methods of MurcsRest for objects that are in the snapshot. A call is sent to the target
+    only if the object is new or if an attribute in the payload differs from the snapshot. Attributes that are not in
+    the payload or not in the snapshot table are not compared. Other calls are sent to the target as they are.
+    The snapshot rows are updated with the payload after the call succeeded, so an object is not sent twice in a run
+    and a failed call is sent again the next time.
+    The target can be a MurcsRest object or a batch:
+
+        with r.batch() as batch:
+            writer = DiffWriter(batch, lcl)
+            writer.add_server(serverId, payload)
+        writer.log_summary()
+    """
+
+    def __init__(self, target, lcl):
+        """
+        :param target: MurcsRest or MurcsBatch object to send the calls.
+        :param lcl: sqliteUtils object for the snapshot.
+        """
+        self.target = target
+        self.lcl = lcl
+        self.snapshot = {}
+        self.columns = {}
+        self.summary = {}
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+    def add_person(self, email, payload):
+        return self._write("add_person", "person", dict(email=email), payload, excludedprops, {}, email, payload)
+
+    def add_server(self, serverId, payload):
+        return self._write("add_server", "server", dict(serverId=serverId), payload, srv_excluded, srv_prop2dict,
+                           serverId, payload)
+
+    def add_server_property(self, serverId, payload):
+        key = dict(serverId=serverId, propertyName=payload["propertyName"])
+        return self._write("add_server_property", "serverproperty", key, payload, excludedprops, {},
+                           serverId, payload)
+
+    def add_site(self, siteId, payload):
+        return self._write("add_site", "site", dict(siteId=siteId), payload, excludedprops, {}, siteId, payload)
+
+    def add_soft(self, softId, payload):
+        return self._write("add_soft", "software", dict(softwareId=softId), payload, excludedprops, {},
+                           softId, payload)
+
+    def add_softInst(self, softInstId, payload):
+        return self._write("add_softInst", "softinst", dict(softwareInstanceId=softInstId), payload, excludedprops,
+                           softInst_prop2dict, softInstId, payload)
+
+    def add_sol(self, solId, payload):
+        return self._write("add_sol", "solution", dict(solutionId=solId), payload, excludedprops, {}, solId, payload)
+
+    def add_solInst(self, solId, solInstId, payload):
+        return self._write("add_solInst", "solinst", dict(solutionInstanceId=solInstId), payload, excludedprops,
+                           solInst_prop2dict, solId, solInstId, payload)
+
+    def add_solution_property(self, solId, payload):
+        key = dict(solutionId=solId, propertyName=payload["propertyName"])
+        return self._write("add_solution_property", "solutionproperty", key, payload, excludedprops, {},
+                           solId, payload)
+
+    def get_rows(self, tablename, keycols):
+        """
+        This method returns the snapshot rows of a table, indexed on the key columns. The table is read on first
+        use.
+
+        :param tablename: Name of the table.
+        :param keycols: Tuple with the names of the key columns.
+        :return: Dictionary with tuple of key values as key and row dictionary as value.
+        """
+        try:
+            return self.snapshot[(tablename, keycols)]
+        except KeyError:
+            rows = {}
+            self.columns[tablename] = self.lcl.get_columns(tablename)
+            for row in self.lcl.get_query("SELECT * FROM {t}".format(t=tablename)):
+                row = dict(row)
+                rows[tuple(_norm(row[k]) for k in keycols)] = row
+            self.snapshot[(tablename, keycols)] = rows
+            logging.debug("{cnt} rows from {t} in snapshot".format(cnt=len(rows), t=tablename))
+            return rows
+
+    def _write(self, name, tablename, key, payload, excluded, prop2dict, *args):
+        """
+        Internal method to compare the payload with the snapshot and to send the call if required.
+
+        :param name: Name of the add_* method.
+        :param tablename: Snapshot table for the object.
+        :param key: Dictionary with the key columns and values of the object.
+        :param payload: Payload for the call.
+        :param excluded: List of attributes that are not compared.
+        :param prop2dict: Translation from table attribute to payload dictionary item, see lib.murcs.
+        :param args: Arguments for the add_* method.
+        :return: Result of the call, or None if the call is skipped.
+        """
+        rows = self.get_rows(tablename, tuple(key.keys()))
+        row = rows.get(tuple(_norm(v) for v in key.values()))
+        columns = self.columns[tablename]
+        attribs = {attrib: value for attrib, value in flatten(payload, prop2dict).items() if attrib in columns}
+        if row is None:
+            status = "new"
+        else:
+            changed = [attrib for attrib in attribs
+                       if attrib not in excluded and _norm(attribs[attrib]) != _norm(row.get(attrib))]
+            status = "changed" if changed else "skipped"
+            if changed:
+                logging.debug("{n} {k} changed: {c}".format(n=name, k=list(key.values()), c=", ".join(changed)))
+        counts = self.summary.setdefault(name, dict(new=0, changed=0, skipped=0))
+        counts[status] += 1
+        if status == "skipped":
+            return None
+        res = getattr(self.target, name)(*args)
+
+        def remember():
+            # Remember the payload, so the same object is not sent again in this run.
+            if row is None:
+                rows[tuple(_norm(v) for v in key.values())] = dict(key, **attribs)
+            else:
+                row.update(attribs)
+        if isinstance(self.target, MurcsBatch):
+            # The call is only queued, the batch calls remember when the call is sent without error.
+            self.target.after(remember)
+        else:
+            remember()
+        return res
+
+    def get_summary(self):
+        """
+        This method returns the number of new, changed and skipped objects per add_* method.
+
+        :return: Dictionary with add_* method as key and dictionary with new, changed and skipped counts as value.
+        """
+        return self.summary
+
+    def log_summary(self):
+        """
+        This method writes the number of new, changed and skipped objects per add_* method to the log.
+
+        :return:
+        """
+        for name, counts in sorted(self.summary.items()):
+            logging.info("{n}: {new} new, {changed} changed, {skipped} skipped".format(n=name, **counts))
+        return
+
+
+def flatten(payload, prop2dict):
+    """
+    This function translates a payload into table attributes. Dictionary items in the payload (e.g. site) are replaced
+    by the table attribute (e.g. siteId) according to prop2dict.
+
+    :param payload: Payload dictionary.
+    :param prop2dict: Translation from table attribute to payload dictionary item, see lib.murcs.
+    :return: Dictionary with table attributes.
+    """
+    attribs = dict(payload)
+    for attrib, (item, key) in prop2dict.items():
+        if item in attribs:
+            value = attribs.pop(item)
+            attribs[attrib] = value.get(key) if isinstance(value, dict) else value
+    return attribs
+
+
+def _norm(value):
+    """
+    This function normalizes a value for comparison: sqlite returns integers for numeric and boolean columns, payloads
+    may have strings or booleans.
+
+    :param value: Value from payload or snapshot.
+    :return: None or string.
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return str(int(value))
+    return str(value)
@@ -0,0 +1,123 @@
+"""
+This module implements a write-ahead journal for Murcs write calls. The journal is an append-only file with a json
+record per line. A call is written to the journal before it is sent, the result is added when the call is done. The
+calls that are not done can be sent again after an interruption.
+"""
+
+import datetime
+import json
+import logging
+import os
+import threading
+
+
+class Journal:
+    """
+    This class handles the journal file. Journal records are:
+
+        {"entry": 1, "state": "queued", "operation": "add_server", "args": [...], "kwargs": {...}, "at": "..."}
+        {"entry": 1, "state": "done", "status": 200, "at": "..."}
+        {"entry": 1, "state": "failed", "status": 503, "error": "...", "at": "..."}
+
+    An entry is outstanding if it has no done record.
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: Full path of the journal file. The file is created if it does not exist.
+        """
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.done = set()
+        if os.path.isfile(filename):
+            self._load()
+        self.fh = open(filename, "a", encoding="utf-8")
+
+    def _load(self):
+        """
+        Internal method to read the journal. A partial last line, from a run that was killed while writing, is ignored.
+
+        :return:
+        """
+        with open(self.filename, encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    logging.warning("Journal {f}: line ignored: {l}".format(f=self.filename, l=line.strip()))
+                    continue
+                if rec["state"] == "queued":
+                    self.entries[rec["entry"]] = rec
+                elif rec["state"] == "done":
+                    self.done.add(rec["entry"])
+        logging.info("Journal {f}: {e} entries, {d} done".format(f=self.filename, e=len(self.entries), d=len(self.done)))
+        return
+
+    def _write(self, records):
+        """
+        Internal method to append records to the journal. The records are on disk when the method returns.
+
+        :param records: List of dictionaries.
+        :return:
+        """
+        at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self.lock:
+            for rec in records:
+                rec["at"] = at
+                self.fh.write(json.dumps(rec) + "\n")
+            self.fh.flush()
+            os.fsync(self.fh.fileno())
+        return
+
+    def append(self, calls):
+        """
+        This method adds calls to the journal.
+
+        :param calls: List of (operation, args, kwargs) tuples.
+        :return: List of entry numbers, one for each call.
+        """
+        with self.lock:
+            first = max(self.entries, default=0) + 1
+            records = [dict(entry=first + cnt, state="queued", operation=name, args=list(args), kwargs=kwargs)
+                       for cnt, (name, args, kwargs) in enumerate(calls)]
+            for rec in records:
+                self.entries[rec["entry"]] = rec
+        self._write(records)
+        return [rec["entry"] for rec in records]
+
+    def mark(self, entry, status, error=None):
+        """
+        This method adds the result of a call to the journal.
+
+        :param entry: Entry number of the call.
+        :param status: http status of the call.
+        :param error: Error message or response body if the call failed.
+        :return:
+        """
+        if error is None:
+            self._write([dict(entry=entry, state="done", status=status)])
+            with self.lock:
+                self.done.add(entry)
+        else:
+            self._write([dict(entry=entry, state="failed", status=status, error=error)])
+        return
+
+    def outstanding(self):
+        """
+        This method returns the calls in the journal that are not done, in journal order.
+
+        :return: List of (entry, operation, args, kwargs) tuples.
+        """
+        with self.lock:
+            return [(entry, rec["operation"], rec["args"], rec["kwargs"])
+                    for entry, rec in sorted(self.entries.items()) if entry not in self.done]
+
+    def close(self):
+        """
+        This method closes the journal file.
+
+        :return:
+        """
+        self.fh.close()
+        return
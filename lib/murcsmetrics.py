@@ -0,0 +1,302 @@
+"""
+This module collects performance information for the Murcs Rest calls. Every call is registered with endpoint template,
+method, status, latency, response size and number of retries. Hedged calls and calls that exceed their deadline are
+counted as well. At the end of a run the information can be written as a json report and as a Prometheus textfile.
+"""
+
+import bisect
+import json
+import logging
+import math
+import os
+import threading
+from collections import deque
+
+# Path segments that are part of the Murcs Rest API. All other segments are object IDs and are replaced by {id}.
+vocabulary = ["all", "contactPersons", "persons", "properties", "servers", "serverNetworkInterfaces",
+              "serverNetworkInterfacesIpAddress", "sites", "software", "softwareInstances", "solutionInstanceComponents",
+              "solutionInstances", "solutions", "solutionToSolution", "version"]
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+bytes_buckets = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    """
+    This class counts observations in cumulative buckets, as a Prometheus histogram. The last observations are kept
+    as well, to calculate percentiles for the json report and for hedging. Memory use does not depend on the number of
+    observations.
+    """
+
+    def __init__(self, buckets, window=1000):
+        """
+        :param buckets: Upper bounds of the buckets, in increasing order.
+        :param window: Number of observations that are kept to calculate percentiles.
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.values = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.values.append(value)
+        self.count += 1
+        self.sum += value
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, pct):
+        """
+        This method returns the percentile of the last observations, nearest-rank method.
+
+        :param pct: Percentile, between 0 and 100.
+        :return: Value for the percentile, None if there are no observations.
+        """
+        if not self.values:
+            return None
+        values = sorted(self.values)
+        return values[max(0, int(math.ceil(pct / 100 * len(values))) - 1)]
+
+    def cumulative(self):
+        """
+        This method returns the cumulative count per bucket upper bound, the last bound is +Inf.
+
+        :return: List of (upper bound, count) tuples.
+        """
+        res = []
+        total = 0
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += count
+            res.append((bound, total))
+        return res
+
+
+class MurcsMetrics:
+    """
+    This class registers the Murcs Rest calls per endpoint template and method.
+    """
+
+    def __init__(self, url_loc, url_base, window=1000):
+        """
+        :param url_loc: Url for the Murcs Rest API.
+        :param url_base: Url for the Murcs Rest API of the client.
+        :param window: Number of calls per endpoint template and method that are kept to calculate percentiles.
+        """
+        self.url_loc = url_loc
+        self.url_base = url_base
+        self.window = window
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def endpoint(self, url):
+        """
+        This method translates a url into the endpoint template, e.g. servers/{id}/properties/{id}.
+
+        :param url: Full url of the call.
+        :return: Endpoint template.
+        """
+        path = url.split("?")[0]
+        for prefix in [self.url_base, self.url_loc]:
+            if path.startswith(prefix):
+                path = path[len(prefix):]
+                break
+        segments = [segment if segment in vocabulary else "{id}" for segment in path.strip("/").split("/")]
+        return "/".join(segments)
+
+    def _get_endpoint(self, method, url):
+        """
+        Internal method to return the counters for the endpoint template and method of a call. The lock must be held.
+
+        :param method: GET, PUT or DELETE
+        :param url: Full url of the call.
+        :return: Dictionary with the counters.
+        """
+        key = (self.endpoint(url), method)
+        try:
+            return self.endpoints[key]
+        except KeyError:
+            ep = dict(latency=Histogram(latency_buckets, self.window), size=Histogram(bytes_buckets, self.window),
+                      status={}, retries=0, hedged=0, hedge_wins=0, deadline_exceeded=0, percentiles={})
+            self.endpoints[key] = ep
+            return ep
+
+    def record(self, method, url, status, latency, size=0, retries=0):
+        """
+        This method registers a call.
+
+        :param method: GET, PUT or DELETE
+        :param url: Full url of the call.
+        :param status: http status of the response, or "error" if there is no response.
+        :param latency: Duration of the call in seconds, retries included.
+        :param size: Number of bytes in the response body.
+        :param retries: Number of retries for the call.
+        :return:
+        """
+        with self.lock:
+            ep = self._get_endpoint(method, url)
+            ep["latency"].observe(latency)
+            ep["size"].observe(size)
+            ep["status"][str(status)] = ep["status"].get(str(status), 0) + 1
+            ep["retries"] += retries
+        return
+
+    def record_hedge(self, method, url, won=False):
+        """
+        This method registers a hedged call: a second call that is sent because the first call is slow.
+
+        :param method: GET
+        :param url: Full url of the call.
+        :param won: True if the second call answered first.
+        :return:
+        """
+        with self.lock:
+            ep = self._get_endpoint(method, url)
+            if won:
+                ep["hedge_wins"] += 1
+            else:
+                ep["hedged"] += 1
+        return
+
+    def record_deadline(self, method, url):
+        """
+        This method registers a call that did not answer before its deadline.
+
+        :param method: GET, PUT or DELETE
+        :param url: Full url of the call.
+        :return:
+        """
+        with self.lock:
+            self._get_endpoint(method, url)["deadline_exceeded"] += 1
+        return
+
+    def get_percentile(self, method, url, pct, min_count=20):
+        """
+        This method returns a latency percentile of the last calls for the endpoint template and method of a call. The
+        percentile is calculated again when the number of calls has grown by 10%, or by a tenth of the window in a long
+        run, so the method can be used for every call.
+
+        :param method: GET, PUT or DELETE
+        :param url: Full url of the call.
+        :param pct: Percentile, between 0 and 100.
+        :param min_count: Minimum number of calls, None is returned for fewer calls.
+        :return: Latency in seconds, or None.
+        """
+        with self.lock:
+            ep = self.endpoints.get((self.endpoint(url), method))
+            count = ep["latency"].count if ep else 0
+            if count < min_count:
+                return None
+            calculated_at, value = ep["percentiles"].get(pct, (0, None))
+            if count >= calculated_at + min(calculated_at * 0.1, self.window / 10):
+                value = ep["latency"].percentile(pct)
+                ep["percentiles"][pct] = (count, value)
+            return value
+
+    def get_report(self):
+        """
+        This method returns a summary per endpoint template and method. Count, mean and maximum are for all calls, the
+        percentiles for the last calls (the window).
+
+        :return: List of dictionaries, one per endpoint template and method.
+        """
+        report = []
+        with self.lock:
+            for (endpoint, method), ep in sorted(self.endpoints.items()):
+                latency = ep["latency"]
+                count = latency.count
+                report.append(dict(
+                    endpoint=endpoint,
+                    method=method,
+                    count=count,
+                    status=dict(ep["status"]),
+                    retries=ep["retries"],
+                    hedged=ep["hedged"],
+                    hedge_wins=ep["hedge_wins"],
+                    deadline_exceeded=ep["deadline_exceeded"],
+                    latency_mean=latency.sum / count if count else None,
+                    latency_p50=latency.percentile(50),
+                    latency_p95=latency.percentile(95),
+                    latency_p99=latency.percentile(99),
+                    latency_max=latency.max,
+                    bytes_total=ep["size"].sum,
+                    bytes_p95=ep["size"].percentile(95)
+                ))
+        return report
+
+    def write_json(self, filename):
+        """
+        This method writes the summary per endpoint template and method to a json file.
+
+        :param filename: Full path of the json file.
+        :return:
+        """
+        _write_atomic(filename, json.dumps(self.get_report(), indent=2))
+        logging.info("Murcs call report written to {f}".format(f=filename))
+        return
+
+    def write_textfile(self, filename):
+        """
+        This method writes the metrics in Prometheus text format, for the node exporter textfile collector.
+
+        :param filename: Full path of the .prom file.
+        :return:
+        """
+        lines = []
+        with self.lock:
+            items = sorted(self.endpoints.items())
+            lines.append("# HELP murcs_requests_total Murcs Rest calls by endpoint, method and status.")
+            lines.append("# TYPE murcs_requests_total counter")
+            for (endpoint, method), ep in items:
+                for status, count in sorted(ep["status"].items()):
+                    lines.append('murcs_requests_total{{{l},status="{s}"}} {c}'
+                                 .format(l=_labels(endpoint, method), s=status, c=count))
+            lines.append("# HELP murcs_retries_total Retries of Murcs Rest calls by endpoint and method.")
+            lines.append("# TYPE murcs_retries_total counter")
+            for (endpoint, method), ep in items:
+                lines.append("murcs_retries_total{{{l}}} {c}".format(l=_labels(endpoint, method), c=ep["retries"]))
+            for name, field, help_text in [
+                ("murcs_hedged_total", "hedged", "Hedged Murcs Rest calls by endpoint and method."),
+                ("murcs_hedge_wins_total", "hedge_wins", "Hedged calls that answered first by endpoint and method."),
+                ("murcs_deadline_exceeded_total", "deadline_exceeded",
+                 "Murcs Rest calls that exceeded the deadline by endpoint and method.")
+            ]:
+                lines.append("# HELP {n} {h}".format(n=name, h=help_text))
+                lines.append("# TYPE {n} counter".format(n=name))
+                for (endpoint, method), ep in items:
+                    lines.append("{n}{{{l}}} {c}".format(n=name, l=_labels(endpoint, method), c=ep[field]))
+            for name, field, help_text in [
+                ("murcs_request_duration_seconds", "latency", "Duration of Murcs Rest calls."),
+                ("murcs_response_bytes", "size", "Size of Murcs Rest responses.")
+            ]:
+                lines.append("# HELP {n} {h}".format(n=name, h=help_text))
+                lines.append("# TYPE {n} histogram".format(n=name))
+                for (endpoint, method), ep in items:
+                    hist = ep[field]
+                    labels = _labels(endpoint, method)
+                    for bound, count in hist.cumulative():
+                        lines.append('{n}_bucket{{{l},le="{b}"}} {c}'.format(n=name, l=labels, b=bound, c=count))
+                    lines.append("{n}_sum{{{l}}} {s}".format(n=name, l=labels, s=hist.sum))
+                    lines.append("{n}_count{{{l}}} {c}".format(n=name, l=labels, c=hist.count))
+        _write_atomic(filename, "\n".join(lines) + "\n")
+        logging.info("Murcs metrics written to {f}".format(f=filename))
+        return
+
+
+def _labels(endpoint, method):
+    return 'endpoint="{e}",method="{m}"'.format(e=endpoint, m=method)
+
+
+def _write_atomic(filename, content):
+    """
+    This function writes a file under a temporary name and then renames it, so readers never see a partial file.
+
+    :param filename: Full path of the file.
+    :param content: String to write.
+    :return:
+    """
+    tmpname = "{f}.tmp".format(f=filename)
+    with open(tmpname, "w") as fh:
+        fh.write(content)
+    os.replace(tmpname, filename)
+    return
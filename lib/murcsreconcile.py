@@ -0,0 +1,175 @@
+"""
+This module reconciles Murcs with a desired state. The desired state is a list of servers, software instances and
+solution instance components. It is compared with the local snapshot on the natural keys, the add_* and remove_* calls
+that are required to get to the desired state are sent in a dependency ordered batch.
+"""
+
+import csv
+import json
+import logging
+import os
+from lib.murcs import excludedprops, srv_prop2dict, softInst_prop2dict
+from lib.murcsdiff import DiffWriter, _norm
+
+"""
+Object types in the desired state, with snapshot table and natural key.
+"""
+object_types = dict(
+    servers=dict(table="server", keycols=("serverId",)),
+    softinst=dict(table="softinst", keycols=("softwareInstanceId",)),
+    solinstcomp=dict(table="solinstcomp", keycols=("solutionInstanceId", "softwareInstanceId"))
+)
+
+
+def load_records(filename):
+    """
+    This function reads the records for an object type from a csv file (with header line) or from a json file with a
+    list of records. Empty values in a csv file are read as None.
+
+    :param filename: Full path of the file.
+    :return: List of dictionaries.
+    """
+    if os.path.splitext(filename)[1].lower() == ".json":
+        with open(filename, encoding="utf-8") as fh:
+            return json.load(fh)
+    with open(filename, newline="", encoding="utf-8") as fh:
+        return [{k: (v if v != "" else None) for k, v in row.items()} for row in csv.DictReader(fh)]
+
+
+def load_desired(filename):
+    """
+    This function reads a json file with the desired state: a dictionary with object type (servers, softinst,
+    solinstcomp) as key and list of records as value.
+
+    :param filename: Full path of the json file.
+    :return: Dictionary with object type as key and list of records as value.
+    """
+    with open(filename, encoding="utf-8") as fh:
+        desired = json.load(fh)
+    unknown = [objtype for objtype in desired if objtype not in object_types]
+    if unknown:
+        raise ValueError("Unknown object types in {f}: {u}".format(f=filename, u=", ".join(unknown)))
+    return desired
+
+
+def check_keys(desired):
+    """
+    This function checks that every record in the desired state has a value for the key columns of its object type.
+
+    :param desired: Dictionary with object type as key and list of records as value.
+    :return:
+    """
+    for objtype, records in desired.items():
+        keycols = object_types[objtype]["keycols"]
+        for cnt, record in enumerate(records):
+            missing = [k for k in keycols if record.get(k) is None]
+            if missing:
+                raise ValueError("Record {c} of {t} has no value for key column {k}: {r}"
+                                 .format(c=cnt + 1, t=objtype, k=", ".join(missing), r=record))
+    return
+
+
+def unflatten(record, prop2dict):
+    """
+    This function translates a record with table attributes into a payload. Table attributes (e.g. siteId) are
+    replaced by the dictionary item (e.g. site) according to prop2dict. Attributes that are maintained by Murcs are
+    removed.
+
+    :param record: Dictionary with table attributes.
+    :param prop2dict: Translation from table attribute to payload dictionary item, see lib.murcs.
+    :return: Payload dictionary.
+    """
+    payload = {k: v for k, v in record.items() if k not in excludedprops}
+    for attrib, (item, key) in prop2dict.items():
+        if attrib in payload:
+            value = payload.pop(attrib)
+            payload[item] = {key: value} if value is not None else None
+    return payload
+
+
+class Reconciler:
+    """
+    This class computes the calls to get from the snapshot to the desired state. Desired state and snapshot are indexed
+    on the natural keys (serverId, softwareInstanceId, solutionInstanceId + softwareInstanceId), so the comparison is
+    linear in the number of objects.
+    Objects that are in the desired state and not in the snapshot are added, objects that differ are sent again (see
+    DiffWriter). Objects that are in the snapshot and not in the desired state are removed, for the object types that
+    are in the desired state only and if remove is True.
+    """
+
+    def __init__(self, client, lcl, remove=True):
+        """
+        :param client: MurcsRest object.
+        :param lcl: sqliteUtils object for the snapshot.
+        :param remove: If False, then objects that are not in the desired state are not removed.
+        """
+        self.client = client
+        self.lcl = lcl
+        self.remove = remove
+        self.summary = {}
+
+    def plan(self, target, desired):
+        """
+        This method queues the calls to reconcile the desired state on the target. Key values of the desired state
+        and the snapshot are compared after normalization (see murcsdiff._norm). A record without a value for a key
+        column raises ValueError before any call is queued.
+
+        :param target: MurcsBatch (or MurcsRest) object that takes the add_* and remove_* calls.
+        :param desired: Dictionary with object type as key and list of records as value.
+        :return: Dictionary with number of new, changed, skipped and removed objects per object type.
+        """
+        check_keys(desired)
+        writer = DiffWriter(target, self.lcl)
+        for objtype in object_types:
+            if objtype not in desired:
+                continue
+            keycols = object_types[objtype]["keycols"]
+            snapshot = writer.get_rows(object_types[objtype]["table"], keycols)
+            wanted = {}
+            for record in desired[objtype]:
+                wanted[tuple(_norm(record[k]) for k in keycols)] = record
+            counts = dict(new=0, changed=0, skipped=0, removed=0)
+            for key, record in wanted.items():
+                if objtype == "servers":
+                    writer.add_server(record["serverId"], unflatten(record, srv_prop2dict))
+                elif objtype == "softinst":
+                    writer.add_softInst(record["softwareInstanceId"], unflatten(record, softInst_prop2dict))
+                elif key in snapshot:
+                    counts["skipped"] += 1
+                else:
+                    counts["new"] += 1
+                    target.add_solInstComp(record["solutionInstanceId"], record["softwareInstanceId"],
+                                           record["solutionId"], record["serverId"], record["softwareId"])
+            if self.remove:
+                for key in snapshot.keys() - wanted.keys():
+                    row = snapshot[key]
+                    counts["removed"] += 1
+                    if objtype == "servers":
+                        target.remove_server(row["serverId"])
+                    elif objtype == "softinst":
+                        target.remove_softInst(row["serverId"], row["softwareId"], row["softwareInstanceId"])
+                    else:
+                        target.remove_solInstComp(row["solutionInstanceId"], row["softwareInstanceId"],
+                                                  row["solutionId"], row["serverId"], row["softwareId"])
+            name = dict(servers="add_server", softinst="add_softInst").get(objtype)
+            if name in writer.get_summary():
+                counts.update(writer.get_summary()[name])
+            self.summary[objtype] = counts
+        for objtype, counts in self.summary.items():
+            logging.info("{t}: {new} new, {changed} changed, {skipped} skipped, {removed} removed"
+                         .format(t=objtype, **counts))
+        return self.summary
+
+    def run(self, desired, workers=None, dry_run=False, journal=None):
+        """
+        This method reconciles Murcs with the desired state. Calls are sent concurrently in dependency order.
+
+        :param desired: Dictionary with object type as key and list of records as value.
+        :param workers: Number of threads to send the calls, default max_workers of the client.
+        :param dry_run: If True, then the calls are logged and written to the journal, but not sent.
+        :param journal: Optional murcsjournal.Journal object.
+        :return: Report of the batch, one item per call.
+        """
+        with self.client.batch(workers, ordered=True, journal=journal, dry_run=dry_run) as batch:
+            self.plan(batch, desired)
+        return batch.report
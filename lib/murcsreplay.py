@@ -0,0 +1,248 @@
+"""
+This module records the Murcs Rest traffic of a run and replays it offline. The recording is a json file with a record
+per call (method, path, request body, status, headers, response body and latency), gzip compressed if the file name
+ends with .gz. Sensitive attributes can be replaced by pseudonyms before they are written.
+Set MURCS_RECORD to record a run, set MURCS_REPLAY to answer the calls from a recording instead of Murcs.
+MURCS_REPLAY_SPEED sets the timing: 1 replays with the recorded latency, 10 is ten times faster, 0 has no delay.
+"""
+
+import collections
+import gzip
+import hashlib
+import json
+import logging
+import threading
+import time
+import requests
+from requests.adapters import BaseAdapter
+from urllib.parse import urlsplit
+
+# Headers that are kept in the recording.
+recorded_headers = ["Content-Type", "ETag", "Last-Modified"]
+# Attributes with personal or infrastructure information, replaced by the Anonymizer.
+sensitive_keys = ["email", "firstName", "lastName", "hostName", "fqdn", "ipAddress", "macAddress"]
+# Url path segments with a sensitive attribute as ID: the segment after persons or contactPersons is an email.
+sensitive_paths = dict(persons="email", contactPersons="email")
+
+
+def _open(filename, mode):
+    if filename.endswith(".gz"):
+        return gzip.open(filename, mode + "t", encoding="utf-8")
+    return open(filename, mode, encoding="utf-8")
+
+
+def _path(url):
+    """
+    This function returns the path and query of a url, so a recording can be replayed on another host.
+
+    :param url: Full url.
+    :return: Path with query string.
+    """
+    parts = urlsplit(url)
+    return parts.path + ("?" + parts.query if parts.query else "")
+
+
+class Anonymizer:
+    """
+    This class replaces the values of sensitive attributes by pseudonyms. The same value always gets the same
+    pseudonym, also in url paths, so a recording stays consistent. Object IDs (serverId, solutionId, ...) are not
+    replaced, they link the calls of the recording.
+    """
+
+    def __init__(self, keys=None, paths=None, salt=""):
+        """
+        :param keys: List of attribute names to replace, default sensitive_keys.
+        :param paths: Dictionary with path segment as key and attribute name of the next segment as value, default
+        sensitive_paths.
+        :param salt: Salt for the pseudonyms, use a secret salt if pseudonyms should not be reversible by guessing.
+        """
+        self.keys = set(keys or sensitive_keys)
+        self.paths = paths or sensitive_paths
+        self.salt = salt
+
+    def pseudonym(self, key, value):
+        """
+        This method returns the pseudonym for a value.
+
+        :param key: Attribute name, used as prefix for the pseudonym.
+        :param value: Original value.
+        :return: Pseudonym.
+        """
+        digest = hashlib.sha1("{s}{v}".format(s=self.salt, v=value).encode("utf-8")).hexdigest()[:12]
+        return "{k}-{d}".format(k=key, d=digest)
+
+    def anonymize(self, value):
+        """
+        This method replaces the sensitive attributes in a parsed json value.
+
+        :param value: Parsed json value.
+        :return: Parsed json value with pseudonyms.
+        """
+        if isinstance(value, dict):
+            return {k: (self.pseudonym(k, v) if k in self.keys and v is not None else self.anonymize(v))
+                    for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.anonymize(v) for v in value]
+        return value
+
+    def __call__(self, rec):
+        """
+        This method anonymizes a recorded call: response body, request body and url path.
+
+        :param rec: Recorded call.
+        :return: Anonymized recorded call.
+        """
+        for attrib in ["body", "requestBody"]:
+            try:
+                rec[attrib] = json.dumps(self.anonymize(json.loads(rec[attrib])))
+            except (TypeError, ValueError):
+                pass
+        path, _, query = rec["path"].partition("?")
+        segments = path.split("/")
+        for cnt in range(1, len(segments)):
+            if segments[cnt - 1] in self.paths:
+                segments[cnt] = self.pseudonym(self.paths[segments[cnt - 1]], requests.utils.unquote(segments[cnt]))
+        rec["path"] = "/".join(segments) + ("?" + query if query else "")
+        return rec
+
+
+class Recorder:
+    """
+    This class writes every response of a session to the recording. Use it as a response hook:
+
+        session.hooks["response"].append(Recorder(filename))
+    """
+
+    def __init__(self, filename, anonymize=None):
+        """
+        :param filename: Full path of the recording. The file is replaced.
+        :param anonymize: Optional function that gets a recorded call (dictionary) and returns the call to write, see
+        Anonymizer.
+        """
+        self.filename = filename
+        self.anonymize = anonymize
+        self.lock = threading.Lock()
+        self.fh = _open(filename, "w")
+        self.cnt = 0
+
+    def __call__(self, r, *args, **kwargs):
+        self.record(r.request.method, r.request.url, r.request.body, r.status_code, r.headers, r.content,
+                    r.elapsed.total_seconds())
+        return r
+
+    def record(self, method, url, request_body, status, headers, content, latency):
+        """
+        This method writes a call to the recording. It is used by the response hook and by clients without requests
+        session.
+
+        :param method: GET, PUT or DELETE
+        :param url: Full url of the call, with query string.
+        :param request_body: Request body (string or bytes), or None.
+        :param status: http status of the response.
+        :param headers: Response headers.
+        :param content: Response body (bytes).
+        :param latency: Duration of the call in seconds.
+        :return:
+        """
+        if isinstance(request_body, bytes):
+            request_body = request_body.decode("utf-8")
+        rec = dict(
+            method=method,
+            path=_path(url),
+            requestBody=request_body,
+            status=status,
+            headers={k: headers[k] for k in recorded_headers if k in headers},
+            body=content.decode("utf-8"),
+            latency=latency
+        )
+        if self.anonymize:
+            rec = self.anonymize(rec)
+        with self.lock:
+            self.fh.write(json.dumps(rec) + "\n")
+            self.cnt += 1
+        return
+
+    def close(self):
+        """
+        This method closes the recording.
+
+        :return:
+        """
+        with self.lock:
+            self.fh.close()
+        logging.info("{cnt} calls recorded in {f}".format(cnt=self.cnt, f=self.filename))
+        return
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    This class is a transport adapter for a requests session that answers calls from a recording. Calls are matched on
+    method, path with query string and request body. If the same call is recorded more than once, then the responses
+    are returned in recorded order and the last response is repeated. A call that is not in the recording gets a 404.
+    """
+
+    def __init__(self, filename, speed=1.0):
+        """
+        :param filename: Full path of the recording.
+        :param speed: Replay speed: 1 for recorded latency, 10 for ten times faster, 0 for no delay.
+        """
+        super().__init__()
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.calls = collections.defaultdict(collections.deque)
+        self.stats = dict(replayed=0, missing=0)
+        with _open(filename, "r") as fh:
+            for line in fh:
+                rec = json.loads(line)
+                self.calls[(rec["method"], rec["path"], rec["requestBody"])].append(rec)
+        logging.info("{cnt} calls in recording {f}".format(cnt=sum(len(q) for q in self.calls.values()), f=filename))
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        rec = self.lookup(request.method, request.url, request.body)
+        if self.speed > 0:
+            time.sleep(rec["latency"] / self.speed)
+        r = requests.Response()
+        r.status_code = rec["status"]
+        r.headers = requests.structures.CaseInsensitiveDict(rec["headers"])
+        r._content = rec["body"].encode("utf-8")
+        r.encoding = "utf-8"
+        r.url = request.url
+        r.request = request
+        r.connection = self
+        return r
+
+    def lookup(self, method, url, request_body):
+        """
+        This method returns the recorded response for a call. It is used by send and by clients without requests
+        session, the caller waits for the recorded latency.
+
+        :param method: GET, PUT or DELETE
+        :param url: Full url of the call, with query string.
+        :param request_body: Request body (string or bytes), or None.
+        :return: Recorded call with status, headers, body and latency. A 404 reply if the call is not in the recording.
+        """
+        if isinstance(request_body, bytes):
+            request_body = request_body.decode("utf-8")
+        key = (method, _path(url), request_body)
+        with self.lock:
+            queue = self.calls.get(key)
+            if queue:
+                rec = queue.popleft() if len(queue) > 1 else queue[0]
+                self.stats["replayed"] += 1
+            else:
+                rec = dict(status=404, headers={}, body=json.dumps(dict(message="Not in recording")), latency=0)
+                self.stats["missing"] += 1
+                logging.warning("Replay: {m} {p} not in recording".format(m=method, p=key[1]))
+        return rec
+
+    def close(self):
+        pass
+
+    def get_stats(self):
+        """
+        This method returns the number of replayed calls and the number of calls that were not in the recording.
+
+        :return: Dictionary with replayed and missing counters.
+        """
+        with self.lock:
+            return dict(self.stats)
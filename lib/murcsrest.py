@@ -1,21 +1,357 @@
 """
 This module consolidates the Murcs Rest Calls
 """
+import atexit
+import concurrent.futures
+import itertools
 import logging
 import os
 import requests
 import json
+import threading
+import time
 from lib import my_env
+from lib import murcsdeps
+from lib.murcscache import MurcsCache, MurcsDiskCache
+from lib.murcsmetrics import MurcsMetrics
+from lib.murcsreplay import Anonymizer, Recorder, ReplayAdapter
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+# Status codes for which a Rest call is retried.
+retry_status = (500, 502, 503, 504)
+# Status codes that show that Murcs is overloaded.
+overload_status = retry_status + (429,)
 
-class MurcsRest:
+
+class DeadlineExceeded(requests.Timeout):
+    """
+    This exception is raised for a Rest call that did not answer before its deadline or before the end of the run
+    budget.
+    """
+
+
+class AdaptiveLimiter:
+    """
+    This class limits the number of Rest calls in flight. The limit is adjusted AIMD-style on the outcome of the calls.
+    A call that succeeds in time increases the limit by 1/limit, so the limit goes up by one for every limit calls
+    (additive increase). A failure halves the limit, a call that is slow reduces the limit by 10% (multiplicative
+    decrease). A call is slow if the average latency of its endpoint is more than latency_factor times the lowest
+    latency of the endpoint, so a slow endpoint is not compared with a fast one. Calls that were in flight together
+    cause one decrease only. The limit stays between 1 and the ceiling.
+    """
+
+    def __init__(self, initial, ceiling, latency_factor=3.0):
+        """
+        :param initial: Number of calls in flight at start.
+        :param ceiling: Maximum number of calls in flight.
+        :param latency_factor: Calls are slow if the average latency is above latency_factor * lowest latency.
+        """
+        self.ceiling = max(1, ceiling)
+        self.limit = float(min(max(1, initial), self.ceiling))
+        self.latency_factor = latency_factor
+        self.inflight = 0
+        # Lowest latency and average latency per endpoint.
+        self.latencies = {}
+        self.decreased_at = 0.0
+        self.counter = dict(calls=0, failures=0, slow=0, increases=0, decreases=0)
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        """
+        This method waits until a call can be launched within the limit.
+
+        :return: Start time of the call.
+        """
+        with self.cond:
+            while self.inflight >= int(self.limit):
+                self.cond.wait()
+            self.inflight += 1
+        return time.monotonic()
+
+    def release(self, started, failed=False, endpoint=None):
+        """
+        This method registers the end of a call and adjusts the limit.
+
+        :param started: Start time of the call, as returned by acquire.
+        :param failed: True if Murcs failed or was overloaded for the call.
+        :param endpoint: Endpoint of the call, e.g. ("servers/{id}", "GET"). Latencies are compared per endpoint.
+        :return:
+        """
+        with self.cond:
+            self.inflight -= 1
+            self._adjust(started, time.monotonic(), failed, endpoint)
+            self.cond.notify_all()
+
+    def _adjust(self, started, ended, failed, endpoint=None):
+        """
+        Internal method to calculate the new limit for the outcome of a call.
+
+        :param started: Start time of the call.
+        :param ended: End time of the call.
+        :param failed: True if the call failed.
+        :param endpoint: Endpoint of the call.
+        :return:
+        """
+        latency = ended - started
+        old = int(self.limit)
+        self.counter["calls"] += 1
+        factor = None
+        baseline = ewma = latency
+        if failed:
+            self.counter["failures"] += 1
+            reason = "failure"
+            factor = 0.5
+        else:
+            # The lowest latency is allowed to go up slowly, so the limiter follows a change in Murcs response times.
+            if endpoint in self.latencies:
+                baseline, ewma = self.latencies[endpoint]
+                baseline = min(latency, baseline * 1.001)
+                ewma = 0.8 * ewma + 0.2 * latency
+            self.latencies[endpoint] = (baseline, ewma)
+            if ewma > self.latency_factor * baseline:
+                self.counter["slow"] += 1
+                reason = "slow"
+                factor = 0.9
+            else:
+                reason = "calls succeed"
+        if factor is None:
+            self.limit = min(float(self.ceiling), self.limit + 1.0 / self.limit)
+        elif started > self.decreased_at:
+            self.limit = max(1.0, self.limit * factor)
+            self.decreased_at = ended
+        new = int(self.limit)
+        if new != old:
+            self.counter["increases" if new > old else "decreases"] += 1
+            logging.info("Concurrency limit {o} -> {n}: {r}, latency {l:.3f}s, average {a:.3f}s, lowest {b:.3f}s"
+                         .format(o=old, n=new, r=reason, l=latency, a=ewma, b=baseline))
+        return
+
+    def get_stats(self):
+        """
+        This method returns the current limit and the counters of the limiter.
+
+        :return: Dictionary with limit, ceiling and counters.
+        """
+        stats = dict(limit=int(self.limit), ceiling=self.ceiling)
+        stats.update(self.counter)
+        return stats
+
+
+class MurcsBatch:
+    """
+    This class queues Murcs write calls (add_*, remove_*, update_*) and sends them concurrently on exit of the context:
+
+        with client.batch() as batch:
+            for rec in records:
+                batch.add_softInst_calc(rec["softId"], rec["serverId"])
+        failed = [item for item in batch.report if item["error"]]
+
+    A failing call does not stop the batch. The report has an item per call, in the order of the calls, with
+    operation, arguments, http status, latency in seconds and error message or response body.
+    In an ordered batch the calls are sent in dependency levels, see murcsdeps.plan. All calls of a level are sent
+    concurrently, the next level starts when the level is done. Calls that depend on a call that failed are skipped.
+    With a journal every call is written to the journal before it is sent and marked done after success. Calls that
+    are not done in the journal are queued again with resume(). A dry run writes the journal and sends nothing.
+    A function that needs to know if a call succeeded is registered with after(), it is called when the call is sent
+    without error.
     """
-    This class will set up the attributes for the Murcs Rest call.
+
+    def __init__(self, client, workers=None, ordered=False, journal=None, dry_run=False):
+        """
+        :param client: MurcsRest object that sends the calls.
+        :param workers: Number of threads to send the calls, default the max_workers of the client.
+        :param ordered: If True, then the calls are sent in dependency order.
+        :param journal: Optional murcsjournal.Journal object.
+        :param dry_run: If True, then calls are logged and written to the journal, but not sent.
+        """
+        self.client = client
+        self.workers = workers or client.max_workers
+        self.ordered = ordered
+        self.journal = journal
+        self.dry_run = dry_run
+        self.queue = []
+        self.entries = []
+        self.callbacks = []
+        self.report = []
+
+    def __getattr__(self, name):
+        if not name.startswith(("add_", "remove_", "update_")):
+            raise AttributeError("{n} is not a Murcs write call".format(n=name))
+        func = getattr(self.client, name)
+
+        def queue_call(*args, **kwargs):
+            self.queue.append((name, func, args, kwargs))
+            self.entries.append(None)
+            self.callbacks.append(None)
+        return queue_call
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.run()
+        else:
+            logging.error("Batch with {c} calls is not sent because of {e!r}".format(c=len(self.queue), e=exc_val))
+
+    def resume(self):
+        """
+        This method queues the calls from the journal that are not done.
+
+        :return: Number of calls queued.
+        """
+        outstanding = self.journal.outstanding()
+        for entry, name, args, kwargs in outstanding:
+            self.queue.append((name, getattr(self.client, name), args, kwargs))
+            self.entries.append(entry)
+            self.callbacks.append(None)
+        logging.info("{c} calls from journal {f} queued".format(c=len(outstanding), f=self.journal.filename))
+        return len(outstanding)
+
+    def after(self, callback):
+        """
+        This method registers a function for the last queued call. The function is called without arguments after the
+        call is sent without error. It is not called for a call that fails, is skipped or is not sent (dry run).
+
+        :param callback: Function without arguments.
+        :return:
+        """
+        self.callbacks[-1] = callback
+        return
+
+    def run(self):
+        """
+        This method sends the calls that are queued. The calls are removed from the queue and their results are added
+        to the report.
+
+        :return: List with the result for every call.
+        """
+        jobs = self._take()
+        if self.dry_run:
+            return []
+        if self.ordered:
+            results = [None] * len(jobs)
+            for todo in self._levels(jobs, results):
+                for idx, result in zip(todo, my_env.ordered_map(self._call, [jobs[idx] for idx in todo],
+                                                                self.workers)):
+                    results[idx] = result
+        else:
+            results = list(my_env.ordered_map(self._call, jobs, self.workers))
+        return self._add_report(results)
+
+    def _take(self):
+        """
+        Internal method to remove the calls from the queue. New calls are written to the journal, in a dry run the
+        calls are logged.
+
+        :return: List of (queued call, journal entry, callback) tuples.
+        """
+        queue, self.queue = self.queue, []
+        entries, self.entries = self.entries, []
+        callbacks, self.callbacks = self.callbacks, []
+        if self.journal:
+            new = [idx for idx, entry in enumerate(entries) if entry is None]
+            for idx, entry in zip(new, self.journal.append([(queue[idx][0], queue[idx][2], queue[idx][3])
+                                                            for idx in new])):
+                entries[idx] = entry
+        if self.dry_run:
+            for name, func, args, kwargs in queue:
+                logging.info("Dry run: {n} {a}".format(n=name, a=args))
+            logging.info("Dry run, {c} calls not sent".format(c=len(queue)))
+        return list(zip(queue, entries, callbacks))
+
+    def _add_report(self, results):
+        """
+        Internal method to log the results of a run and add them to the report.
+
+        :param results: List with the result for every call.
+        :return: List with the result for every call.
+        """
+        failed = len([result for result in results if result["error"]])
+        logging.info("Batch with {c} calls sent, {f} failed".format(c=len(results), f=failed))
+        self.report += results
+        return results
+
+    def _levels(self, jobs, results):
+        """
+        Internal method to plan the calls in dependency levels. Calls that depend on a call that failed get a skipped
+        result, the caller sends the other calls of the level and sets their results before the next level.
+
+        :param jobs: List of (queued call, journal entry, callback) tuples.
+        :param results: List with a result per call, in the order of the queue, None for calls that are not sent.
+        :return: Generator with a list of job indexes for every level.
+        """
+        queue = [job[0] for job in jobs]
+        levels, depends_on = murcsdeps.plan(queue)
+        logging.info("Batch with {c} calls planned in {l} levels".format(c=len(queue), l=len(levels)))
+        for cnt, level in enumerate(levels):
+            todo = []
+            for idx in level:
+                failed = [dep for dep in depends_on[idx] if results[dep] is None or results[dep]["error"]]
+                if failed:
+                    name, func, args, kwargs = queue[idx]
+                    results[idx] = dict(operation=name, args=args, kwargs=kwargs, status=None, latency=None,
+                                        error="Skipped, {o} {a} failed"
+                                        .format(o=queue[failed[0]][0], a=queue[failed[0]][2]))
+                else:
+                    todo.append(idx)
+            logging.debug("Level {cnt}: {t} calls".format(cnt=cnt, t=len(todo)))
+            yield todo
+
+    def _call(self, job):
+        """
+        Internal method to send one call of the batch. The result is added to the journal and the callback is called
+        on success.
+
+        :param job: Tuple with queued call (operation name, method, args and kwargs), journal entry and callback.
+        :return: Dictionary with operation, args, kwargs, status, latency and error.
+        """
+        name, func, args, kwargs = job[0]
+        self.client.last_call.status = None
+        self.client.last_call.latency = None
+        error = None
+        try:
+            func(*args, **kwargs)
+        except requests.HTTPError as e:
+            error = e.response.text if e.response is not None else str(e)
+        except Exception as e:
+            error = "{e!r}".format(e=e)
+        return self._result(job, self.client.last_call.status, self.client.last_call.latency, error)
+
+    def _result(self, job, status, latency, error):
+        """
+        Internal method to register the result of a call. The result is added to the journal and the callback is
+        called on success.
+
+        :param job: Tuple with queued call (operation name, method, args and kwargs), journal entry and callback.
+        :param status: http status of the call, None if there was no response.
+        :param latency: Duration of the call in seconds.
+        :param error: Error message or response body, None on success.
+        :return: Dictionary with operation, args, kwargs, status, latency and error.
+        """
+        (name, func, args, kwargs), entry, callback = job
+        if self.journal:
+            self.journal.mark(entry, status, error)
+        if callback and not error:
+            callback()
+        return dict(operation=name, args=args, kwargs=kwargs, status=status, latency=latency, error=error)
+
+
+class MurcsRestBase:
+    """
+    This class has the Murcs Rest parameters and the methods that build the url and payload of the Murcs Rest calls.
+    The calls are sent by _send of the subclass: MurcsRest sends them with a requests session, murcsasync.AsyncMurcsRest
+    with an aiohttp session. Deadlines, hedging, caches, recording and metrics work the same for both.
     """
 
-    def __init__(self):
+    def __init__(self, cache_size=None):
         """
-        The init procedure will set-up the Murcs Rest parameters.
+        The init procedure will set-up the Murcs Rest parameters, the metrics, the caches and the recording.
+
+        :param cache_size: Number of GET responses in the read-through cache, default MURCS_CACHE_SIZE. The cache is
+        off by default (0): a cached response can be up to MURCS_CACHE_TTL seconds old, enable it only in scripts
+        that can work with that.
         """
         # Remove http_proxy environment settings if they exist.
         # If they exist, Python "requests" module will route over http_proxy instead of using OpenVPN.
@@ -31,6 +367,189 @@ class MurcsRest:
         clientId = os.getenv("MURCS_CLIENTID")
         self.url_loc = "http://{host}:{port}/murcs/rest/".format(host=host, port=port)
         self.url_base = "{url_loc}{clientId}/".format(url_loc=self.url_loc, clientId=clientId)
+        self.timeout = float(os.getenv("MURCS_TIMEOUT", 60))
+        self.poolsize = int(os.getenv("MURCS_POOLSIZE", 10))
+        self.retries = int(os.getenv("MURCS_RETRIES", 3))
+        self.backoff = float(os.getenv("MURCS_BACKOFF", 0.5))
+        # Calls in flight start at MURCS_WORKERS and adapt up to MURCS_MAX_INFLIGHT (default the larger of
+        # MURCS_WORKERS and MURCS_POOLSIZE). The budget is shared by all threads that use this object. max_workers is
+        # the number of threads for fan-out and batches, MURCS_MAX_INFLIGHT=1 gives a serial run.
+        self.initial_workers = int(os.getenv("MURCS_WORKERS", 4))
+        self.max_workers = int(os.getenv("MURCS_MAX_INFLIGHT", max(self.initial_workers, self.poolsize)))
+        self.latency_factor = float(os.getenv("MURCS_LATENCY_FACTOR", 3))
+        # Deadline per call in seconds, retries included, and budget for all calls of the run. 0 is no limit.
+        self.deadline = float(os.getenv("MURCS_DEADLINE", 0))
+        budget = float(os.getenv("MURCS_RUN_BUDGET", 0))
+        self.run_end = time.monotonic() + budget if budget else None
+        # GET calls that did not answer at this latency percentile of the endpoint get a second call. 0 is no hedging.
+        self.hedge_pct = float(os.getenv("MURCS_HEDGE", 0))
+        self.hedge_min = int(os.getenv("MURCS_HEDGE_MIN", 20))
+        # Latency percentiles for the report and for hedging are calculated on the last MURCS_METRICS_WINDOW calls.
+        self.metrics = MurcsMetrics(self.url_loc, self.url_base, int(os.getenv("MURCS_METRICS_WINDOW", 1000)))
+        # Read-through cache for GET calls, opt-in: MURCS_CACHE_SIZE 0 (default) switches off the cache.
+        if cache_size is None:
+            cache_size = int(os.getenv("MURCS_CACHE_SIZE", 0))
+        cache_ttl = float(os.getenv("MURCS_CACHE_TTL", 300))
+        self.cache = MurcsCache(self.url_loc, self.url_base, cache_size, cache_ttl) if cache_size > 0 else None
+        # Optional disk cache for GET calls, responses without ETag or Last-Modified are valid MURCS_CACHEDIR_TTL.
+        cachedir = os.getenv("MURCS_CACHEDIR")
+        cachedir_ttl = float(os.getenv("MURCS_CACHEDIR_TTL", 3600))
+        self.disk_cache = MurcsDiskCache(cachedir, cachedir_ttl) if cachedir else None
+        # Calls are recorded in MURCS_RECORD, or answered from the recording in MURCS_REPLAY. See murcsreplay.
+        self.recorder = self._init_recorder()
+        replay = os.getenv("MURCS_REPLAY")
+        self.replayer = ReplayAdapter(replay, float(os.getenv("MURCS_REPLAY_SPEED", 1))) if replay else None
+
+    def _init_recorder(self):
+        """
+        Internal method to create the recorder for the calls if MURCS_RECORD is set. Sensitive attributes are replaced
+        by pseudonyms if MURCS_RECORD_ANONYMIZE is set, with optional salt MURCS_RECORD_SALT. The recording is closed at
+        exit.
+
+        :return: Recorder object, or None.
+        """
+        record = os.getenv("MURCS_RECORD")
+        if not record:
+            return None
+        anonymize = Anonymizer(salt=os.getenv("MURCS_RECORD_SALT", "")) if os.getenv("MURCS_RECORD_ANONYMIZE") else None
+        recorder = Recorder(record, anonymize)
+        atexit.register(recorder.close)
+        return recorder
+
+    def _get_deadline(self, now):
+        """
+        Internal method to calculate the deadline of a call. The deadline is the earliest of the call deadline
+        (MURCS_DEADLINE seconds after the start of the call) and the end of the run budget (MURCS_RUN_BUDGET seconds
+        after the creation of this object).
+
+        :param now: Start of the call (time.monotonic).
+        :return: Deadline (time.monotonic), or None if the call has no deadline.
+        """
+        deadlines = [d for d in [self.run_end, now + self.deadline if self.deadline else None] if d is not None]
+        return min(deadlines, default=None)
+
+    def _get_hedge_delay(self, method, url):
+        """
+        Internal method to return the time after which a call gets a second call: the MURCS_HEDGE latency percentile
+        of the endpoint. Only GET calls are hedged, after MURCS_HEDGE_MIN calls on the endpoint.
+
+        :param method: GET, PUT or DELETE
+        :param url: Full url for the call.
+        :return: Number of seconds, or None if the call is not hedged.
+        """
+        if method == "GET" and self.hedge_pct:
+            return self.metrics.get_percentile(method, url, self.hedge_pct, self.hedge_min)
+        return None
+
+    def _deadline_exceeded(self, method, url, started):
+        """
+        Internal method to register a call that exceeded its deadline and to raise DeadlineExceeded.
+
+        :param method: GET, PUT or DELETE
+        :param url: Full url for the call.
+        :param started: Start of the call (time.monotonic), for the latency of the call in the subclasses.
+        :return:
+        """
+        self.metrics.record_deadline(method, url)
+        raise DeadlineExceeded("Deadline exceeded for {m} {u}".format(m=method, u=url))
+
+    def _send(self, method, url, msg=None, parse=None, cached=True, **kwargs):
+        """
+        Internal method to launch a Rest call and handle the response, see the subclasses.
+
+        :param method: GET, PUT or DELETE
+        :param url: Full url for the call.
+        :param msg: Message to log on success.
+        :param parse: Optional function that is applied on the parsed json of a GET call.
+        :param cached: If False, then a GET call is not answered from the memory cache.
+        :param kwargs: Additional parameters for the call (data, params, ...)
+        :return: Murcs information as a parsed json string for GET calls, None otherwise.
+        """
+        raise NotImplementedError
+
+    def _handle(self, body, msg=None, parse=None):
+        """
+        Internal method to handle the response body of a GET call: the message is logged and the json is parsed.
+
+        :param body: Response body, or None.
+        :param msg: Message to log.
+        :param parse: Optional function that is applied on the parsed json.
+        :return: Parsed json, None if there is no body.
+        """
+        if body is None:
+            return
+        if msg:
+            logging.info(msg)
+        res = json.loads(body)
+        if parse:
+            return parse(res)
+        return res
+
+    def _invalidate(self, url, data=None):
+        """
+        Internal method to drop the cached GET responses for the objects that are touched by a write call.
+
+        :param url: Full url of the write call.
+        :param data: Payload of the write call as a json string, or None.
+        :return:
+        """
+        if self.cache:
+            self.cache.invalidate(url, data)
+        if self.disk_cache:
+            self.disk_cache.invalidate()
+        return
+
+    @staticmethod
+    def _check(status, body, r):
+        """
+        Internal method to check the status of a call. On failure the response is logged and an HTTPError is raised.
+
+        :param status: http status of the call.
+        :param body: Response body.
+        :param r: Response object.
+        :return: Response body, None if the status is not 200.
+        """
+        if status == 200:
+            return body
+        logging.fatal("Investigate: {s}".format(s=status))
+        logging.fatal(body)
+        r.raise_for_status()
+        return
+
+    def write_metrics(self, filename):
+        """
+        This method writes the metrics of the Murcs Rest calls as a json report (filename.json) and as a Prometheus
+        textfile (filename.prom).
+
+        :param filename: Full path of the files, without extension.
+        :return:
+        """
+        self.metrics.write_json("{f}.json".format(f=filename))
+        self.metrics.write_textfile("{f}.prom".format(f=filename))
+        return
+
+    def get_limiter_stats(self):
+        """
+        This method returns the state of the adaptive concurrency limiter.
+
+        :return: Dictionary with current limit, ceiling and number of calls, failures, slow calls, increases and
+        decreases.
+        """
+        return self.inflight.get_stats()
+
+    def get_cache_stats(self):
+        """
+        This method returns the counters of the GET cache.
+
+        :return: Dictionary with cache counters, see MurcsCache.get_stats. Disk cache counters have prefix disk_, see
+        MurcsDiskCache.get_stats. Empty if the caches are switched off.
+        """
+        stats = {}
+        if self.cache:
+            stats.update(self.cache.get_stats())
+        if self.disk_cache:
+            stats.update({"disk_" + k: v for k, v in self.disk_cache.get_stats().items()})
+        return stats
 
     def add_server(self, serverId, payload):
         """
@@ -44,15 +563,8 @@ class MurcsRest:
         logging.debug("Payload: {p}".format(p=data))
         path = "servers/{serverId}".format(serverId=serverId)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.put(url, data=data, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("Load server {serverId}!".format(serverId=serverId))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Load server {serverId}!".format(serverId=serverId)
+        return self._send("PUT", url, msg=msg, data=data)
 
     def add_server_contact(self, serverId, personId, role):
         """
@@ -66,16 +578,9 @@ class MurcsRest:
         path = "servers/{serverId}/contactPersons/{personId}/{role}".format(serverId=serverId, personId=personId,
                                                                             role=role)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.put(url, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("Contact {personId} added to server {serverId}!".format(serverId=serverId,
-                                                                                 personId=personId))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Contact {personId} added to server {serverId}!".format(serverId=serverId,
+                                                                      personId=personId)
+        return self._send("PUT", url, msg=msg)
 
     def add_server_property(self, serverId, payload):
         """
@@ -90,16 +595,9 @@ class MurcsRest:
         logging.debug("Payload: {p}".format(p=data))
         path = "servers/{serverId}/properties/{prop}".format(serverId=serverId, prop=propname)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.put(url, data=data, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("Property {prop} with value {val} added to server {serverId}!"
-                         .format(prop=propname, serverId=serverId, val=payload["propertyValue"]))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Property {prop} with value {val} added to server {serverId}!"\
+            .format(prop=propname, serverId=serverId, val=payload["propertyValue"])
+        return self._send("PUT", url, msg=msg, data=data)
 
     def add_site(self, siteId, payload):
         """
@@ -113,15 +611,8 @@ class MurcsRest:
         logging.debug("Payload: {p}".format(p=data))
         path = "sites/{siteId}".format(siteId=siteId)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.put(url, data=data, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("Load site {siteId}!".format(siteId=siteId))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Load site {siteId}!".format(siteId=siteId)
+        return self._send("PUT", url, msg=msg, data=data)
 
     def add_sol(self, solId, payload):
         """
@@ -135,50 +626,46 @@ class MurcsRest:
         logging.debug("Payload: {p}".format(p=data))
         path = "solutions/{solId}".format(solId=solId)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.put(url, data=data, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("Load solution {solId}!".format(solId=solId))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Load solution {solId}!".format(solId=solId)
+        return self._send("PUT", url, msg=msg, data=data)
 
-    def get_data(self, objtype, start=0, limit=100, reslist=None):
+    @staticmethod
+    def _new_records(page, seen):
+        """
+        Internal method to remove records from a page that have been returned on an earlier page.
+
+        :param page: List of records.
+        :param seen: Set with keys of records that have been returned. Keys of new records are added.
+        :return: List of new records.
         """
-        This method launches the Rest call to get the murcs data for a specific object type (site, servers, ...)
+        items = []
+        for item in page:
+            key = item.get("id")
+            if key is None:
+                key = json.dumps(item, sort_keys=True)
+            if key not in seen:
+                seen.add(key)
+                items.append(item)
+        return items
+
+    def _get_page(self, objtype, start, limit):
+        """
+        Internal method to get a single page of records for an object type.
 
         :param objtype: Object type for which Murcs information is collected.
-        :param start: Offset of the return set, default 0
-        :param limit: Number of lines in the return set, default 100
-        :param reslist:
-        :return: Murcs information as a parsed json string.
+        :param start: Offset of the return set
+        :param limit: Number of lines in the return set
+        :return: Parsed json with items and totalResults.
         """
-        logging.debug("Start: {start}, limit: {limit}".format(start=start, limit=limit))
+        logging.debug("{objtype} - Start: {start}, limit: {limit}".format(objtype=objtype, start=start, limit=limit))
         url = self.url_base + objtype
-        headers = {
-            'Accept': 'application/json'
-        }
         payload = dict(
             start=start,
             limit=limit
         )
-        r = requests.get(url, headers=headers, auth=(self.user, self.passwd), params=payload)
-        if r.status_code == 200:
-            res = r.json()
-            reslist += res["items"]
-            totalResults = res["totalResults"]
-            nextStart = start + limit
-            if nextStart < totalResults:
-                self.get_data(objtype, nextStart, limit, reslist)
-            else:
-                return
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-            return
+        # Pages are read once per run and list objects that may have changed, they are not kept in the cache and
+        # never read from the disk cache without asking Murcs.
+        return self._send("GET", url, cached=False, params=payload)
 
     def get_server(self, serverId):
         """
@@ -189,18 +676,7 @@ class MurcsRest:
         :return: Murcs information as a parsed json string.
         """
         url = self.url_base + 'servers/{serverId}'.format(serverId=serverId)
-        headers = {
-            'Accept': 'application/json'
-        }
-        r = requests.get(url, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            res = r.json()
-            return res
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-            return
+        return self._send("GET", url)
 
     def get_softinst_from_server(self, serverId):
         """
@@ -212,21 +688,10 @@ class MurcsRest:
         """
         limit = 100
         url = self.url_base + 'servers/{serverId}/softwareInstances'.format(serverId=serverId)
-        headers = {
-            'Accept': 'application/json'
-        }
         payload = dict(
             limit=limit
         )
-        r = requests.get(url, headers=headers, auth=(self.user, self.passwd), params=payload)
-        if r.status_code == 200:
-            res = r.json()
-            return res
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-            return
+        return self._send("GET", url, params=payload)
 
     def get_solution(self, solutionId):
         """
@@ -236,51 +701,22 @@ class MurcsRest:
         :return:
         """
         url = self.url_base + 'solutions/{solutionId}'.format(solutionId=solutionId)
-        headers = {
-            'Accept': 'application/json'
-        }
-        r = requests.get(url, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            res = r.json()
-            return res
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-            return
+        return self._send("GET", url)
 
-    def get_solinst_from_solution(self, solId):
+    def get_solinstids_from_solution(self, solId):
         """
-        This method launches the Rest call to get the solution Instances for a solution. This needs to be done in two
-        steps. 1. Find the solutionInstance Ids attached to this solution. 2. Find the details for every solution
-        Instance Id.
+        This method launches the Rest call to get the solution Instance Ids for a solution. This is the first step
+        of get_solinst_from_solution.
 
-        :param solId: Solution Id for which the solution Instances are required.
-        :return: Murcs information as a parsed json string.
+        :param solId: Solution Id for which the solution Instance Ids are required.
+        :return: List of solution Instance Ids.
         """
         limit = 100
         url = self.url_base + 'solutions/{solId}/solutionInstances'.format(solId=solId)
-        headers = {
-            'Accept': 'application/json'
-        }
         payload = dict(
             limit=limit
         )
-        r = requests.get(url, headers=headers, auth=(self.user, self.passwd), params=payload)
-        if r.status_code == 200:
-            res = r.json()
-            solInstRecs = []
-            for rec in res:
-                solInstId = rec["key"]
-                solInstDict = self.get_solinst_details_from_solution(solId, solInstId)
-                if isinstance(solInstDict, dict):
-                    solInstRecs.append(solInstDict)
-            return solInstRecs
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-            return
+        return self._send("GET", url, params=payload, parse=lambda res: [rec["key"] for rec in res])
 
     def get_solinst_details_from_solution(self, solId, solInstId):
         """
@@ -293,21 +729,10 @@ class MurcsRest:
         """
         limit = 100
         url = self.url_base + 'solutions/{solId}/solutionInstances/{solInstId}'.format(solId=solId, solInstId=solInstId)
-        headers = {
-            'Accept': 'application/json'
-        }
         payload = dict(
             limit=limit
         )
-        r = requests.get(url, headers=headers, auth=(self.user, self.passwd), params=payload)
-        if r.status_code == 200:
-            res = r.json()
-            return res
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-            return
+        return self._send("GET", url, params=payload)
 
     def get_soltosol_from_solution(self, solId):
         """
@@ -318,21 +743,10 @@ class MurcsRest:
         """
         limit = 100
         url = self.url_base + 'solutionToSolution/all/{solId}'.format(solId=solId)
-        headers = {
-            'Accept': 'application/json'
-        }
         payload = dict(
             limit=limit
         )
-        r = requests.get(url, headers=headers, auth=(self.user, self.passwd), params=payload)
-        if r.status_code == 200:
-            res = r.json()
-            return res["items"]
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-            return
+        return self._send("GET", url, params=payload, parse=lambda res: res["items"])
 
     def get_version(self):
         """
@@ -341,21 +755,14 @@ class MurcsRest:
         :return:
         """
         url = self.url_loc + 'version'
-        headers = {
-            'Accept': 'application/json'
-        }
-        r = requests.get(url, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            res = r.json()
-            msg = "Murcs Version: {mv} - Database Version: {dbv}".format(mv=res["murcsVersion"],
-                                                                         dbv=res["databaseVersion"])
-            logging.info(msg)
-            return res
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-            return
+        return self._send("GET", url, parse=self._log_version)
+
+    @staticmethod
+    def _log_version(res):
+        msg = "Murcs Version: {mv} - Database Version: {dbv}".format(mv=res["murcsVersion"],
+                                                                     dbv=res["databaseVersion"])
+        logging.info(msg)
+        return res
 
     def get_wave(self, solId):
         """
@@ -365,18 +772,7 @@ class MurcsRest:
         :return:
         """
         url = self.url_base + 'solutions/{solId}'.format(solId=solId)
-        headers = {
-            'Accept': 'application/json'
-        }
-        r = requests.get(url, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            parsed_json = r.json()
-            print(parsed_json['fromSolution'][0]['comment'])
-        else:
-            print("Investigate: {s}".format(s=r.status_code))
-            print(r.content)
-            r.raise_for_status()
-        return
+        return self._send("GET", url, parse=lambda parsed_json: print(parsed_json['fromSolution'][0]['comment']))
 
     def add_person(self, email, payload):
         """
@@ -390,15 +786,8 @@ class MurcsRest:
         logging.debug("Payload: {p}".format(p=data))
         path = "persons/{email}".format(email=email)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.put(url, data=data, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("Load person {email}!".format(email=email))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Load person {email}!".format(email=email)
+        return self._send("PUT", url, msg=msg, data=data)
 
     def add_serverNetIface(self, serverId, ifaceId, payload=None):
         """
@@ -413,15 +802,8 @@ class MurcsRest:
         logging.debug("Payload: {p}".format(p=data))
         path = "{serverId}/serverNetworkInterfaces/{ifaceId}".format(serverId=serverId, ifaceId=ifaceId)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.put(url, data=data, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("Load Network Interface {ifaceId}!".format(ifaceId=ifaceId))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Load Network Interface {ifaceId}!".format(ifaceId=ifaceId)
+        return self._send("PUT", url, msg=msg, data=data)
 
     def add_serverNetIfaceIp(self, serverId, ifaceId, ipAddress, payload=None):
         """
@@ -442,16 +824,9 @@ class MurcsRest:
         path = "{serverId}/serverNetworkInterfaces/{ifaceId}/serverNetworkInterfacesIpAddress/{ipAddress}"\
             .format(serverId=serverId, ifaceId=ifaceId, ipAddress=ipAddress)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.put(url, data=data, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("Load IP {ipAddress} to Network Interface {ifaceId}!".format(ifaceId=ifaceId,
-                                                                                      ipAddress=ipAddress))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Load IP {ipAddress} to Network Interface {ifaceId}!".format(ifaceId=ifaceId,
+                                                                           ipAddress=ipAddress)
+        return self._send("PUT", url, msg=msg, data=data)
 
     def add_soft(self, softId, payload):
         """
@@ -465,15 +840,8 @@ class MurcsRest:
         logging.debug("Payload: {p}".format(p=data))
         path = "software/{softId}".format(softId=softId)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.put(url, data=data, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("Load soft {softId}!".format(softId=softId))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Load soft {softId}!".format(softId=softId)
+        return self._send("PUT", url, msg=msg, data=data)
 
     def add_software_from_sol(self, sol_rec):
         """
@@ -494,16 +862,9 @@ class MurcsRest:
         )
         data = json.dumps(payload)
         url = self.url_base + "software/{softId}".format(softId=softId)
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.put(url, data=data, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("software {softId} is created for solution {solId}!".format(solId=sol_rec["solId"],
-                                                                                     softId=softId))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "software {softId} is created for solution {solId}!".format(solId=sol_rec["solId"],
+                                                                          softId=softId)
+        return self._send("PUT", url, msg=msg, data=data)
 
     def add_softInst(self, softInstId, payload):
         """
@@ -518,15 +879,8 @@ class MurcsRest:
         logging.debug("Payload: {p}".format(p=data))
         path = "softwareInstances/{softInstId}".format(softInstId=softInstId)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.put(url, data=data, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("Load softwareInstance {softInstId}!".format(softInstId=softInstId))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Load softwareInstance {softInstId}!".format(softInstId=softInstId)
+        return self._send("PUT", url, msg=msg, data=data)
 
     def add_softInst_calc(self, softId, serverId, **params):
         """
@@ -544,20 +898,15 @@ class MurcsRest:
         :return:
         """
         params["server"] = dict(serverId=serverId)
-        if 'vpc' == serverId[:len('vpc')]:
-            serverId = 'VPC' + serverId[len('vpc'):]
+        softwareInstanceId = murcsdeps.softinst_id(softId, serverId, params)
         try:
-            softwareInstanceId = params.pop("softInstId")
+            params.pop("softInstId")
         except KeyError:
             # Check if instSubType (schema of the instance) is defined.
             try:
-                instSubType = params.pop("instSubType")
+                params["instanceSubType"] = params.pop("instSubType")
             except KeyError:
-                softwareInstanceId = "{softId} {serverId}".format(softId=softId, serverId=serverId)
-            else:
-                softwareInstanceId = "{schema} {softId} {serverId}".format(softId=softId, serverId=serverId,
-                                                                           schema=instSubType)
-                params["instanceSubType"] = instSubType
+                pass
         try:
             softwareInstanceType = params.pop("instType")
         except KeyError:
@@ -568,15 +917,8 @@ class MurcsRest:
         data = json.dumps(params)
         logging.debug("Payload: {p}".format(p=data))
         url = self.url_base + "softwareInstances/{softwareInstanceId}".format(softwareInstanceId=softwareInstanceId)
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.put(url, data=data, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("software Instance *{softInstId}* is created!".format(softInstId=softwareInstanceId))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "software Instance *{softInstId}* is created!".format(softInstId=softwareInstanceId)
+        return self._send("PUT", url, msg=msg, data=data)
 
     def add_softInst_property(self, inst_rec, payload):
         """
@@ -595,16 +937,9 @@ class MurcsRest:
         path = "softwareInstances/{serverId}/{softId}/{instId}/properties/{prop}"\
             .format(softId=softId, instId=instId, prop=propname, serverId=serverId)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.put(url, data=data, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("Property {prop} with value {val} added to softInst {instId}!"
-                         .format(prop=propname, instId=instId, val=payload["propertyValue"]))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Property {prop} with value {val} added to softInst {instId}!"\
+            .format(prop=propname, instId=instId, val=payload["propertyValue"])
+        return self._send("PUT", url, msg=msg, data=data)
 
     def add_solComp_property(self, solcomp_rec, payload):
         """
@@ -622,16 +957,9 @@ class MurcsRest:
         path = "solutions/{solId}/solutionInstances/{solInstId}/properties/{prop}"\
             .format(solId=solId, solInstId=solInstId, prop=propname)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.put(url, data=data, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("Property {prop} with value {val} added to solComp {solInstId}!"
-                         .format(prop=propname, solInstId=solInstId, val=payload["propertyValue"]))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Property {prop} with value {val} added to solComp {solInstId}!"\
+            .format(prop=propname, solInstId=solInstId, val=payload["propertyValue"])
+        return self._send("PUT", url, msg=msg, data=data)
 
     def add_solInstComp(self, solInstId, softInstId, solId, serverId, softId, mode="CMO"):
         """
@@ -669,15 +997,8 @@ class MurcsRest:
         data = json.dumps(payload)
         logging.debug("Payload: {p}".format(p=data))
         url = self.url_base + 'solutionInstanceComponents'
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.put(url, data=data, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("solution Instance Component {sIC} is created!".format(sIC=sIC))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "solution Instance Component {sIC} is created!".format(sIC=sIC)
+        return self._send("PUT", url, msg=msg, data=data)
 
     def add_solInst(self, solId, solInstId, payload):
         """
@@ -694,15 +1015,8 @@ class MurcsRest:
         logging.debug("Payload: {p}".format(p=data))
         path = "solutions/{solId}/solutionInstances/{solInstId}".format(solId=solId, solInstId=solInstId)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.put(url, data=data, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("Load solution Instance {solInstId}!".format(solInstId=solInstId))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Load solution Instance {solInstId}!".format(solInstId=solInstId)
+        return self._send("PUT", url, msg=msg, data=data)
 
     def add_solToSol(self, solToSolId, fromSolId, toSolId, payload):
         """
@@ -719,15 +1033,8 @@ class MurcsRest:
         url = self.url_base + 'solutionToSolution/{fromSolId}/{toSolId}/{solToSolId}'.format(fromSolId=fromSolId,
                                                                                              toSolId=toSolId,
                                                                                              solToSolId=solToSolId)
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.put(url, data=data, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("solution to Solution {sIC} is added!".format(sIC=solToSolId))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "solution to Solution {sIC} is added!".format(sIC=solToSolId)
+        return self._send("PUT", url, msg=msg, data=data)
 
     def add_solutionComponent(self, sol_rec, env):
         """
@@ -754,16 +1061,9 @@ class MurcsRest:
         logging.debug("Payload: {p}".format(p=data))
         url = self.url_base + 'solutions/{solId}/solutionInstances/{solInstId}'\
             .format(solId=solId, solInstId=solInstId)
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.put(url, data=data, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("solution Instance {solInstId} is created for solution {solId}!".format(solId=solId,
-                                                                                                 solInstId=solInstId))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "solution Instance {solInstId} is created for solution {solId}!".format(solId=solId,
+                                                                                      solInstId=solInstId)
+        return self._send("PUT", url, msg=msg, data=data)
 
     def add_solutionInstance(self, sol_rec):
         """
@@ -790,16 +1090,9 @@ class MurcsRest:
         logging.debug("Payload: {p}".format(p=data))
         url = self.url_base + 'solutions/{solId}/solutionInstances/{solInstId}'\
             .format(solId=solId, solInstId=solInstId)
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.put(url, data=data, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("solution Instance {solInstId} is created for solution {solId}!".format(solId=solId,
-                                                                                                 solInstId=solInstId))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "solution Instance {solInstId} is created for solution {solId}!".format(solId=solId,
+                                                                                      solInstId=solInstId)
+        return self._send("PUT", url, msg=msg, data=data)
 
     def add_solution_contact(self, solId, personId, role):
         """
@@ -812,15 +1105,8 @@ class MurcsRest:
         """
         path = "solutions/{solId}/contactPersons/{personId}/{role}".format(solId=solId, personId=personId, role=role)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.put(url, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("Contact {personId} added to solution {solId}!".format(solId=solId, personId=personId))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Contact {personId} added to solution {solId}!".format(solId=solId, personId=personId)
+        return self._send("PUT", url, msg=msg)
 
     def add_solution_property(self, solId, payload):
         """
@@ -835,16 +1121,9 @@ class MurcsRest:
         logging.debug("Payload: {p}".format(p=data))
         path = "solutions/{solId}/properties/{prop}".format(solId=solId, prop=propname)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.put(url, data=data, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("Property {prop} with value {val} added to solution {solId}!"
-                         .format(prop=propname, solId=solId, val=payload["propertyValue"]))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Property {prop} with value {val} added to solution {solId}!"\
+            .format(prop=propname, solId=solId, val=payload["propertyValue"])
+        return self._send("PUT", url, msg=msg, data=data)
 
     def get_softInst_property(self, inst_rec, propname):
         """
@@ -860,17 +1139,7 @@ class MurcsRest:
         path = "softwareInstances/{serverId}/{softId}/{instId}/properties/{prop}"\
             .format(softId=softId, instId=instId, prop=propname, serverId=serverId)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.get(url, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            return r.json()
-            # logging.info("Property {prop} with value {val} added to softInst {instId}!"
-            #              .format(prop=propname, instId=instId, val=payload["propertyValue"]))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        return self._send("GET", url)
 
     def remove_person(self, email):
         """
@@ -881,15 +1150,8 @@ class MurcsRest:
         """
         path = "persons/{email}".format(email=email)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.delete(url, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("Contact {personId} removed!".format(personId=email))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Contact {personId} removed!".format(personId=email)
+        return self._send("DELETE", url, msg=msg)
 
     def remove_server(self, serverId):
         """
@@ -900,15 +1162,8 @@ class MurcsRest:
         """
         path = "servers/{serverId}".format(serverId=serverId)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.delete(url, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("Remove server {serverId}!".format(serverId=serverId))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Remove server {serverId}!".format(serverId=serverId)
+        return self._send("DELETE", url, msg=msg)
 
     def remove_server_property(self, serverId, prop):
         """
@@ -920,16 +1175,9 @@ class MurcsRest:
         """
         path = "servers/{serverId}/properties/{prop}".format(serverId=serverId, prop=prop)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.delete(url, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("Property {prop} removed from server {serverId}!"
-                         .format(prop=prop, serverId=serverId))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Property {prop} removed from server {serverId}!"\
+            .format(prop=prop, serverId=serverId)
+        return self._send("DELETE", url, msg=msg)
 
     def remove_serverNetIface(self, serverId, ifaceId):
         """
@@ -941,15 +1189,8 @@ class MurcsRest:
         """
         path = "{serverId}/serverNetworkInterfaces/{ifaceId}".format(serverId=serverId, ifaceId=ifaceId)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.delete(url, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("Remove Network Interface {ifaceId}!".format(ifaceId=ifaceId))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Remove Network Interface {ifaceId}!".format(ifaceId=ifaceId)
+        return self._send("DELETE", url, msg=msg)
 
     def remove_serverNetIfaceIp(self, serverId, ifaceId, ipAddress):
         """
@@ -963,16 +1204,9 @@ class MurcsRest:
         path = "{serverId}/serverNetworkInterfaces/{ifaceId}/serverNetworkInterfacesIpAddress/{ipAddress}"\
             .format(serverId=serverId, ifaceId=ifaceId, ipAddress=ipAddress)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.delete(url, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("Remove IP {ipAddress} from Network Interface {ifaceId}!".format(ifaceId=ifaceId,
-                                                                                          ipAddress=ipAddress))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Remove IP {ipAddress} from Network Interface {ifaceId}!".format(ifaceId=ifaceId,
+                                                                               ipAddress=ipAddress)
+        return self._send("DELETE", url, msg=msg)
 
     def remove_software(self, softwareId):
         """
@@ -982,16 +1216,8 @@ class MurcsRest:
         :return:
         """
         url = self.url_base + "software/{softwareId}".format(softwareId=softwareId)
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.delete(url, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            msg = "Software {softId} removed".format(softId=softwareId)
-            logging.info(msg)
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Software {softId} removed".format(softId=softwareId)
+        return self._send("DELETE", url, msg=msg)
 
     def remove_softInst(self, serverId, softId, softInstId):
         """
@@ -1005,16 +1231,8 @@ class MurcsRest:
         """
         url = self.url_base + "softwareInstances/{serverId}/{softwareId}/{softwareInstanceId}"\
             .format(serverId=serverId, softwareId=softId, softwareInstanceId=softInstId)
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.delete(url, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            msg = "Link between server {sid} and software {softId} removed".format(sid=serverId, softId=softId)
-            logging.info(msg)
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Link between server {sid} and software {softId} removed".format(sid=serverId, softId=softId)
+        return self._send("DELETE", url, msg=msg)
 
     def remove_softInst_property(self, inst_rec, propname):
         """
@@ -1030,16 +1248,9 @@ class MurcsRest:
         path = "softwareInstances/{serverId}/{softId}/{instId}/properties/{prop}"\
             .format(softId=softId, instId=instId, prop=propname, serverId=serverId)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.delete(url, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("Property {prop} removed to softInst {instId}!"
-                         .format(prop=propname, instId=instId))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Property {prop} removed to softInst {instId}!"\
+            .format(prop=propname, instId=instId)
+        return self._send("DELETE", url, msg=msg)
 
     def remove_solComp_contact(self, solId, solInstId, personId, role):
         """
@@ -1054,16 +1265,9 @@ class MurcsRest:
         path = "solutions/{solId}/solutionInstances/{solInstId}/contactPersons/{personId}/{role}"\
             .format(solId=solId, solInstId=solInstId, personId=personId, role=role)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.delete(url, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("Person {email} removed from solComp {solInstId}!"
-                         .format(email=personId, solInstId=solInstId))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Person {email} removed from solComp {solInstId}!"\
+            .format(email=personId, solInstId=solInstId)
+        return self._send("DELETE", url, msg=msg)
 
     def remove_solComp_property(self, solcomp_rec, propname):
         """
@@ -1078,16 +1282,9 @@ class MurcsRest:
         path = "solutions/{solId}/solutionInstances/{solInstId}/properties/{prop}"\
             .format(solId=solId, solInstId=solInstId, prop=propname)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.delete(url, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("Property {prop} removed from solComp {solInstId}!"
-                         .format(prop=propname, solInstId=solInstId))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Property {prop} removed from solComp {solInstId}!"\
+            .format(prop=propname, solInstId=solInstId)
+        return self._send("DELETE", url, msg=msg)
 
     def remove_solInstComp(self, solInstId, softInstId, solId, serverId, softId):
         """
@@ -1123,15 +1320,8 @@ class MurcsRest:
         data = json.dumps(payload)
         logging.debug("Payload: {p}".format(p=data))
         url = self.url_base + 'solutionInstanceComponents'
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.delete(url, data=data, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("solution Instance Component {sIC} is removed!".format(sIC=sIC))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "solution Instance Component {sIC} is removed!".format(sIC=sIC)
+        return self._send("DELETE", url, msg=msg, data=data)
 
     def remove_solToSol(self, solToSolId, fromSolId, toSolId):
         """
@@ -1145,15 +1335,8 @@ class MurcsRest:
         url = self.url_base + 'solutionToSolution/{fromSolId}/{toSolId}/{solToSolId}'.format(fromSolId=fromSolId,
                                                                                              toSolId=toSolId,
                                                                                              solToSolId=solToSolId)
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.delete(url, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("solution to Solution {sIC} is removed!".format(sIC=solToSolId))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "solution to Solution {sIC} is removed!".format(sIC=solToSolId)
+        return self._send("DELETE", url, msg=msg)
 
     def remove_solutionInstance(self, solId, solInstId):
         """
@@ -1165,17 +1348,9 @@ class MurcsRest:
         :return:
         """
         url = self.url_base + "solutions/{solId}/solutionInstances/{solInstId}".format(solId=solId, solInstId=solInstId)
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.delete(url, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            msg = "solution Instance *{solInstId}* has been deleted from solution *{solId}*".format(solId=solId,
-                                                                                                    solInstId=solInstId)
-            logging.info(msg)
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "solution Instance *{solInstId}* has been deleted from solution *{solId}*".format(solId=solId,
+                                                                                                solInstId=solInstId)
+        return self._send("DELETE", url, msg=msg)
 
     def remove_solution_contact(self, solId, personId, role):
         """
@@ -1188,17 +1363,10 @@ class MurcsRest:
         """
         path = "solutions/{solId}/contactPersons/{personId}/{role}".format(solId=solId, personId=personId, role=role)
         url = self.url_base + path
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.delete(url, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("Contact {personId} role {r} removed from solution {solId}!".format(solId=solId,
-                                                                                             personId=personId,
-                                                                                             r=role))
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Contact {personId} role {r} removed from solution {solId}!".format(solId=solId,
+                                                                                  personId=personId,
+                                                                                  r=role)
+        return self._send("DELETE", url, msg=msg)
 
     def remove_solution_property(self, solId, propertyName):
         """
@@ -1209,16 +1377,8 @@ class MurcsRest:
         :return:
         """
         url = self.url_base + "solutions/{solId}/properties/{prop}".format(solId=solId, prop=propertyName)
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.delete(url, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            msg = "Property {prop} has been deleted from solution {solId}".format(solId=solId, prop=propertyName)
-            logging.info(msg)
-        else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
-        return
+        msg = "Property {prop} has been deleted from solution {solId}".format(solId=solId, prop=propertyName)
+        return self._send("DELETE", url, msg=msg)
 
     def update_solution_component(self, solcomp_rec):
         """
@@ -1243,13 +1403,360 @@ class MurcsRest:
         logging.debug("Payload: {p}".format(p=data))
         url = self.url_base + 'solutions/{solId}/solutionInstances/{solInstId}'\
             .format(solId=solId, solInstId=solInstId)
-        headers = {'Content-Type': 'application/json; charset=utf-8', 'Accept': 'application/json'}
-        r = requests.put(url, data=data, headers=headers, auth=(self.user, self.passwd))
-        if r.status_code == 200:
-            logging.info("solution Instance {solInstId} is modified for solution {solId}!".format(solId=solId,
-                                                                                                  solInstId=solInstId))
+        msg = "solution Instance {solInstId} is modified for solution {solId}!".format(solId=solId,
+                                                                                       solInstId=solInstId)
+        return self._send("PUT", url, msg=msg, data=data)
+
+
+class MurcsRest(MurcsRestBase):
+    """
+    This class sends the Murcs Rest calls with a requests session that is shared by all threads.
+    """
+
+    def __init__(self, cache_size=None):
+        """
+        The init procedure will set-up the Murcs Rest parameters (see MurcsRestBase), the threads for calls with a
+        deadline and the shared http session.
+
+        :param cache_size: Number of GET responses in the read-through cache, default MURCS_CACHE_SIZE.
+        """
+        super().__init__(cache_size)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=4 * self.max_workers)
+        self.inflight = AdaptiveLimiter(self.initial_workers, self.max_workers, self.latency_factor)
+        # Status and latency of the last call in this thread.
+        self.last_call = threading.local()
+        # Marks the threads of a fan-out, a fan-out in such a thread is done serially.
+        self.fan_out_thread = threading.local()
+        self.session = self._init_session()
+
+    def _init_session(self):
+        """
+        Internal method to create the http session that is shared by all Murcs Rest calls. The session keeps a pool
+        of keep-alive connections to the Murcs server, so consecutive calls do not need a new TCP connection.
+        Authentication and default headers are set on the session once.
+        Pool size and retry behaviour can be configured in the environment: MURCS_POOLSIZE (default 10),
+        MURCS_RETRIES (default 3) and MURCS_BACKOFF (default 0.5 seconds).
+        If MURCS_RECORD is set, then all calls are recorded in this file. If MURCS_REPLAY is set, then calls are
+        answered from this recording at MURCS_REPLAY_SPEED (default 1, 0 for no delay). See murcsreplay.
+
+        :return: requests Session object.
+        """
+        retries = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff,
+            status_forcelist=retry_status,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(self.poolsize, self.max_workers),
+                              max_retries=retries, pool_block=True)
+        if self.replayer:
+            adapter = self.replayer
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if self.recorder:
+            session.hooks["response"].append(self.recorder)
+        session.auth = (self.user, self.passwd)
+        session.headers.update({'Accept': 'application/json'})
+        return session
+
+    def _request(self, method, url, **kwargs):
+        """
+        Internal method to launch a Rest call within its deadline. The deadline is the earliest of the call deadline
+        (MURCS_DEADLINE seconds after the start of the call) and the end of the run budget (MURCS_RUN_BUDGET seconds
+        after the creation of this object). The timeout of the call is reduced to the time that is left. A call that
+        does not answer before the deadline raises DeadlineExceeded, the call itself is abandoned.
+        If MURCS_HEDGE is set (e.g. 95), then a GET call that did not answer at this latency percentile of the
+        endpoint gets a second call. The first answer is used. Hedging starts after MURCS_HEDGE_MIN calls on the
+        endpoint.
+
+        :param method: GET, PUT or DELETE
+        :param url: Full url for the call.
+        :param kwargs: Additional parameters for the requests call (data, params, ...)
+        :return: Response object.
+        """
+        now = time.monotonic()
+        deadline = self._get_deadline(now)
+        if deadline is not None:
+            if deadline <= now:
+                self._deadline_exceeded(method, url, now)
+            kwargs["timeout"] = min(kwargs.get("timeout", self.timeout), deadline - now)
+        hedge_delay = self._get_hedge_delay(method, url)
+        if not (self.deadline or hedge_delay):
+            try:
+                return self._attempt(method, url, **kwargs)
+            except requests.RequestException:
+                # The timeout was reduced to the end of the run budget.
+                if deadline is not None and time.monotonic() >= deadline:
+                    self._deadline_exceeded(method, url, now)
+                raise
+        return self._race(method, url, deadline, hedge_delay, **kwargs)
+
+    def _race(self, method, url, deadline, hedge_delay, **kwargs):
+        """
+        Internal method to run a call in the executor and to wait for the first answer, until the deadline. A hedged
+        call is sent after hedge_delay seconds.
+
+        :param method: GET, PUT or DELETE
+        :param url: Full url for the call.
+        :param deadline: Deadline (time.monotonic) or None.
+        :param hedge_delay: Seconds to wait before a second call is sent, None for no second call.
+        :param kwargs: Additional parameters for the requests call (data, params, ...)
+        :return: Response object.
+        """
+        started = time.monotonic()
+
+        def attempt():
+            res = self._attempt(method, url, **kwargs)
+            return res, self.last_call.status
+
+        pending = {self.executor.submit(attempt): False}
+        hedge_at = started + hedge_delay if hedge_delay is not None else None
+        error = None
+        while pending:
+            until = min([t for t in [hedge_at, deadline] if t is not None], default=None)
+            timeout = None if until is None else max(0, until - time.monotonic())
+            done, _ = concurrent.futures.wait(pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                hedged = pending.pop(future)
+                try:
+                    r, status = future.result()
+                except requests.RequestException as e:
+                    error = error or e
+                    # No second call for a call that failed.
+                    hedge_at = None
+                    continue
+                if hedged:
+                    self.metrics.record_hedge(method, url, won=True)
+                self.last_call.status, self.last_call.latency = status, time.monotonic() - started
+                return r
+            if done:
+                continue
+            if deadline is not None and time.monotonic() >= deadline:
+                self._deadline_exceeded(method, url, started)
+            if hedge_at is not None:
+                self.metrics.record_hedge(method, url)
+                pending[self.executor.submit(attempt)] = True
+                hedge_at = None
+        self.last_call.status, self.last_call.latency = None, time.monotonic() - started
+        raise error
+
+    def _deadline_exceeded(self, method, url, started):
+        self.last_call.status, self.last_call.latency = None, time.monotonic() - started
+        super()._deadline_exceeded(method, url, started)
+
+    def _attempt(self, method, url, **kwargs):
+        """
+        Internal method to launch a Rest call on the shared session. Default timeout (MURCS_TIMEOUT, default 60
+        seconds) is set if no timeout is specified. A json Content-Type header is added for calls that send data.
+        The number of calls in flight is controlled by the adaptive limiter, whatever the number of threads that use
+        this object. Calls that fail, that need a retry or that are rejected by an overloaded Murcs reduce the limit.
+        Every call is registered in the metrics, status and latency are remembered in last_call for this thread.
+
+        :param method: GET, PUT or DELETE
+        :param url: Full url for the call.
+        :param kwargs: Additional parameters for the requests call (data, params, ...)
+        :return: Response object.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        if method != "GET":
+            kwargs["headers"] = {'Content-Type': 'application/json; charset=utf-8'}
+        started = self.inflight.acquire()
+        failed = True
+        try:
+            r = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            self.last_call.status, self.last_call.latency = None, time.monotonic() - started
+            self.metrics.record(method, url, "error", self.last_call.latency)
+            raise
         else:
-            logging.fatal("Investigate: {s}".format(s=r.status_code))
-            logging.fatal(r.content)
-            r.raise_for_status()
+            retries = getattr(r.raw, "retries", None)
+            retries = len(retries.history) if retries else 0
+            failed = r.status_code in overload_status or retries > 0
+            self.last_call.status, self.last_call.latency = r.status_code, time.monotonic() - started
+            self.metrics.record(method, url, r.status_code, self.last_call.latency, len(r.content), retries)
+            return r
+        finally:
+            self.inflight.release(started, failed, (self.metrics.endpoint(url), method))
+
+    def _send(self, method, url, msg=None, parse=None, cached=True, **kwargs):
+        """
+        Internal method to launch a Rest call and handle the response. On success the message is logged and for GET
+        calls the parsed json is returned. On failure the response is logged and an HTTPError is raised.
+        GET calls are answered from the cache if possible, write calls invalidate the cache for the objects they touch.
+        Then the disk cache is tried, if MURCS_CACHEDIR is set.
+
+        :param method: GET, PUT or DELETE
+        :param url: Full url for the call.
+        :param msg: Message to log on success.
+        :param parse: Optional function that is applied on the parsed json of a GET call.
+        :param cached: If False, then a GET call is not answered from the memory cache and not added to the memory
+        cache. The disk cache only answers after a 304 reply of Murcs, so the response is never stale.
+        :param kwargs: Additional parameters for the requests call (data, params, ...)
+        :return: Murcs information as a parsed json string for GET calls, None otherwise.
+        """
+        if method == "GET":
+            if self.cache and cached:
+                body = self.cache.get(url, kwargs.get("params"), lambda: self._fetch(url, **kwargs))
+            else:
+                body = self._fetch(url, fresh=not cached, **kwargs)
+            return self._handle(body, msg, parse)
+        try:
+            body = self._receive(method, url, **kwargs)
+        finally:
+            self._invalidate(url, kwargs.get("data"))
+        if msg and body is not None:
+            logging.info(msg)
         return
+
+    def _receive(self, method, url, **kwargs):
+        """
+        Internal method to launch a Rest call and return the response body. On failure the response is logged and an
+        HTTPError is raised.
+
+        :param method: GET, PUT or DELETE
+        :param url: Full url for the call.
+        :param kwargs: Additional parameters for the requests call (data, params, ...)
+        :return: Response body (bytes), None if the status is not 200.
+        """
+        r = self._request(method, url, **kwargs)
+        return self._check(r.status_code, r.content, r)
+
+    def _fetch(self, url, fresh=False, **kwargs):
+        """
+        Internal method to launch a GET call and return the response body. The disk cache is used if MURCS_CACHEDIR
+        is set.
+
+        :param url: Full url for the call.
+        :param fresh: If True, then the disk cache does not use a response without asking Murcs.
+        :param kwargs: Additional parameters for the requests call (params, ...)
+        :return: Response body (bytes), None if the status is not 200.
+        """
+        if not self.disk_cache:
+            return self._receive("GET", url, **kwargs)
+        responses = []
+
+        def request(headers):
+            responses.append(self._request("GET", url, headers=headers, **kwargs))
+            return responses[-1]
+
+        status, body = self.disk_cache.get(url, kwargs.get("params"), request, fresh)
+        if status in (None, 304):
+            return body
+        return self._check(status, body, responses[-1])
+
+    def batch(self, workers=None, ordered=False, journal=None, dry_run=False):
+        """
+        This method returns a context to send write calls (add_*, remove_*, update_*) concurrently. See MurcsBatch.
+
+        :param workers: Number of threads to send the calls, default max_workers.
+        :param ordered: If True, then calls are sent in dependency order: removes first, children before parents, then
+        adds and updates, parents before children.
+        :param journal: Optional murcsjournal.Journal object, calls are written to the journal before they are sent.
+        :param dry_run: If True, then calls are logged and written to the journal, but not sent.
+        :return: MurcsBatch object.
+        """
+        return MurcsBatch(self, workers, ordered, journal, dry_run)
+
+    def fan_out(self, func, items):
+        """
+        This method calls func for every item on max_workers threads, see my_env.ordered_map. A fan-out that is
+        started in a thread of a fan-out is done serially in that thread, so nested fan-out does not multiply the
+        number of threads. The calls in flight are limited by the adaptive limiter in both cases.
+
+        :param func: Function to call for every item, typically a get_* method of this object.
+        :param items: Items to handle.
+        :return: Generator with the function results, in the order of the items.
+        """
+        if getattr(self.fan_out_thread, "active", False):
+            return map(func, items)
+
+        def call(item):
+            self.fan_out_thread.active = True
+            try:
+                return func(item)
+            finally:
+                self.fan_out_thread.active = False
+
+        return my_env.ordered_map(call, items, self.max_workers)
+
+    def get_connection_stats(self):
+        """
+        This method returns the connection counters of the shared session. Connections that are reused are requests
+        that did not need a new connection to the Murcs server.
+
+        :return: Dictionary with number of requests, connections and reused connections.
+        """
+        requests_cnt = 0
+        connections_cnt = 0
+        for adapter in set(self.session.adapters.values()):
+            if not hasattr(adapter, "poolmanager"):
+                continue
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                requests_cnt += pool.num_requests
+                connections_cnt += pool.num_connections
+        return dict(
+            requests=requests_cnt,
+            connections=connections_cnt,
+            reused=requests_cnt - connections_cnt
+        )
+
+    def get_data(self, objtype, start=0, limit=100, reslist=None):
+        """
+        This method launches the Rest calls to get the murcs data for a specific object type (site, servers, ...)
+        All records are collected in a list, check iter_data to handle the records page by page.
+
+        :param objtype: Object type for which Murcs information is collected.
+        :param start: Offset of the return set, default 0
+        :param limit: Number of lines in the return set, default 100
+        :param reslist: Optional list, records will be appended to this list.
+        :return: List with Murcs records for the object type.
+        """
+        if reslist is None:
+            reslist = []
+        for page in self.iter_data(objtype, page_size=limit, start=start):
+            reslist += page
+        return reslist
+
+    def iter_data(self, objtype, page_size=100, start=0):
+        """
+        This method launches the Rest calls to get the murcs data for a specific object type (site, servers, ...) and
+        yields the records page by page.
+        The first page returns the total number of results. This is used to plan the remaining pages, which are
+        collected concurrently by MURCS_MAX_INFLIGHT threads, see fan_out. Only a few pages are collected ahead of the
+        page that is handled by the caller, so memory use does not depend on the number of records.
+        Pages are returned in order. A record that shows up on more than one page (e.g. because data changed during
+        collection) is returned only once.
+
+        :param objtype: Object type for which Murcs information is collected.
+        :param page_size: Number of records per page, default 100
+        :param start: Offset of the first record, default 0
+        :return: Generator with a list of Murcs records for every page.
+        """
+        res = self._get_page(objtype, start, page_size)
+        starts = range(start + page_size, res["totalResults"], page_size)
+        pages = itertools.chain([res["items"]],
+                                self.fan_out(lambda nextStart: self._get_page(objtype, nextStart, page_size)["items"],
+                                             starts))
+        seen = set()
+        for page in pages:
+            yield self._new_records(page, seen)
+
+    def get_solinst_from_solution(self, solId):
+        """
+        This method launches the Rest call to get the solution Instances for a solution. This needs to be done in two
+        steps. 1. Find the solutionInstance Ids attached to this solution. 2. Find the details for every solution
+        Instance Id. The details are collected concurrently, or serially if this method is called in a fan-out.
+
+        :param solId: Solution Id for which the solution Instances are required.
+        :return: Murcs information as a parsed json string.
+        """
+        solInstIds = self.get_solinstids_from_solution(solId)
+        solInstRecs = []
+        for solInstDict in self.fan_out(lambda solInstId: self.get_solinst_details_from_solution(solId, solInstId),
+                                        solInstIds):
+            if isinstance(solInstDict, dict):
+                solInstRecs.append(solInstDict)
+        return solInstRecs
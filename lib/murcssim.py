@@ -0,0 +1,445 @@
+"""
+This module implements a local stand-in for the Murcs Rest server. It serves a synthetic dataset on the endpoints that
+are used by MurcsRest, so extraction and load scripts can be run and measured without a connection to Murcs.
+Latency, jitter and error rate can be injected, ETag headers can be switched on. Use murcs_Sim.py to run the stand-in
+as a separate process, or MurcsSim to run it in a thread of a test script:
+
+    sim = MurcsSim(MurcsData(servers=1000), latency=0.02).start()
+    os.environ.update(MURCS_HOST=sim.host, MURCS_PORT=str(sim.port))
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+meta_fields = dict(
+    changedAt="2019-01-01T00:00:00Z",
+    changedBy="sim",
+    createdAt="2019-01-01T00:00:00Z",
+    createdBy="sim",
+    clientId="sim",
+    version="1"
+)
+
+
+class MurcsData:
+    """
+    This class generates and holds the synthetic Murcs dataset. The dataset is deterministic for a seed.
+    """
+
+    def __init__(self, servers=100, solutions=20, sites=5, persons=20, seed=0):
+        """
+        Generate the dataset.
+
+        :param servers: Number of servers.
+        :param solutions: Number of solutions.
+        :param sites: Number of sites.
+        :param persons: Number of persons.
+        :param seed: Seed for the random generator.
+        """
+        self.rnd = random.Random(seed)
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.sites = [self._site(cnt) for cnt in range(sites)]
+        self.persons = [self._person(cnt) for cnt in range(persons)]
+        self.software = [self._software(cnt) for cnt in range(max(1, servers // 10))]
+        self.servers = {}
+        for cnt in range(servers):
+            srv = self._server(cnt)
+            self.servers[srv["serverId"]] = srv
+        self.solutions = {}
+        for cnt in range(solutions):
+            sol = self._solution(cnt)
+            self.solutions[sol["solutionId"]] = sol
+        self._link_solutions()
+        self.writes = []
+
+    def _meta(self):
+        self.next_id += 1
+        rec = dict(meta_fields)
+        rec["id"] = self.next_id
+        return rec
+
+    def _site(self, cnt):
+        rec = self._meta()
+        rec.update(siteId="site{c}".format(c=cnt), country="BE", town="Town {c}".format(c=cnt),
+                   dataCenterName="DC{c}".format(c=cnt), description="Site {c}".format(c=cnt), eslId=cnt,
+                   provider="sim", region="EMEA")
+        return rec
+
+    def _person(self, cnt):
+        rec = self._meta()
+        rec.update(email="person{c}@example.com".format(c=cnt), firstName="First{c}".format(c=cnt),
+                   lastName="Last{c}".format(c=cnt), company="sim", department="IT")
+        return rec
+
+    def _software(self, cnt):
+        rec = self._meta()
+        rec.update(softwareId="soft{c}".format(c=cnt), softwareName="Software {c}".format(c=cnt),
+                   softwareType="OperatingSystem" if cnt == 0 else "Application", softwareVendor="sim",
+                   softwareVersion="1.{c}".format(c=cnt), inScope="Yes")
+        return rec
+
+    def _server(self, cnt):
+        serverId = "srv{c:06d}".format(c=cnt)
+        rec = self._meta()
+        parent = None
+        if cnt > 0 and self.rnd.random() < 0.2:
+            parent = dict(serverId="srv{c:06d}".format(c=self.rnd.randrange(cnt)))
+        rec.update(serverId=serverId, hostName=serverId, fqdn="{s}.example.com".format(s=serverId),
+                   site=dict(siteId=self.rnd.choice(self.sites)["siteId"]), parentServer=parent,
+                   cpuCount=self.rnd.randint(1, 16), memorySizeInByte=self.rnd.randint(1, 64) * 1024 ** 3,
+                   operatingSystem="Linux", serverType="Virtual", inScope="Yes")
+        rec["detail"] = self._server_detail(serverId)
+        return rec
+
+    def _server_detail(self, serverId):
+        ifaces = []
+        for ifcnt in range(self.rnd.randint(0, 2)):
+            iface = self._meta()
+            ifaceId = "{s} eth{c}".format(s=serverId, c=ifcnt)
+            ips = []
+            for ipcnt in range(self.rnd.randint(0, 2)):
+                ip = self._meta()
+                ip.update(ipAddress="10.{a}.{b}.{c}".format(a=ifcnt, b=ipcnt, c=self.rnd.randrange(255)),
+                          ipAddressType="IPv4", netmask="255.255.255.0", serverNetworkInterfaceId=ifaceId)
+                ips.append(ip)
+            iface.update(networkInterfaceId=ifaceId, interfaceName="eth{c}".format(c=ifcnt),
+                         macAddress="00:00:00:00:00:{c:02d}".format(c=ifcnt), serverNetworkInterfaceIPAddresses=ips)
+            ifaces.append(iface)
+        contacts = []
+        for person in self.rnd.sample(self.persons, min(len(self.persons), self.rnd.randint(0, 2))):
+            contact = self._meta()
+            contact.update(role="Technical Owner", serverId=serverId, person=dict(email=person["email"]))
+            contacts.append(contact)
+        props = []
+        for propcnt in range(self.rnd.randint(0, 5)):
+            prop = self._meta()
+            prop.update(propertyName="prop{c}".format(c=propcnt), propertyValue=str(self.rnd.random()),
+                        description="Property {c}".format(c=propcnt), serverId=serverId,
+                        self="servers/{s}/properties/prop{c}".format(s=serverId, c=propcnt))
+            props.append(prop)
+        softinsts = []
+        for sw in [self.software[0]] + self.rnd.sample(self.software, min(len(self.software),
+                                                                          self.rnd.randint(0, 3))):
+            softinst = self._meta()
+            softinst.update(softwareInstanceId="{sw} {s}".format(sw=sw["softwareId"], s=serverId),
+                            softwareInstanceType=sw["softwareType"], server=dict(serverId=serverId),
+                            software=dict(sw))
+            if softinst["softwareInstanceId"] not in [si["softwareInstanceId"] for si in softinsts]:
+                softinsts.append(softinst)
+        return dict(serverNetworkInterfaces=ifaces, contactPersons=contacts, serverProperties=props,
+                    softwareInstances=softinsts)
+
+    def _solution(self, cnt):
+        solutionId = "sol{c:05d}".format(c=cnt)
+        rec = self._meta()
+        rec.update(solutionId=solutionId, solutionName="Solution {c}".format(c=cnt), inScope="Yes",
+                   classification="Internal")
+        return rec
+
+    def _link_solutions(self):
+        solIds = list(self.solutions.keys())
+        servers = list(self.servers.values())
+        for solutionId in solIds:
+            sol = self.solutions[solutionId]
+            sol["toSolution"] = []
+            sol["fromSolution"] = []
+            instances = []
+            for env in ["Production", "Development"][:self.rnd.randint(1, 2)]:
+                solInstId = "{s} solInstance {e}".format(s=solutionId, e=env)
+                inst = self._meta()
+                comps = []
+                for srv in self.rnd.sample(servers, min(len(servers), self.rnd.randint(0, 3))):
+                    softinst = srv["detail"]["softwareInstances"][0]
+                    comp = self._meta()
+                    comp.update(softwareInstance=dict(softwareInstanceId=softinst["softwareInstanceId"],
+                                                      software=dict(softwareId=softinst["software"]["softwareId"]),
+                                                      server=dict(serverId=srv["serverId"])),
+                                availability="High")
+                    comps.append(comp)
+                props = {}
+                for propcnt in range(self.rnd.randint(0, 2)):
+                    prop = self._meta()
+                    prop.update(propertyName="iprop{c}".format(c=propcnt), propertyValue=str(propcnt),
+                                solutionId=solutionId, solutionInstanceId=solInstId, self="self")
+                    props["iprop{c}".format(c=propcnt)] = prop
+                inst.update(solutionInstanceId=solInstId, solutionInstanceName="{s} {e}".format(s=solutionId, e=env),
+                            environment=env, solution=dict(solutionId=solutionId), contactPersons=[],
+                            solutionInstanceComponents=comps, solutionInstanceProperties=props)
+                instances.append(inst)
+            sol["solutionInstances"] = instances
+            contacts = []
+            for person in self.rnd.sample(self.persons, min(len(self.persons), self.rnd.randint(0, 2))):
+                contact = self._meta()
+                contact.update(role="Solution Owner", solutionId=solutionId, person=dict(email=person["email"]))
+                contacts.append(contact)
+            sol["contactPersons"] = contacts
+            props = []
+            for propcnt in range(self.rnd.randint(0, 3)):
+                prop = self._meta()
+                prop.update(propertyName="sprop{c}".format(c=propcnt), propertyValue=str(propcnt),
+                            solutionId=solutionId, self="self")
+                props.append(prop)
+            sol["solutionProperties"] = props
+        for cnt in range(len(solIds) // 2):
+            fromId, toId = self.rnd.sample(solIds, 2) if len(solIds) > 1 else (solIds[0], solIds[0])
+            rel = self._meta()
+            rel.update(solutionToSolutionId="rel{c}".format(c=cnt), connectionType="Interface",
+                       fromSolution=dict(solutionId=fromId), toSolution=dict(solutionId=toId),
+                       solutionToSolutionProperties=[])
+            self.solutions[fromId]["fromSolution"].append(rel)
+            self.solutions[toId]["toSolution"].append(rel)
+
+    def get(self, segments, query):
+        """
+        This method handles a GET call.
+
+        :param segments: Path segments after /murcs/rest/.
+        :param query: Parsed query string.
+        :return: Tuple with http status and json reply (bytes).
+        """
+        with self.lock:
+            status, body = self._get(segments, query)
+            return status, json.dumps(body).encode("utf-8")
+
+    def _get(self, segments, query):
+        if segments == ["version"]:
+            return 200, dict(murcsVersion="sim", databaseVersion="sim", murcsBuild="0", murcsNode="sim")
+        segments = segments[1:]
+        if len(segments) == 1 and segments[0] in ["sites", "persons", "servers", "solutions"]:
+            objtype = segments[0]
+            if objtype == "sites":
+                items = self.sites
+            elif objtype == "persons":
+                items = self.persons
+            elif objtype == "servers":
+                items = [self.server_list_item(srv) for srv in self.servers.values()]
+            else:
+                items = [self.solution_list_item(sol) for sol in self.solutions.values()]
+            start = int(query.get("start", ["0"])[0])
+            limit = int(query.get("limit", ["100"])[0])
+            return 200, dict(items=items[start:start + limit], totalResults=len(items))
+        if len(segments) == 2 and segments[0] == "servers" and segments[1] in self.servers:
+            return 200, self.server_detail(self.servers[segments[1]])
+        if len(segments) == 3 and segments[0] == "servers" and segments[1] in self.servers \
+                and segments[2] == "softwareInstances":
+            return 200, self.servers[segments[1]]["detail"]["softwareInstances"]
+        if len(segments) == 3 and segments[:2] == ["solutionToSolution", "all"] and segments[2] in self.solutions:
+            sol = self.solutions[segments[2]]
+            return 200, dict(items=sol["fromSolution"] + sol["toSolution"])
+        if len(segments) >= 2 and segments[0] == "solutions" and segments[1] in self.solutions:
+            sol = self.solutions[segments[1]]
+            if len(segments) == 2:
+                return 200, sol
+            if len(segments) == 3 and segments[2] == "solutionInstances":
+                return 200, [dict(key=inst["solutionInstanceId"]) for inst in sol["solutionInstances"]]
+            if len(segments) == 4 and segments[2] == "solutionInstances":
+                for inst in sol["solutionInstances"]:
+                    if inst["solutionInstanceId"] == segments[3]:
+                        return 200, inst
+        return 404, dict(message="Not found: {p}".format(p="/".join(segments)))
+
+    def apply(self, method, segments, body):
+        """
+        This method applies a write call on the servers and solutions of the dataset, so the change shows up in the
+        next GET call. Other write calls are only registered in writes.
+
+        :param method: PUT or DELETE
+        :param segments: Path segments after the clientId.
+        :param body: Request body.
+        :return:
+        """
+        with self.lock:
+            self.writes.append((method, "/".join(segments), body))
+            if len(segments) != 2 or segments[0] not in ["servers", "solutions"]:
+                return
+            objects = self.servers if segments[0] == "servers" else self.solutions
+            if method == "DELETE":
+                objects.pop(segments[1], None)
+                return
+            rec = objects.get(segments[1])
+            if rec is None:
+                rec = self._meta()
+                if segments[0] == "servers":
+                    rec["detail"] = dict(serverNetworkInterfaces=[], contactPersons=[], serverProperties=[],
+                                         softwareInstances=[])
+                else:
+                    rec.update(toSolution=[], fromSolution=[], solutionInstances=[], contactPersons=[],
+                               solutionProperties=[])
+                objects[segments[1]] = rec
+            try:
+                rec.update(json.loads(body))
+            except ValueError:
+                pass
+            rec["version"] = str(int(rec["version"]) + 1)
+            rec["changedAt"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        return
+
+    @staticmethod
+    def server_list_item(srv):
+        return {k: v for k, v in srv.items() if k != "detail"}
+
+    @staticmethod
+    def server_detail(srv):
+        rec = {k: v for k, v in srv.items() if k != "detail"}
+        rec.update(srv["detail"])
+        return rec
+
+    @staticmethod
+    def solution_list_item(sol):
+        skip = ["toSolution", "fromSolution", "solutionInstances", "contactPersons", "solutionProperties"]
+        return {k: v for k, v in sol.items() if k not in skip}
+
+
+class MurcsSimHandler(BaseHTTPRequestHandler):
+    """
+    Request handler for the Murcs stand-in. The server object carries the dataset and the fault injection settings.
+    """
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        logging.debug("Sim: " + format % args)
+
+    def _reply(self, status, body=None):
+        if body is None:
+            payload = b""
+        elif isinstance(body, bytes):
+            payload = body
+        else:
+            payload = json.dumps(body).encode("utf-8")
+        etag = None
+        if self.command == "GET" and status == 200 and self.server.cfg.get("etag"):
+            etag = '"{h}"'.format(h=hashlib.sha1(payload).hexdigest())
+            if self.headers.get("If-None-Match") == etag:
+                self.server.counter["304"] += 1
+                status, payload = 304, b""
+        self.send_response(status)
+        if etag:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _delay_or_fail(self):
+        cfg = self.server.cfg
+        delay = cfg["latency"] + random.uniform(0, cfg["jitter"])
+        if delay > 0:
+            time.sleep(delay)
+        if random.random() < cfg["error_rate"]:
+            self._reply(503, dict(message="Injected error"))
+            return True
+        return False
+
+    def _route(self):
+        parts = urlsplit(self.path)
+        segments = [unquote(seg) for seg in parts.path.split("/") if seg]
+        query = parse_qs(parts.query)
+        # Expected path: /murcs/rest/version or /murcs/rest/<clientId>/<objects...>
+        return segments[2:], query
+
+    def do_GET(self):
+        self.server.counter["GET"] += 1
+        if self._delay_or_fail():
+            return
+        segments, query = self._route()
+        status, body = self.server.data.get(segments, query)
+        return self._reply(status, body)
+
+    def _write(self):
+        self.server.counter[self.command] += 1
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        if self._delay_or_fail():
+            return
+        segments, query = self._route()
+        self.server.data.apply(self.command, segments[1:], body)
+        return self._reply(200)
+
+    def do_PUT(self):
+        self._write()
+
+    def do_DELETE(self):
+        self._write()
+
+
+class MurcsSimServer(ThreadingHTTPServer):
+    """
+    This class is the http server for the Murcs stand-in, with a thread per connection.
+    """
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients that disconnect are normal in load tests, other errors are logged.
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        logging.exception("Sim: error for {c}".format(c=client_address))
+
+
+class MurcsSim:
+    """
+    This class runs the Murcs stand-in. The settings in cfg (latency, jitter, error_rate, etag) and the call counters
+    can be changed and read while the stand-in is running.
+    """
+
+    def __init__(self, data=None, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0, etag=False):
+        """
+        :param data: MurcsData object, default a dataset with default size.
+        :param host: Address to listen on.
+        :param port: Port to listen on, 0 for a free port.
+        :param latency: Delay in seconds for every call.
+        :param jitter: Maximum additional random delay in seconds.
+        :param error_rate: Fraction of calls that get a 503 reply.
+        :param etag: If True, then GET replies have an ETag header and If-None-Match is answered with 304.
+        """
+        self.data = data or MurcsData()
+        self.httpd = MurcsSimServer((host, port), MurcsSimHandler)
+        self.httpd.data = self.data
+        self.httpd.cfg = dict(latency=latency, jitter=jitter, error_rate=error_rate, etag=etag)
+        self.httpd.counter = collections.Counter()
+        self.host, self.port = self.httpd.server_address
+        self.thread = None
+
+    def start(self):
+        """
+        This method starts the stand-in in a background thread.
+
+        :return: MurcsSim object.
+        """
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        logging.info("Murcs stand-in on {h}:{p}".format(h=self.host, p=self.port))
+        return self
+
+    def serve_forever(self):
+        """
+        This method runs the stand-in in the current thread, until interrupted.
+
+        :return:
+        """
+        logging.info("Murcs stand-in on {h}:{p}".format(h=self.host, p=self.port))
+        try:
+            self.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        self.httpd.server_close()
+        return
+
+    def stop(self):
+        """
+        This method stops the stand-in that runs in a background thread.
+
+        :return:
+        """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        return
@@ -11,6 +11,8 @@ import os
 import platform
 import sys
 import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv
 
@@ -167,15 +169,79 @@ def run_script(path, script_name, *args):
     :param path: Full path to the script.
     :param script_name: Name of the script. Include .py if this is the script extension.
     :param args: List of script arguments.
-    :return:
+    :return: CompletedProcess object, returncode is 0 if the script ended without error.
     """
     script_path = os.path.join(path, script_name)
     cmd = [sys.executable, script_path] + list(args)
     # logging.info(cmd)
-    subprocess.run(cmd, env=os.environ.copy())
+    return subprocess.run(cmd, env=os.environ.copy())
+
+
+def publish_file(src, dst, link=None):
+    """
+    This function renames a file that is complete to its final name. The rename is atomic, a reader sees the previous
+    file or the new file, never a partial file. The file is synced to disk before the rename.
+    Optionally a symbolic link is pointed to the new file, the link is replaced atomically as well.
+
+    :param src: Full path of the file.
+    :param dst: Full path of the final name, an existing file is replaced.
+    :param link: Full path of the symbolic link, or None.
+    :return:
+    """
+    with open(src, "rb") as fh:
+        os.fsync(fh.fileno())
+    os.replace(src, dst)
+    if link:
+        tmplink = "{l}.tmp".format(l=link)
+        if os.path.lexists(tmplink):
+            os.remove(tmplink)
+        os.symlink(os.path.relpath(dst, os.path.dirname(link)), tmplink)
+        os.replace(tmplink, link)
+    # Sync the directory, so the renames survive a crash.
+    try:
+        dirfd = os.open(os.path.dirname(dst), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dirfd)
+    except OSError:
+        pass
+    finally:
+        os.close(dirfd)
     return
 
 
+def ordered_map(func, iterable, workers):
+    """
+    This function calls func for every item in iterable on a pool of worker threads. Results are yielded in the order
+    of the iterable. At most 2 * workers calls are running or waiting ahead of the result that is yielded, so results
+    do not pile up in memory when the consumer is slower than the workers.
+    If workers is 1 or less, then the calls are done in the calling thread.
+
+    :param func: Function to call for every item.
+    :param iterable: Items to handle.
+    :param workers: Number of worker threads.
+    :return: Generator with the function results, in the order of the iterable.
+    """
+    if workers <= 1:
+        for item in iterable:
+            yield func(item)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        try:
+            for item in iterable:
+                pending.append(executor.submit(func, item))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # Do not start calls that are not required anymore (exception or consumer stopped).
+            for future in pending:
+                future.cancel()
+
+
 class LoopInfo:
     """
     This class handles a FOR loop information handling.
@@ -1,65 +1,138 @@
 """
 This script will collect information from Murcs and store it in a local database.
+In incremental mode (--previous) the server and solution lists are compared with the previous snapshot database. Only
+servers and solutions with a new changedAt or version are collected from Murcs, detail information for the other servers
+and solutions is copied from the previous snapshot.
+Progress is remembered in the progress table. With --resume an interrupted run continues where it stopped: stages and
+objects that are done are skipped, rows of unfinished stages and objects are removed and collected again.
+In bulk mode (--bulk) every stage is loaded in one transaction, an interrupted stage is collected again on resume.
+With --memory the database is built in memory and written to the database file at the end, see LOCALDB_MEMORY_LIMIT.
 """
+import argparse
 import logging
+import os
 from lib import localstore
 from lib import my_env
 from lib.murcs import *
 from lib import murcsrest
 
-solToSol_done = []
+solToSol_done = set()
 
+parser = argparse.ArgumentParser(description="Collect Murcs information into the local database.")
+parser.add_argument("--previous", help="Previous snapshot database. Only changed servers and solutions are collected "
+                                       "from Murcs, the others are copied from this database.")
+parser.add_argument("--resume", action="store_true", help="Continue an interrupted run on the same database.")
+parser.add_argument("--bulk", action="store_true", help="Bulk load mode: loader pragmas and one transaction per stage.")
+parser.add_argument("--memory", action="store_true", help="Build the database in memory, write it to file at the end.")
+args = parser.parse_args()
 
 cfg = my_env.init_env("bellavista", __file__)
 r = murcsrest.MurcsRest()
 lcl = localstore.sqliteUtils()
+if args.memory:
+    lcl.set_memory()
+if args.bulk:
+    lcl.set_bulk()
 
-logging.info("Get Version Information")
-res = r.get_version()
-lcl.insert_row("version", res)
+incremental = False
+if args.previous:
+    lcl.attach(args.previous)
+    missing = ["{t}.{k}".format(t=table, k=keycol)
+               for table, keycols in list(srv_detail_tables.items()) + list(sol_detail_tables.items())
+               for keycol in ([keycols] if isinstance(keycols, str) else keycols)
+               if keycol not in lcl.get_columns(table, "prev")]
+    if missing:
+        logging.warning("Previous snapshot {db} has no {m}, full collection required."
+                        .format(db=args.previous, m=", ".join(missing)))
+    else:
+        incremental = True
 
-res = []
-logging.info("Get Site information")
-r.get_data("sites", reslist=res)
-lcl.insert_rows("site", res)
+done_stages = set()
+if args.resume:
+    done_stages = lcl.get_done("stage")
+    logging.info("Resume run, stages done: {s}".format(s=", ".join(sorted(done_stages))))
+    # Stages that are not done are collected again.
+    for table in ["version", "site", "person", "server", "solution"]:
+        if table not in done_stages:
+            lcl.remove_unfinished(table, "stage")
 
-logging.info("Handling Person information")
-res = []
-r.get_data("persons", reslist=res)
-lcl.insert_rows("person", res)
+if "version" not in done_stages:
+    logging.info("Get Version Information")
+    res = r.get_version()
+    lcl.insert_row("version", res)
+    lcl.mark_done("stage", "version")
+    lcl.commit()
 
-logging.info("Handling Servers")
-res = []
-r.get_data("servers", reslist=res)
-for cnt in range(len(res)):
-    res[cnt]["parentServer"] = handle_server(res[cnt]["parentServer"])
-    res[cnt]["siteId"] = handle_site(res[cnt].pop("site"))
-    # Todo: process State variable
-    res[cnt]["status"] = None
-lcl.insert_rows("server", res)
+if "site" not in done_stages:
+    logging.info("Get Site information")
+    for res in r.iter_data("sites"):
+        lcl.insert_rows("site", res)
+    lcl.mark_done("stage", "site")
+    lcl.commit()
+
+if "person" not in done_stages:
+    logging.info("Handling Person information")
+    for res in r.iter_data("persons"):
+        lcl.insert_rows("person", res)
+    lcl.mark_done("stage", "person")
+    lcl.commit()
+
+if "server" not in done_stages:
+    logging.info("Handling Servers")
+    for res in r.iter_data("servers"):
+        for cnt in range(len(res)):
+            res[cnt]["parentServer"] = handle_server(res[cnt]["parentServer"])
+            res[cnt]["siteId"] = handle_site(res[cnt].pop("site"))
+            # Todo: process State variable
+            res[cnt]["status"] = None
+        lcl.insert_rows("server", res)
+    lcl.mark_done("stage", "server")
+    lcl.commit()
 
 logging.info("Handling Server detail information")
 query = "SELECT serverId FROM server"
-records = lcl.get_query(query)
+serverIds = [record["serverId"] for record in lcl.get_query(query)]
+if incremental:
+    changed = lcl.get_changed("server", "serverId")
+    unchanged = [serverId for serverId in serverIds if serverId not in changed]
+    serverIds = [serverId for serverId in serverIds if serverId in changed]
+    logging.info("{c} servers changed, {u} servers copied from {db}"
+                 .format(c=len(serverIds), u=len(unchanged), db=args.previous))
+if args.resume:
+    # Remove rows of the server that was in progress, then continue with the servers that are not done.
+    done = lcl.get_done("serverdetail")
+    for table, keycol in srv_detail_tables.items():
+        lcl.remove_unfinished(table, "serverdetail", keycol)
+    serverIds = [serverId for serverId in serverIds if serverId not in done]
+    if incremental:
+        unchanged = [serverId for serverId in unchanged if serverId not in done]
+    disc_sw += [record["softwareId"] for record in lcl.get_query("SELECT softwareId FROM software")]
+    logging.info("{d} servers done, {c} servers to collect".format(d=len(done), c=len(serverIds)))
 my_loop = my_env.LoopInfo("Server Details", 20)
-for record in records:
+# Server details are collected by MURCS_MAX_INFLIGHT threads (MURCS_MAX_INFLIGHT=1 for a serial run). Results are
+# handled in serverId order in this thread, which is the only writer to the database, so the result is the same as for a
+# serial run.
+for serverId, res in zip(serverIds, r.fan_out(r.get_server, serverIds)):
     my_loop.info_loop()
-    serverId = record["serverId"]
-    res = r.get_server(serverId)
     netinfo = res.pop("serverNetworkInterfaces")
     if len(netinfo) > 0:
         for cnt in range(len(netinfo)):
             netinfo[cnt]["serverId"] = serverId
             ipaddress_list = netinfo[cnt].pop("serverNetworkInterfaceIPAddresses")
             if len(ipaddress_list) > 0:
+                for ipaddress in ipaddress_list:
+                    ipaddress["serverId"] = serverId
                 lcl.insert_rows("ipaddress", ipaddress_list)
         lcl.insert_rows("netiface", netinfo)
     contacts = res.pop("contactPersons")
     if len(contacts) > 0:
         for cnt in range(len(contacts)):
             contacts[cnt]["email"] = handle_person(contacts[cnt].pop("person"))
+            contacts[cnt]["serverId"] = serverId
         lcl.insert_rows("contactserver", contacts)
     serverproperties = handle_properties(res.pop("serverProperties"))
+    for serverproperty in serverproperties:
+        serverproperty["serverId"] = serverId
     lcl.insert_rows("serverproperty", serverproperties)
     softinstances = res.pop("softwareInstances")
     if len(softinstances) > 0:
@@ -69,23 +142,54 @@ for record in records:
             if isinstance(swdict, dict):
                 lcl.insert_row("software", swdict)
         lcl.insert_rows("softinst", softinstances)
+    lcl.mark_done("serverdetail", serverId)
+my_loop.end_loop()
+if incremental:
+    for table, keycol in srv_detail_tables.items():
+        lcl.copy_rows(table, keycol, unchanged)
+    lcl.mark_done("serverdetail", unchanged)
+    # Software is collected from the software instances, add software for the instances that have been copied.
+    query = "SELECT DISTINCT softwareId FROM softinst WHERE softwareId NOT IN (SELECT softwareId FROM software)"
+    softwareIds = [record["softwareId"] for record in lcl.get_query(query)]
+    lcl.copy_rows("software", "softwareId", softwareIds)
+    disc_sw += softwareIds
+lcl.commit()
 
-logging.info("Collecting Solutions")
-res = []
-r.get_data("solutions", reslist=res)
-for cnt in range(len(res)):
-    # Todo: process State variable
-    res[cnt]["status"] = None
-lcl.insert_rows("solution", res)
+if "solution" not in done_stages:
+    logging.info("Collecting Solutions")
+    for res in r.iter_data("solutions"):
+        for cnt in range(len(res)):
+            # Todo: process State variable
+            res[cnt]["status"] = None
+        lcl.insert_rows("solution", res)
+    lcl.mark_done("stage", "solution")
+    lcl.commit()
 
 logging.info("Handling Solutions")
 query = "SELECT solutionId FROM solution"
-records = lcl.get_query(query)
+solIds = [record["solutionId"] for record in lcl.get_query(query)]
+if incremental:
+    changed = lcl.get_changed("solution", "solutionId")
+    unchanged = [solId for solId in solIds if solId not in changed]
+    solIds = [solId for solId in solIds if solId in changed]
+    logging.info("{c} solutions changed, {u} solutions copied from {db}"
+                 .format(c=len(solIds), u=len(unchanged), db=args.previous))
+if args.resume:
+    # Relations of an unfinished solution are removed, they are collected again with the solution.
+    done = lcl.get_done("solutiondetail")
+    for table, keycol in sol_detail_tables.items():
+        lcl.remove_unfinished(table, "solutiondetail", keycol)
+    solIds = [solId for solId in solIds if solId not in done]
+    if incremental:
+        unchanged = [solId for solId in unchanged if solId not in done]
+    solToSol_done.update(record["solutionToSolutionId"]
+                         for record in lcl.get_query("SELECT solutionToSolutionId FROM soltosol"))
+    logging.info("{d} solutions done, {c} solutions to collect".format(d=len(done), c=len(solIds)))
 my_loop = my_env.LoopInfo("Solutions", 20)
-for record in records:
+# Solutions are collected concurrently, but handled in solutionId order so the first appearance of a solToSol relation
+# is the same as in a serial run.
+for res in r.fan_out(r.get_solution, solIds):
     my_loop.info_loop()
-    solId = record["solutionId"]
-    res = r.get_solution(solId)
     if len(res) > 0:
         solutionId = res.pop("solutionId")
         solToSol_res = handle_solToSol(res.pop("toSolution"), solToSol_done)
@@ -94,6 +198,8 @@ for record in records:
         lcl.insert_rows("soltosol", solToSol_res)
         solInstance_res, solInstComp_res, solInstProps = handle_solutionInstance(res.pop("solutionInstances"),
                                                                                  solutionId)
+        for solInstProp in solInstProps:
+            solInstProp["solutionId"] = solutionId
         lcl.insert_rows("solinst", solInstance_res)
         lcl.insert_rows("solinstcomp", solInstComp_res)
         lcl.insert_rows("solinstproperty", solInstProps)
@@ -101,9 +207,32 @@ for record in records:
         if len(contacts) > 0:
             for cnt in range(len(contacts)):
                 contacts[cnt]["email"] = handle_person(contacts[cnt].pop("person"))
+                contacts[cnt]["solutionId"] = solutionId
             lcl.insert_rows("contactsolution", contacts)
         solprops = handle_properties(res.pop("solutionProperties"))
+        for solprop in solprops:
+            solprop["solutionId"] = solutionId
         lcl.insert_rows("solutionproperty", solprops)
+        lcl.mark_done("solutiondetail", solutionId)
 my_loop.end_loop()
+if incremental:
+    # Relations with a changed solution have been collected already.
+    for table, keycol in sol_detail_tables.items():
+        lcl.copy_rows(table, keycol, unchanged,
+                      uniquecol="solutionToSolutionId" if table == "soltosol" else None)
+    lcl.mark_done("solutiondetail", unchanged)
+for tablename, cols in lcl.create_indexes():
+    logging.error("No unique index on {c} of {t}, the snapshot has duplicate natural keys."
+                  .format(c=", ".join(cols), t=tablename))
+for scan in lcl.check_indexes():
+    logging.warning("No index used: {s}".format(s=scan))
+if args.bulk:
+    lcl.end_bulk()
+if args.memory:
+    lcl.end_memory()
 
+logging.info("Connection stats: {s}".format(s=r.get_connection_stats()))
+logging.info("Concurrency stats: {s}".format(s=r.get_limiter_stats()))
+logging.info("Cache stats: {s}".format(s=r.get_cache_stats()))
+r.write_metrics(os.path.join(os.getenv("MURCS_METRICSDIR", os.getenv("LOGDIR")), "murcs_Get_metrics"))
 logging.info("End Application")
@@ -0,0 +1,54 @@
+"""
+This script will bring Murcs in the desired state for servers, software instances and solution instance components.
+The desired state is compared with the local database, so run murcs_Get.py first for a recent snapshot.
+Objects in the local database that are not in the desired state are removed, for the object types that are given.
+With --journal the calls are written to a journal before they are sent. If the run is interrupted, --resume sends the
+calls from the journal that are not done. --dry-run writes the journal and does not send anything.
+"""
+import argparse
+import logging
+from lib import localstore
+from lib import my_env
+from lib import murcsjournal
+from lib import murcsreconcile
+from lib import murcsrest
+
+parser = argparse.ArgumentParser(description="Reconcile Murcs with a desired state.")
+parser.add_argument("--desired", help="json file with servers, softinst and solinstcomp lists.")
+parser.add_argument("--servers", help="csv or json file with the desired servers.")
+parser.add_argument("--softinst", help="csv or json file with the desired software instances.")
+parser.add_argument("--solinstcomp", help="csv or json file with the desired solution instance components.")
+parser.add_argument("--no-remove", action="store_true", help="Do not remove objects that are not in the desired state.")
+parser.add_argument("--dry-run", action="store_true", help="Log the calls and write the journal, do not send them.")
+parser.add_argument("--journal", help="Journal file for the calls.")
+parser.add_argument("--resume", action="store_true", help="Send the calls from the journal that are not done.")
+parser.add_argument("--workers", type=int, help="Number of threads to send the calls.")
+args = parser.parse_args()
+
+cfg = my_env.init_env("bellavista", __file__)
+logging.info("Start application")
+desired = murcsreconcile.load_desired(args.desired) if args.desired else {}
+for objtype in murcsreconcile.object_types:
+    filename = getattr(args, objtype)
+    if filename:
+        desired[objtype] = murcsreconcile.load_records(filename)
+if args.resume and not args.journal:
+    parser.error("--resume needs a --journal.")
+if not (desired or args.resume):
+    parser.error("No desired state given.")
+journal = murcsjournal.Journal(args.journal) if args.journal else None
+r = murcsrest.MurcsRest()
+if args.resume:
+    with r.batch(args.workers, ordered=True, journal=journal, dry_run=args.dry_run) as batch:
+        batch.resume()
+    report = batch.report
+else:
+    lcl = localstore.sqliteUtils()
+    rec = murcsreconcile.Reconciler(r, lcl, remove=not args.no_remove)
+    report = rec.run(desired, workers=args.workers, dry_run=args.dry_run, journal=journal)
+if journal:
+    journal.close()
+for item in report:
+    if item["error"]:
+        logging.error("{o} {a} failed: {e}".format(o=item["operation"], a=item["args"], e=item["error"]))
+logging.info("End application")
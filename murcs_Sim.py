@@ -0,0 +1,31 @@
+"""
+This script runs a local stand-in for the Murcs Rest server with a synthetic dataset. Point MURCS_HOST and MURCS_PORT
+to the stand-in to run murcs_Get.py or the write scripts without a connection to Murcs, e.g. for load tests.
+"""
+import argparse
+import logging
+from lib import my_env
+from lib.murcssim import MurcsData, MurcsSim
+
+parser = argparse.ArgumentParser(description="Run a local Murcs stand-in with a synthetic dataset.")
+parser.add_argument("--host", default="127.0.0.1", help="Address to listen on.")
+parser.add_argument("--port", type=int, default=8080, help="Port to listen on.")
+parser.add_argument("--servers", type=int, default=100, help="Number of servers.")
+parser.add_argument("--solutions", type=int, default=20, help="Number of solutions.")
+parser.add_argument("--sites", type=int, default=5, help="Number of sites.")
+parser.add_argument("--persons", type=int, default=20, help="Number of persons.")
+parser.add_argument("--seed", type=int, default=0, help="Seed for the dataset.")
+parser.add_argument("--latency", type=float, default=0.0, help="Delay in seconds for every call.")
+parser.add_argument("--jitter", type=float, default=0.0, help="Maximum additional random delay in seconds.")
+parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls that get a 503 reply.")
+parser.add_argument("--etag", action="store_true", help="Add ETag headers and answer If-None-Match with 304.")
+args = parser.parse_args()
+
+cfg = my_env.init_env("bellavista", __file__)
+data = MurcsData(servers=args.servers, solutions=args.solutions, sites=args.sites, persons=args.persons,
+                 seed=args.seed)
+sim = MurcsSim(data, host=args.host, port=args.port, latency=args.latency, jitter=args.jitter,
+               error_rate=args.error_rate, etag=args.etag)
+sim.serve_forever()
+logging.info("Calls: {c}".format(c=dict(sim.httpd.counter)))
+logging.info("End application")
@@ -1,5 +1,6 @@
 """
 This procedure will rebuild the sqlite BellaVista database
+To refresh a database that is in use without a rebuild, see refresh_db.py.
 """
 
 import logging
@@ -0,0 +1,41 @@
+"""
+This script refreshes a database in place from a snapshot, instead of a rebuild. Rows are upserted on the natural keys
+and rows that disappeared from Murcs are deleted, unchanged rows are not touched. Readers of the database keep their
+connection and their page cache. The number of inserted, updated and deleted rows is reported per table.
+By default the latest snapshot in DBDIR refreshes the sqlite database LOCALDB. With --mysql the MySQL database from the
+ini file is refreshed. If a natural key has duplicate values, then nothing is refreshed and the script ends with an
+error.
+"""
+import argparse
+import logging
+import os
+import platform
+import sys
+from lib import localstore
+from lib import my_env
+
+parser = argparse.ArgumentParser(description="Refresh a database in place from a snapshot.")
+parser.add_argument("--snapshot", help="Snapshot database, default the latest snapshot in DBDIR.")
+parser.add_argument("--mysql", action="store_true", help="Refresh the MySQL database instead of LOCALDB.")
+args = parser.parse_args()
+
+cfg = my_env.init_env("bellavista", __file__)
+snapshot = args.snapshot or os.path.join(os.getenv("DBDIR"), "{host}_latest.db".format(host=platform.node()))
+logging.info("Refresh from snapshot {s}".format(s=snapshot))
+try:
+    if args.mysql:
+        counts = localstore.mysqlUtils(cfg).refresh(localstore.sqliteUtils(snapshot))
+    else:
+        lcl = localstore.sqliteUtils()
+        if not lcl.dbConn:
+            # First run, create the database.
+            lcl.rebuild()
+            lcl = localstore.sqliteUtils()
+        counts = lcl.refresh(snapshot)
+except localstore.DuplicateKeyError as e:
+    logging.error(e)
+    sys.exit(1)
+for tablename, cnt in counts.items():
+    logging.info("{t}: {i} inserted, {u} updated, {d} deleted".format(t=tablename, i=cnt["inserted"],
+                                                                      u=cnt["updated"], d=cnt["deleted"]))
+logging.info("End application")
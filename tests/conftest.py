@@ -0,0 +1,71 @@
+"""
+Shared fixtures: the lib package on the path, a clean Murcs environment and a local Murcs stand-in (lib.murcssim).
+"""
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.murcssim import MurcsData, MurcsSim, MurcsSimHandler  # noqa: E402
+
+
+@pytest.fixture
+def murcs_env(monkeypatch, tmp_path):
+    """
+    Environment without MURCS_ settings of the caller, without retry delays and with DBDIR in a temporary directory.
+    """
+    for key in list(os.environ):
+        if key.startswith("MURCS_") or key.startswith("LOCALDB"):
+            monkeypatch.delenv(key)
+    monkeypatch.setenv("MURCS_CLIENTID", "sim")
+    monkeypatch.setenv("MURCS_USER", "user")
+    monkeypatch.setenv("MURCS_PWD", "pwd")
+    monkeypatch.setenv("MURCS_BACKOFF", "0")
+    monkeypatch.setenv("DBDIR", str(tmp_path))
+    return monkeypatch
+
+
+@pytest.fixture
+def sim(murcs_env):
+    """
+    Murcs stand-in with a small dataset, MURCS_HOST and MURCS_PORT point to it.
+    """
+    stand_in = MurcsSim(MurcsData(servers=30, solutions=6, sites=3, persons=5)).start()
+    murcs_env.setenv("MURCS_HOST", stand_in.host)
+    murcs_env.setenv("MURCS_PORT", str(stand_in.port))
+    yield stand_in
+    stand_in.stop()
+
+
+@pytest.fixture
+def rejected(monkeypatch):
+    """
+    Set of path fragments: write calls to the stand-in with one of these fragments in the path get a 400 reply.
+    """
+    marks = set()
+    write = MurcsSimHandler._write
+
+    def reject_or_write(handler):
+        if any(mark in handler.path for mark in marks):
+            handler.rfile.read(int(handler.headers.get("Content-Length", 0)))
+            handler.server.counter["rejected"] += 1
+            return handler._reply(400, dict(message="Rejected by test"))
+        return write(handler)
+
+    monkeypatch.setattr(MurcsSimHandler, "_write", reject_or_write)
+    return marks
+
+
+@pytest.fixture
+def snapshot(murcs_env, tmp_path):
+    """
+    Empty snapshot database murcs.db in DBDIR, LOCALDB points to it.
+    """
+    from lib.localstore import sqliteUtils
+    murcs_env.setenv("LOCALDB", "murcs.db")
+    sqliteUtils().rebuild()
+    lcl = sqliteUtils()
+    yield lcl
+    if lcl.dbConn:
+        lcl.dbConn.close()
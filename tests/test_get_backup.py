@@ -0,0 +1,37 @@
+import datetime
+import os
+import platform
+import subprocess
+import sys
+from lib.localstore import sqliteUtils
+from lib.murcssim import MurcsData, MurcsSim
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_backup(murcs_env, tmp_path, *args):
+    murcs_env.setenv("LOGDIR", str(tmp_path))
+    murcs_env.setenv("LOGLEVEL", "warning")
+    return subprocess.run([sys.executable, os.path.join(root, "get_backup.py")] + list(args), env=dict(os.environ),
+                          capture_output=True, text=True)
+
+
+def test_snapshot_is_published_and_checked(sim, murcs_env, tmp_path):
+    dbname = "{h}_{d}.db".format(h=platform.node(), d=datetime.datetime.now().strftime("%Y%m%d"))
+    latest = str(tmp_path / "{h}_latest.db".format(h=platform.node()))
+    r = get_backup(murcs_env, tmp_path)
+    assert r.returncode == 0, r.stderr
+    assert os.readlink(latest) == dbname
+    assert not (tmp_path / (dbname + ".tmp")).exists()
+    assert sqliteUtils(latest).get_counts()["server"] == 30
+    # A snapshot that shrinks below SNAPSHOT_MIN_RATIO of the latest snapshot is not published.
+    small = MurcsSim(MurcsData(servers=10, solutions=6, sites=3, persons=5)).start()
+    try:
+        murcs_env.setenv("MURCS_PORT", str(small.port))
+        r = get_backup(murcs_env, tmp_path)
+    finally:
+        small.stop()
+    assert r.returncode == 1
+    assert "Table server has 10 rows, latest snapshot has 30 rows" in r.stderr
+    assert (tmp_path / (dbname + ".tmp")).exists()
+    assert sqliteUtils(latest).get_counts()["server"] == 30
@@ -0,0 +1,217 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import pytest
+from lib.localstore import DuplicateKeyError, sqliteUtils
+
+
+def site_rows(lcl):
+    return [tuple(row) for row in lcl.get_query("SELECT siteId, town, region FROM site ORDER BY siteId")]
+
+
+def test_insert_rows_missing_keys_are_null(snapshot):
+    snapshot.insert_rows("site", [dict(siteId="a", town="A"), dict(siteId="b", region="R")])
+    assert site_rows(snapshot) == [("a", "A", None), ("b", None, "R")]
+
+
+def test_insert_rows_unknown_key_raises(snapshot):
+    with pytest.raises(sqlite3.OperationalError, match="no column named notAColumn"):
+        snapshot.insert_rows("site", [dict(siteId="a", town="A"), dict(siteId="b", notAColumn="x")])
+    assert site_rows(snapshot) == []
+    snapshot.insert_rows("site", [dict(siteId="c")])
+    assert site_rows(snapshot) == [("c", None, None)]
+
+
+def test_insert_rows_duplicate_is_logged_and_skipped(snapshot, caplog):
+    snapshot.dbConn.execute("CREATE UNIQUE INDEX uq_test ON site (siteId)")
+    snapshot.insert_rows("site", [dict(siteId="a", town="A")])
+    snapshot.insert_rows("site", [dict(siteId="b", town="B"), dict(siteId="a", town="X"), dict(siteId="c")])
+    assert site_rows(snapshot) == [("a", "A", None), ("b", "B", None), ("c", None, None)]
+    assert "Integrity Error" in caplog.text
+
+
+def test_bulk_rows_are_committed_per_stage(snapshot):
+    snapshot.set_bulk()
+    snapshot.insert_rows("site", [dict(siteId="a")])
+    reader = sqliteUtils()
+    assert site_rows(reader) == []
+    snapshot.commit()
+    assert site_rows(reader) == [("a", None, None)]
+    snapshot.insert_rows("site", [dict(siteId="b")])
+    reader.dbConn.close()
+    snapshot.end_bulk()
+    assert len(site_rows(sqliteUtils())) == 2
+    assert snapshot.get_query("PRAGMA journal_mode")[0][0] == "delete"
+
+
+def test_memory_load_is_written_at_end(snapshot):
+    snapshot.insert_rows("site", [dict(siteId="a")])
+    snapshot.set_memory()
+    snapshot.set_bulk()
+    snapshot.insert_rows("site", [dict(siteId="b")])
+    snapshot.commit()
+    assert site_rows(sqliteUtils()) == [("a", None, None)]
+    snapshot.end_bulk()
+    snapshot.end_memory()
+    assert not snapshot.memory
+    assert len(site_rows(sqliteUtils())) == 2
+    # The load continues on the file.
+    snapshot.insert_rows("site", [dict(siteId="c")])
+    assert len(site_rows(sqliteUtils())) == 3
+
+
+def test_memory_load_without_database_file(murcs_env, tmp_path):
+    murcs_env.setenv("LOCALDB", "new.db")
+    lcl = sqliteUtils()
+    lcl.set_memory()
+    lcl.insert_rows("site", [dict(siteId="a")])
+    assert not (tmp_path / "new.db").exists()
+    lcl.end_memory()
+    assert site_rows(sqliteUtils()) == [("a", None, None)]
+
+
+def test_memory_limit_continues_on_disk(snapshot, murcs_env, caplog):
+    murcs_env.setenv("LOCALDB_MEMORY_LIMIT", "0")
+    snapshot.set_memory()
+    snapshot.set_bulk()
+    snapshot.insert_rows("site", [dict(siteId="a")])
+    assert not snapshot.memory
+    assert "load continues on disk" in caplog.text
+    snapshot.insert_rows("site", [dict(siteId="b")])
+    snapshot.end_bulk()
+    snapshot.end_memory()
+    assert len(site_rows(sqliteUtils())) == 2
+
+
+def test_memory_load_is_written_on_exit(snapshot, tmp_path):
+    script = "\n".join([
+        "import sys",
+        "sys.path.insert(0, {root!r})",
+        "from lib.localstore import sqliteUtils",
+        "lcl = sqliteUtils()",
+        "lcl.set_memory()",
+        "lcl.set_bulk()",
+        "lcl.insert_rows('site', [dict(siteId='a')])",
+        "sys.exit('stopped on an error')"
+    ]).format(root=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    r = subprocess.run([sys.executable, "-c", script], env=dict(os.environ), capture_output=True, text=True)
+    assert r.returncode == 1
+    assert site_rows(sqliteUtils()) == [("a", None, None)]
+
+
+def test_create_indexes_enforces_natural_keys(snapshot):
+    assert snapshot.create_indexes() == []
+    assert snapshot.check_unique_keys() == []
+    snapshot.insert_rows("server", [dict(serverId="a")])
+    snapshot.insert_rows("server", [dict(serverId="a")])
+    assert [tuple(row) for row in snapshot.get_query("SELECT serverId FROM server")] == [("a",)]
+    assert snapshot.check_indexes() == []
+
+
+def test_network_interface_is_unique_per_server(snapshot):
+    snapshot.insert_rows("netiface", [dict(serverId="a", networkInterfaceId="eth0"),
+                                      dict(serverId="b", networkInterfaceId="eth0")])
+    assert snapshot.create_indexes() == []
+    assert len(snapshot.get_query("SELECT * FROM netiface")) == 2
+
+
+def test_duplicate_natural_key_is_reported(snapshot, caplog):
+    # Regression: a non-unique index was created under the uq_ name and the key was treated as unique.
+    snapshot.insert_rows("server", [dict(serverId="a"), dict(serverId="a"), dict(serverId="b")])
+    assert snapshot.create_indexes() == [("server", ["serverId"])]
+    assert snapshot.check_unique_keys() == [("server", ["serverId"])]
+    assert "1 duplicate values for serverId in server" in caplog.text
+    names = [row["name"] for row in snapshot.get_query("PRAGMA index_list(server)")]
+    assert "uq_server_serverId" not in names and "ix_server_serverId" in names
+    assert snapshot.get_duplicates("server", ["serverId"]) == 1
+
+
+def test_non_unique_index_with_unique_name_is_replaced(snapshot):
+    snapshot.dbConn.execute("CREATE INDEX uq_server_serverId ON server (serverId)")
+    assert ("server", ["serverId"]) in snapshot.check_unique_keys()
+    assert snapshot.create_indexes() == []
+
+
+def test_null_keys_are_not_duplicates(snapshot):
+    snapshot.insert_rows("netiface", [dict(serverId="a"), dict(serverId="a")])
+    assert snapshot.get_duplicates("netiface", ["serverId", "networkInterfaceId"]) == 0
+    assert snapshot.create_indexes() == []
+
+
+def other_database(tmp_path, name):
+    sqliteUtils(str(tmp_path / name)).rebuild()
+    return sqliteUtils(str(tmp_path / name))
+
+
+def test_refresh_raises_on_duplicate_keys_in_snapshot(snapshot, tmp_path):
+    snapshot.insert_rows("server", [dict(serverId="a", hostName="old")])
+    src = other_database(tmp_path, "src.db")
+    src.insert_rows("server", [dict(serverId="a", hostName="new"), dict(serverId="a", hostName="other")])
+    src.dbConn.close()
+    with pytest.raises(DuplicateKeyError, match=r"server\(serverId\)"):
+        snapshot.refresh(str(tmp_path / "src.db"))
+    assert [tuple(row) for row in snapshot.get_query("SELECT serverId, hostName FROM server")] == [("a", "old")]
+
+
+def test_refresh_raises_on_duplicate_keys_in_database(snapshot, tmp_path):
+    # Regression: the refresh switched silently to matching on all columns.
+    snapshot.insert_rows("server", [dict(serverId="a"), dict(serverId="a")])
+    src = other_database(tmp_path, "src.db")
+    src.insert_rows("server", [dict(serverId="a")])
+    src.dbConn.close()
+    with pytest.raises(DuplicateKeyError):
+        snapshot.refresh(str(tmp_path / "src.db"))
+    assert len(snapshot.get_query("SELECT * FROM server")) == 2
+    assert "src" not in snapshot.attached
+
+
+def refresh_from(snapshot, tmp_path, table, rows):
+    src = other_database(tmp_path, "src.db")
+    src.insert_rows(table, rows)
+    src.dbConn.close()
+    counts = snapshot.refresh(str(tmp_path / "src.db"))
+    (tmp_path / "src.db").unlink()
+    return counts[table]
+
+
+def test_refresh_counts_identical_rows(snapshot, tmp_path):
+    # Regression: identical rows were collapsed, a duplicate row in the snapshot was never inserted.
+    row = dict(serverId="a", email="x@y.z", role="owner")
+    snapshot.insert_rows("contactserver", [row])
+    first_id = snapshot.get_query("SELECT id FROM contactserver")[0][0]
+    assert refresh_from(snapshot, tmp_path, "contactserver", [row, row]) == dict(inserted=1, updated=0, deleted=0)
+    assert len(snapshot.get_query("SELECT * FROM contactserver")) == 2
+    assert refresh_from(snapshot, tmp_path, "contactserver", [row, row]) == dict(inserted=0, updated=0, deleted=0)
+    assert refresh_from(snapshot, tmp_path, "contactserver", [row]) == dict(inserted=0, updated=0, deleted=1)
+    assert [r[0] for r in snapshot.get_query("SELECT id FROM contactserver")] == [first_id]
+
+
+def test_refresh_rows_with_null_values(snapshot, tmp_path):
+    rows = [dict(serverId="a", email=None, role="owner"), dict(serverId="a", email=None, role="owner")]
+    assert refresh_from(snapshot, tmp_path, "contactserver", rows)["inserted"] == 2
+    assert refresh_from(snapshot, tmp_path, "contactserver", rows) == dict(inserted=0, updated=0, deleted=0)
+
+
+def test_refresh_keeps_rows_with_null_key(snapshot, tmp_path):
+    # Regression: rows with a NULL in the natural key never matched and were deleted and inserted on every refresh.
+    rows = [dict(serverId="a", networkInterfaceId=None, macAddress="m1"),
+            dict(serverId="a", networkInterfaceId="eth0", macAddress="m2")]
+    assert refresh_from(snapshot, tmp_path, "netiface", rows) == dict(inserted=2, updated=0, deleted=0)
+    ids = snapshot.get_query("SELECT id FROM netiface ORDER BY id")
+    assert refresh_from(snapshot, tmp_path, "netiface", rows) == dict(inserted=0, updated=0, deleted=0)
+    assert snapshot.get_query("SELECT id FROM netiface ORDER BY id") == ids
+    rows[0]["macAddress"] = "m3"
+    assert refresh_from(snapshot, tmp_path, "netiface", rows) == dict(inserted=1, updated=0, deleted=1)
+    query = "SELECT networkInterfaceId, macAddress FROM netiface ORDER BY macAddress"
+    assert [tuple(row) for row in snapshot.get_query(query)] == [("eth0", "m2"), (None, "m3")]
+
+
+def test_refresh_upserts_on_natural_key(snapshot, tmp_path):
+    rows = [dict(serverId="a", hostName="a"), dict(serverId="b", hostName="b")]
+    assert refresh_from(snapshot, tmp_path, "server", rows) == dict(inserted=2, updated=0, deleted=0)
+    ids = dict(tuple(row) for row in snapshot.get_query("SELECT serverId, id FROM server"))
+    rows = [dict(serverId="a", hostName="changed"), dict(serverId="c", hostName="c")]
+    assert refresh_from(snapshot, tmp_path, "server", rows) == dict(inserted=1, updated=1, deleted=1)
+    assert dict(tuple(row) for row in snapshot.get_query("SELECT serverId, id FROM server"))["a"] == ids["a"]
+    assert snapshot.get_query("SELECT hostName FROM server WHERE serverId = 'a'")[0][0] == "changed"
@@ -0,0 +1,229 @@
+import asyncio
+import threading
+import time
+import warnings
+import aiohttp
+import pytest
+from lib.murcsasync import AsyncMurcsRest
+from lib.murcsrest import DeadlineExceeded, MurcsRest
+from lib.murcssim import MurcsSimHandler
+from tests.test_murcsdeadline import endpoint, slow_down
+
+
+def run(coro_func):
+    async def main():
+        async with AsyncMurcsRest() as client:
+            return await coro_func(client)
+    return asyncio.run(main())
+
+
+def test_get_data_pages(sim):
+    # Paged GET calls pass cached=False to _send, the asyncio client must accept it.
+    res = run(lambda client: client.get_data("servers", limit=7))
+    assert sorted(rec["serverId"] for rec in res) == sorted(sim.data.servers)
+
+
+def test_iter_data_yields_pages(sim):
+    async def pages(client):
+        return [page async for page in client.iter_data("servers", page_size=10)]
+    res = run(pages)
+    assert [len(page) for page in res] == [10, 10, 10]
+
+
+def test_same_result_as_sync_client(sim):
+    solId = sorted(sim.data.solutions)[0]
+    res = run(lambda client: client.get_solinst_from_solution(solId))
+    assert res == MurcsRest().get_solinst_from_solution(solId)
+    assert [inst["solutionInstanceId"] for inst in res] == \
+        [inst["solutionInstanceId"] for inst in sim.data.solutions[solId]["solutionInstances"]]
+
+
+def test_concurrency_limit(sim, murcs_env):
+    murcs_env.setenv("MURCS_WORKERS", "3")
+    murcs_env.setenv("MURCS_MAX_INFLIGHT", "3")
+    state = dict(now=0, peak=0)
+    lock = threading.Lock()
+    get = sim.data.get
+
+    def slow_get(segments, query):
+        with lock:
+            state["now"] += 1
+            state["peak"] = max(state["peak"], state["now"])
+        time.sleep(0.02)
+        with lock:
+            state["now"] -= 1
+        return get(segments, query)
+
+    sim.data.get = slow_get
+    res = run(lambda client: client.run_all(client.get_server(serverId) for serverId in sorted(sim.data.servers)))
+    assert len(res) == 30
+    assert 1 < state["peak"] <= 3
+
+
+def test_run_all_cancels_on_failure(sim):
+    started = []
+
+    async def slow(client):
+        started.append(1)
+        await asyncio.sleep(10)
+
+    async def calls(client):
+        tasks = [slow(client), client.get_server("does-not-exist"), slow(client)]
+        try:
+            await client.run_all(tasks)
+        except aiohttp.ClientResponseError as e:
+            return e.status
+
+    t = time.monotonic()
+    assert run(calls) == 404
+    assert time.monotonic() - t < 5
+    assert len(started) == 2
+
+
+def test_write_calls(sim):
+    async def writes(client):
+        await client.add_softInst("soft-1", dict(softwareId="soft-1"))
+        await client.remove_server("srv000001")
+    run(writes)
+    assert [write[:2] for write in sim.data.writes] == [("PUT", "softwareInstances/soft-1"),
+                                                        ("DELETE", "servers/srv000001")]
+
+
+def test_write_call_failure_raises(sim, rejected):
+    rejected.add("site-bad")
+    with pytest.raises(aiohttp.ClientResponseError, match="Rejected by test"):
+        run(lambda client: client.add_site("site-bad", dict(town="B")))
+
+
+def test_batch(sim, rejected):
+    rejected.add("site-b")
+
+    async def send(client):
+        async with client.batch(workers=2) as batch:
+            for name in ["site-a", "site-b", "site-c"]:
+                batch.add_site(name, dict(town="T"))
+        return batch.report
+
+    report = run(send)
+    assert [(item["args"][0], item["status"]) for item in report] == [("site-a", 200), ("site-b", 400),
+                                                                       ("site-c", 200)]
+    assert "Rejected by test" in report[1]["error"] and report[0]["latency"] > 0
+    assert sorted(write[1] for write in sim.data.writes) == ["sites/site-a", "sites/site-c"]
+
+
+def test_batch_needs_async_with(sim):
+    async def send(client):
+        with client.batch() as batch:
+            batch.add_site("site-a", dict(town="T"))
+    with pytest.raises(TypeError):
+        run(send)
+    assert sim.data.writes == []
+
+
+def test_cancelled_calls_release_the_limiter(sim):
+    slow_down(sim, [1] * 5)
+
+    async def cancel(client):
+        task = asyncio.ensure_future(client.run_all(client.get_server(serverId)
+                                                    for serverId in sorted(sim.data.servers)[:5]))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        inflight = client.inflight.inflight
+        return inflight, await client.get_server("srv000001")
+
+    inflight, server = run(cancel)
+    assert inflight == 0
+    assert server["serverId"] == "srv000001"
+
+
+def test_call_deadline(sim, murcs_env):
+    murcs_env.setenv("MURCS_DEADLINE", "0.2")
+    slow_down(sim, [1])
+
+    async def calls(client):
+        with pytest.raises(DeadlineExceeded):
+            await client.get_server("srv000001")
+        return endpoint(client, "servers/{id}")["deadline_exceeded"], await client.get_server("srv000001")
+
+    t = time.monotonic()
+    exceeded, server = run(calls)
+    assert time.monotonic() - t < 1.5
+    assert exceeded == 1 and server["serverId"] == "srv000001"
+
+
+def test_slow_get_is_hedged(sim, murcs_env):
+    murcs_env.setenv("MURCS_HEDGE", "95")
+    murcs_env.setenv("MURCS_HEDGE_MIN", "5")
+
+    async def calls(client):
+        for _ in range(6):
+            await client.get_server("srv000001")
+        slow_down(sim, [2])
+        t = time.monotonic()
+        server = await client.get_server("srv000001")
+        return server, time.monotonic() - t, endpoint(client, "servers/{id}")
+
+    server, latency, ep = run(calls)
+    assert server["serverId"] == "srv000001" and latency < 1
+    assert ep["hedged"] >= 1 and ep["hedge_wins"] >= 1
+
+
+def test_memory_cache(sim, murcs_env):
+    murcs_env.setenv("MURCS_CACHE_SIZE", "10")
+
+    async def calls(client):
+        first = await client.run_all(client.get_server("srv000001") for _ in range(5))
+        await client.add_server("srv000001", dict(hostName="changed"))
+        return first, await client.get_server("srv000001")
+
+    calls_before = sim.httpd.counter["GET"]
+    first, after_write = run(calls)
+    # Concurrent calls for the same url share one call, the write call invalidates the cached response.
+    assert sim.httpd.counter["GET"] == calls_before + 2
+    assert all(server == first[0] for server in first)
+    assert after_write["hostName"] == "changed"
+
+
+def test_disk_cache(sim, murcs_env, tmp_path):
+    murcs_env.setenv("MURCS_CACHEDIR", str(tmp_path / "cache"))
+    sim.httpd.cfg["etag"] = True
+    first = run(lambda client: client.get_server("srv000001"))
+    assert MurcsRest().get_server("srv000001") == first
+    assert run(lambda client: client.get_server("srv000001")) == first
+    assert sim.httpd.counter["304"] == 2
+
+
+def test_replay_of_sync_recording(sim, murcs_env, tmp_path):
+    filename = str(tmp_path / "run.jsonl")
+    murcs_env.setenv("MURCS_RECORD", filename)
+    client = MurcsRest()
+    recorded = client.get_data("servers", limit=10), client.get_server("srv000002")
+    client.recorder.close()
+    murcs_env.delenv("MURCS_RECORD")
+    sim.stop()
+    murcs_env.setenv("MURCS_REPLAY", filename)
+    murcs_env.setenv("MURCS_REPLAY_SPEED", "0")
+
+    async def calls(client):
+        return (await client.get_data("servers", limit=10), await client.get_server("srv000002")), client.replayer
+
+    replayed, replayer = run(calls)
+    assert replayed == recorded
+    assert replayer.get_stats() == dict(replayed=4, missing=0)
+
+
+def test_authorization_header(sim, monkeypatch):
+    seen = []
+    do_get = MurcsSimHandler.do_GET
+
+    def capture(handler):
+        seen.append(handler.headers.get("Authorization"))
+        return do_get(handler)
+
+    monkeypatch.setattr(MurcsSimHandler, "do_GET", capture)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", DeprecationWarning)
+        run(lambda client: client.get_server("srv000001"))
+    assert seen == ["Basic dXNlcjpwd2Q="]
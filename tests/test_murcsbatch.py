@@ -0,0 +1,44 @@
+import time
+import pytest
+from lib.murcsrest import MurcsRest
+
+
+def test_report_per_call_and_no_raise(sim, rejected):
+    rejected.add("site-bad")
+    client = MurcsRest()
+    with client.batch() as batch:
+        batch.add_site("site-a", dict(town="A"))
+        batch.add_site("site-bad", dict(town="B"))
+        batch.add_site("site-c", dict(town="C"))
+    assert [item["args"][0] for item in batch.report] == ["site-a", "site-bad", "site-c"]
+    assert [item["status"] for item in batch.report] == [200, 400, 200]
+    assert batch.report[0]["error"] is None and batch.report[0]["latency"] >= 0
+    assert "Rejected by test" in batch.report[1]["error"]
+    assert sorted(write[1] for write in sim.data.writes) == ["sites/site-a", "sites/site-c"]
+
+
+def test_calls_are_sent_concurrently(sim, murcs_env):
+    murcs_env.setenv("MURCS_WORKERS", "10")
+    sim.httpd.cfg["latency"] = 0.05
+    client = MurcsRest()
+    t = time.monotonic()
+    with client.batch(workers=10) as batch:
+        for cnt in range(20):
+            batch.add_site("site{c}".format(c=cnt), dict(town="T"))
+    assert time.monotonic() - t < 20 * 0.05 / 2
+    assert len(sim.data.writes) == 20
+
+
+def test_exception_in_context_sends_nothing(sim):
+    client = MurcsRest()
+    with pytest.raises(ValueError):
+        with client.batch() as batch:
+            batch.add_site("site-a", dict(town="A"))
+            raise ValueError("stop")
+    assert sim.data.writes == []
+
+
+def test_only_write_calls_are_queued(sim):
+    batch = MurcsRest().batch()
+    with pytest.raises(AttributeError):
+        batch.get_server("srv000001")
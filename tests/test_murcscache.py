@@ -0,0 +1,94 @@
+import json
+import threading
+import time
+from lib.murcscache import MurcsCache
+from lib.murcsrest import MurcsRest
+
+url_loc = "http://murcs/murcs/rest/"
+url_base = url_loc + "sim/"
+
+
+def test_cache_is_off_by_default(sim):
+    client = MurcsRest()
+    assert client.cache is None
+    client.get_server("srv000001")
+    client.get_server("srv000001")
+    assert sim.httpd.counter["GET"] == 2
+
+
+def test_cache_opt_in_hits_and_write_invalidates(sim):
+    client = MurcsRest(cache_size=100)
+    first = client.get_server("srv000001")
+    first["hostName"] = "modified by caller"
+    assert client.get_server("srv000001")["hostName"] != "modified by caller"
+    assert sim.httpd.counter["GET"] == 1
+    client.add_server("srv000001", dict(hostName="renamed"))
+    assert client.get_server("srv000001")["hostName"] == "renamed"
+    assert sim.httpd.counter["GET"] == 2
+
+
+def test_cache_env_opt_in(sim, murcs_env):
+    murcs_env.setenv("MURCS_CACHE_SIZE", "10")
+    assert MurcsRest().cache is not None
+
+
+def test_ttl_expires():
+    cache = MurcsCache(url_loc, url_base, size=10, ttl=0.05)
+    calls = []
+    fetch = lambda: calls.append(1) or b"{}"
+    cache.get(url_base + "servers/a", None, fetch)
+    cache.get(url_base + "servers/a", None, fetch)
+    time.sleep(0.1)
+    cache.get(url_base + "servers/a", None, fetch)
+    assert len(calls) == 2
+    assert cache.get_stats()["expired"] == 1
+
+
+def test_lru_eviction():
+    cache = MurcsCache(url_loc, url_base, size=2, ttl=60)
+    for name in ["a", "b", "a", "c"]:
+        cache.get(url_base + "servers/" + name, None, lambda: b"{}")
+    stats = cache.get_stats()
+    assert stats["entries"] == 2 and stats["evicted"] == 1
+    calls = []
+    cache.get(url_base + "servers/a", None, lambda: calls.append(1) or b"{}")
+    assert calls == []
+
+
+def test_concurrent_calls_share_one_fetch():
+    cache = MurcsCache(url_loc, url_base, size=10, ttl=60)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return b'{"a": 1}'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(url_base + "servers/x", None, fetch)))
+               for _ in range(5)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1
+    assert results == [b'{"a": 1}'] * 5
+    assert cache.get_stats()["shared"] == 4
+
+
+def test_invalidate_by_payload_id_and_collection():
+    cache = MurcsCache(url_loc, url_base, size=10, ttl=60)
+    cache.get(url_base + "servers/srv1", None, lambda: b"{}")
+    cache.get(url_base + "servers", dict(start=0), lambda: b"{}")
+    cache.get(url_base + "solutions/sol1", None, lambda: b"{}")
+    cache.invalidate(url_base + "softwareInstances/si1", json.dumps(dict(serverId="srv1")))
+    assert cache.get_stats()["entries"] == 2
+    cache.invalidate(url_base + "servers/srv2")
+    assert cache.get_stats()["entries"] == 1
@@ -0,0 +1,93 @@
+import threading
+import time
+import pytest
+from lib.murcsrest import DeadlineExceeded, MurcsRest
+
+
+def slow_down(sim, delays):
+    """
+    The next GET calls on the stand-in wait for the delays in the list, in order. Later calls are not delayed.
+    """
+    get = sim.data.get
+    lock = threading.Lock()
+
+    def delayed(*args, **kwargs):
+        with lock:
+            delay = delays.pop(0) if delays else 0
+        time.sleep(delay)
+        return get(*args, **kwargs)
+
+    sim.data.get = delayed
+
+
+def endpoint(client, name, method="GET"):
+    return [ep for ep in client.metrics.get_report() if ep["endpoint"] == name and ep["method"] == method][0]
+
+
+def test_call_deadline(sim, murcs_env):
+    murcs_env.setenv("MURCS_DEADLINE", "0.2")
+    client = MurcsRest()
+    slow_down(sim, [1])
+    t = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        client.get_server("srv000001")
+    assert time.monotonic() - t < 0.8
+    assert endpoint(client, "servers/{id}")["deadline_exceeded"] == 1
+    assert client.get_server("srv000001")["serverId"] == "srv000001"
+
+
+def test_slow_call_within_deadline(sim, murcs_env):
+    murcs_env.setenv("MURCS_DEADLINE", "2")
+    client = MurcsRest()
+    slow_down(sim, [0.3])
+    assert client.get_server("srv000001")["serverId"] == "srv000001"
+    assert endpoint(client, "servers/{id}")["deadline_exceeded"] == 0
+
+
+def test_run_budget(sim, murcs_env):
+    murcs_env.setenv("MURCS_RUN_BUDGET", "0.3")
+    client = MurcsRest()
+    client.get_server("srv000001")
+    time.sleep(0.3)
+    calls = sim.httpd.counter["GET"]
+    with pytest.raises(DeadlineExceeded):
+        client.get_server("srv000002")
+    assert sim.httpd.counter["GET"] == calls
+
+
+def test_slow_get_is_hedged(sim, murcs_env):
+    murcs_env.setenv("MURCS_HEDGE", "95")
+    murcs_env.setenv("MURCS_HEDGE_MIN", "5")
+    client = MurcsRest()
+    for _ in range(6):
+        client.get_server("srv000001")
+    slow_down(sim, [2])
+    t = time.monotonic()
+    assert client.get_server("srv000001")["serverId"] == "srv000001"
+    assert time.monotonic() - t < 1
+    # A fast call can be hedged too when the machine is busy, the slow call is hedged for sure.
+    ep = endpoint(client, "servers/{id}")
+    assert ep["hedged"] >= 1 and ep["hedge_wins"] >= 1
+
+
+def test_no_hedge_before_min_calls(sim, murcs_env):
+    murcs_env.setenv("MURCS_HEDGE", "50")
+    murcs_env.setenv("MURCS_HEDGE_MIN", "5")
+    client = MurcsRest()
+    for _ in range(2):
+        client.get_server("srv000001")
+    slow_down(sim, [0.3])
+    client.get_server("srv000001")
+    assert endpoint(client, "servers/{id}")["hedged"] == 0
+
+
+def test_write_calls_are_not_hedged(sim, murcs_env):
+    murcs_env.setenv("MURCS_HEDGE", "50")
+    murcs_env.setenv("MURCS_HEDGE_MIN", "1")
+    client = MurcsRest()
+    for cnt in range(3):
+        client.add_site("site{c}".format(c=cnt), dict(town="T"))
+    sim.httpd.cfg["latency"] = 0.3
+    client.add_site("site-slow", dict(town="T"))
+    assert endpoint(client, "sites/{id}", "PUT")["hedged"] == 0
+    assert len(sim.data.writes) == 4
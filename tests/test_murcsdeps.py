@@ -0,0 +1,49 @@
+import logging
+from lib import murcsdeps
+from lib.murcsrest import MurcsRest
+
+
+def calls(client, *specs):
+    return [(name, getattr(client, name), args, {}) for name, args in specs]
+
+
+def test_levels():
+    assert murcsdeps.get_levels([set(), {0}, {0, 1}, set(), {3, 1}]) == [0, 1, 2, 0, 2]
+
+
+def test_long_chain_does_not_recurse():
+    depends_on = [set()] + [{cnt - 1} for cnt in range(1, 20000)]
+    assert murcsdeps.get_levels(depends_on) == list(range(20000))
+
+
+def test_cycle_is_reported(caplog):
+    with caplog.at_level(logging.WARNING):
+        levels = murcsdeps.get_levels([{2}, {0}, {1}, set(), {3}])
+    assert levels[3:] == [0, 1]
+    assert levels[1] == levels[0] + 1 and levels[2] == levels[1] + 1
+    assert "Dependency cycle for call 0" in caplog.text
+
+
+def test_plan_adds_in_dependency_order(murcs_env):
+    client = MurcsRest()
+    queue = calls(client,
+                  ("add_solInstComp", ("solinst1", "sw srv1", "sol1", "srv1", "sw")),
+                  ("add_softInst_calc", ("sw", "srv1")),
+                  ("add_server", ("srv1", dict(site=dict(siteId="site1")))),
+                  ("add_site", ("site1", {})),
+                  ("add_soft", ("sw", {})),
+                  ("add_solInst", ("sol1", "solinst1", {})))
+    levels, depends_on = murcsdeps.plan(queue)
+    assert levels == [[3, 4, 5], [2], [1], [0]]
+    assert depends_on[0] == {1, 5}
+
+
+def test_plan_removes_in_reverse_order_before_adds(murcs_env):
+    client = MurcsRest()
+    queue = calls(client,
+                  ("remove_server", ("srv1",)),
+                  ("add_site", ("site1", {})),
+                  ("remove_softInst", ("srv1", "sw", "sw srv1")),
+                  ("remove_solInstComp", ("solinst1", "sw srv1", "sol1", "srv1", "sw")))
+    levels, _ = murcsdeps.plan(queue)
+    assert levels == [[3], [2], [0], [1]]
@@ -0,0 +1,71 @@
+import pytest
+import requests
+from lib import murcsdiff
+from lib.murcsdiff import DiffWriter
+from lib.murcsrest import MurcsRest
+
+
+def test_norm_booleans_match_sqlite_integers():
+    assert murcsdiff._norm(True) == murcsdiff._norm(1) == "1"
+    assert murcsdiff._norm(False) == murcsdiff._norm(0) == "0"
+    assert murcsdiff._norm(None) is None
+
+
+def test_only_snapshot_columns_are_compared(sim, snapshot):
+    snapshot.insert_row("site", dict(siteId="site-a", town="A"))
+    writer = DiffWriter(MurcsRest(), snapshot)
+    writer.add_site("site-a", dict(siteId="site-a", town="A", notAColumn="x"))
+    assert writer.get_summary()["add_site"] == dict(new=0, changed=0, skipped=1)
+    assert sim.data.writes == []
+
+
+def test_boolean_payload_equals_snapshot_integer(sim, snapshot):
+    snapshot.insert_row("server", dict(serverId="srv-a", hostName="a", inScope=1))
+    writer = DiffWriter(MurcsRest(), snapshot)
+    writer.add_server("srv-a", dict(serverId="srv-a", hostName="a", inScope=True))
+    assert writer.get_summary()["add_server"]["skipped"] == 1
+    writer.add_server("srv-a", dict(serverId="srv-a", hostName="a", inScope=False))
+    assert writer.get_summary()["add_server"]["changed"] == 1
+
+
+def test_sent_object_is_not_sent_again(sim, snapshot):
+    writer = DiffWriter(MurcsRest(), snapshot)
+    writer.add_site("site-a", dict(siteId="site-a", town="A"))
+    writer.add_site("site-a", dict(siteId="site-a", town="A"))
+    assert writer.get_summary()["add_site"] == dict(new=1, changed=0, skipped=1)
+    assert len(sim.data.writes) == 1
+
+
+def test_failed_call_is_sent_again(sim, snapshot, rejected):
+    rejected.add("site-bad")
+    writer = DiffWriter(MurcsRest(), snapshot)
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            writer.add_site("site-bad", dict(siteId="site-bad", town="B"))
+    assert writer.get_summary()["add_site"]["new"] == 2
+    assert sim.httpd.counter["rejected"] == 2
+
+
+def test_batch_remembers_only_calls_that_succeed(sim, snapshot, rejected):
+    rejected.add("site-bad")
+    client = MurcsRest()
+    with client.batch() as batch:
+        writer = DiffWriter(batch, snapshot)
+        writer.add_site("site-a", dict(siteId="site-a", town="A"))
+        writer.add_site("site-bad", dict(siteId="site-bad", town="B"))
+    with client.batch() as batch:
+        writer.target = batch
+        writer.add_site("site-a", dict(siteId="site-a", town="A"))
+        writer.add_site("site-bad", dict(siteId="site-bad", town="B"))
+    assert [item["args"][0] for item in batch.report] == ["site-bad"]
+    assert writer.get_summary()["add_site"] == dict(new=3, changed=0, skipped=1)
+    assert sim.httpd.counter["rejected"] == 2
+
+
+def test_dry_run_remembers_nothing(sim, snapshot):
+    client = MurcsRest()
+    with client.batch(dry_run=True) as batch:
+        writer = DiffWriter(batch, snapshot)
+        writer.add_site("site-a", dict(siteId="site-a", town="A"))
+    writer.add_site("site-a", dict(siteId="site-a", town="A"))
+    assert writer.get_summary()["add_site"]["new"] == 2
@@ -0,0 +1,71 @@
+import os
+import pytest
+from lib.murcsrest import MurcsRest
+
+
+@pytest.fixture
+def cachedir(murcs_env, tmp_path):
+    directory = str(tmp_path / "cache")
+    murcs_env.setenv("MURCS_CACHEDIR", directory)
+    return directory
+
+
+def test_etag_response_is_revalidated(sim, cachedir):
+    sim.httpd.cfg["etag"] = True
+    client = MurcsRest()
+    first = client.get_server("srv000001")
+    assert MurcsRest().get_server("srv000001") == first
+    assert sim.httpd.counter["304"] == 1
+    stats = client.disk_cache.get_stats()
+    assert stats["stored"] == 1
+
+
+def test_changed_object_is_not_served_after_etag_check(sim, cachedir):
+    sim.httpd.cfg["etag"] = True
+    MurcsRest().get_server("srv000001")
+    sim.data.servers["srv000001"]["hostName"] = "changed"
+    assert MurcsRest().get_server("srv000001")["hostName"] == "changed"
+    assert sim.httpd.counter["304"] == 0
+
+
+def test_detail_without_validators_is_used_within_ttl(sim, cachedir):
+    MurcsRest().get_server("srv000001")
+    calls = sim.httpd.counter["GET"]
+    client = MurcsRest()
+    client.get_server("srv000001")
+    assert sim.httpd.counter["GET"] == calls
+    assert client.disk_cache.get_stats()["hits"] == 1
+
+
+def test_detail_without_validators_expires(sim, cachedir, murcs_env):
+    murcs_env.setenv("MURCS_CACHEDIR_TTL", "0")
+    MurcsRest().get_server("srv000001")
+    calls = sim.httpd.counter["GET"]
+    MurcsRest().get_server("srv000001")
+    assert sim.httpd.counter["GET"] == calls + 1
+
+
+def test_write_call_invalidates_responses_without_validators(sim, cachedir):
+    client = MurcsRest()
+    client.get_server("srv000001")
+    client.add_site("site-new", dict(town="T"))
+    calls = sim.httpd.counter["GET"]
+    client.get_server("srv000001")
+    assert sim.httpd.counter["GET"] == calls + 1
+
+
+def test_list_pages_are_never_stale(sim, cachedir):
+    # Regression: pages without validators were served from disk within the TTL, so new servers were not seen.
+    count = len(MurcsRest().get_data("servers"))
+    sim.data.servers["srv999999"] = dict(sim.data.servers["srv000001"], serverId="srv999999", id=999999)
+    servers = MurcsRest().get_data("servers")
+    assert len(servers) == count + 1
+    assert "srv999999" in [srv["serverId"] for srv in servers]
+    assert [name for name in os.listdir(cachedir) if name.endswith(".gz")] == []
+
+
+def test_list_pages_with_etag_are_revalidated(sim, cachedir):
+    sim.httpd.cfg["etag"] = True
+    first = MurcsRest().get_data("sites")
+    assert MurcsRest().get_data("sites") == first
+    assert sim.httpd.counter["304"] == 1
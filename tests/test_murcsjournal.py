@@ -0,0 +1,76 @@
+import json
+from lib.murcsjournal import Journal
+from lib.murcsrest import MurcsRest
+
+
+def test_outstanding_after_reload(tmp_path):
+    filename = str(tmp_path / "calls.jsonl")
+    journal = Journal(filename)
+    entries = journal.append([("add_site", ("site-a", dict(town="A")), {}),
+                              ("add_site", ("site-b", dict(town="B")), {}),
+                              ("add_site", ("site-c", dict(town="C")), {})])
+    assert entries == [1, 2, 3]
+    journal.mark(1, 200)
+    journal.mark(2, 400, "Rejected")
+    journal.close()
+    journal = Journal(filename)
+    assert journal.outstanding() == [(2, "add_site", ["site-b", dict(town="B")], {}),
+                                      (3, "add_site", ["site-c", dict(town="C")], {})]
+    assert journal.append([("add_site", ("site-d", {}), {})]) == [4]
+    journal.close()
+
+
+def test_partial_last_line_is_ignored(tmp_path):
+    filename = str(tmp_path / "calls.jsonl")
+    journal = Journal(filename)
+    journal.append([("add_site", ("site-a", {}), {})])
+    journal.close()
+    with open(filename, "a") as fh:
+        fh.write('{"entry": 1, "state": "do')
+    journal = Journal(filename)
+    assert [item[0] for item in journal.outstanding()] == [1]
+    journal.close()
+
+
+def test_batch_writes_journal_before_send(sim, rejected, tmp_path):
+    rejected.add("site-bad")
+    filename = str(tmp_path / "calls.jsonl")
+    journal = Journal(filename)
+    with MurcsRest().batch(journal=journal) as batch:
+        batch.add_site("site-a", dict(town="A"))
+        batch.add_site("site-bad", dict(town="B"))
+    journal.close()
+    with open(filename) as fh:
+        records = [json.loads(line) for line in fh]
+    assert [(rec["entry"], rec["state"]) for rec in records[:2]] == [(1, "queued"), (2, "queued")]
+    assert sorted((rec["entry"], rec["state"], rec["status"]) for rec in records[2:]) == [(1, "done", 200),
+                                                                                         (2, "failed", 400)]
+
+
+def test_resume_sends_only_outstanding_calls(sim, rejected, tmp_path):
+    rejected.add("site-bad")
+    filename = str(tmp_path / "calls.jsonl")
+    journal = Journal(filename)
+    with MurcsRest().batch(journal=journal) as batch:
+        batch.add_site("site-a", dict(town="A"))
+        batch.add_site("site-bad", dict(town="B"))
+    journal.close()
+    rejected.clear()
+    sim.data.writes.clear()
+    journal = Journal(filename)
+    with MurcsRest().batch(ordered=True, journal=journal) as batch:
+        assert batch.resume() == 1
+    assert [write[1] for write in sim.data.writes] == ["sites/site-bad"]
+    assert journal.outstanding() == []
+    journal.close()
+    assert Journal(filename).outstanding() == []
+
+
+def test_dry_run_writes_journal_and_sends_nothing(sim, tmp_path):
+    filename = str(tmp_path / "calls.jsonl")
+    journal = Journal(filename)
+    with MurcsRest().batch(journal=journal, dry_run=True) as batch:
+        batch.add_site("site-a", dict(town="A"))
+    journal.close()
+    assert sim.data.writes == []
+    assert [item[1:3] for item in Journal(filename).outstanding()] == [("add_site", ["site-a", dict(town="A")])]
@@ -0,0 +1,36 @@
+from lib.murcsmetrics import Histogram, MurcsMetrics, latency_buckets
+
+url_loc = "http://murcs/murcs/rest/"
+url_base = url_loc + "sim/"
+
+
+def test_histogram_keeps_last_observations():
+    # Regression: every observation was kept and sorted for a percentile.
+    hist = Histogram(latency_buckets, window=100)
+    for cnt in range(10000):
+        hist.observe(5 if cnt == 0 else 0.001 * (cnt % 100))
+    assert len(hist.values) == 100
+    assert hist.count == 10000
+    assert hist.max == 5
+    assert hist.percentile(50) == 0.049
+    assert hist.cumulative()[-1] == ("+Inf", 10000)
+
+
+def test_report_counts_all_calls():
+    metrics = MurcsMetrics(url_loc, url_base, window=10)
+    for cnt in range(50):
+        metrics.record("GET", url_base + "servers/srv{c}".format(c=cnt), 200, 1 if cnt < 40 else 0.1, 100)
+    ep = metrics.get_report()[0]
+    assert (ep["endpoint"], ep["count"], ep["latency_max"]) == ("servers/{id}", 50, 1)
+    assert ep["latency_p99"] == 0.1
+
+
+def test_percentile_follows_the_window():
+    metrics = MurcsMetrics(url_loc, url_base, window=100)
+    url = url_base + "servers/srv1"
+    for _ in range(1000):
+        metrics.record("GET", url, 200, 1)
+    assert metrics.get_percentile("GET", url, 95) == 1
+    for _ in range(100):
+        metrics.record("GET", url, 200, 0.1)
+    assert metrics.get_percentile("GET", url, 95) == 0.1
@@ -0,0 +1,74 @@
+import pytest
+from lib.murcsreconcile import Reconciler
+from lib.murcsrest import MurcsRest
+
+
+def load_snapshot(snapshot):
+    snapshot.insert_rows("server", [dict(serverId=srv, hostName=srv) for srv in ["srv-a", "srv-b", "srv-c"]])
+    snapshot.insert_rows("softinst", [dict(softwareInstanceId="soft-1 srv-c", serverId="srv-c", softwareId="soft-1")])
+    snapshot.insert_rows("solinstcomp", [dict(solutionInstanceId="sol-1 inst", softwareInstanceId="soft-1 srv-c",
+                                              solutionId="sol-1", serverId="srv-c", softwareId="soft-1")])
+
+
+def writes(sim):
+    return [(method, path) for method, path, body in sim.data.writes]
+
+
+def test_counts_per_object_type(sim, snapshot):
+    load_snapshot(snapshot)
+    desired = dict(servers=[dict(serverId="srv-a", hostName="srv-a"), dict(serverId="srv-b", hostName="changed"),
+                            dict(serverId="srv-new", hostName="srv-new")])
+    rec = Reconciler(MurcsRest(), snapshot)
+    report = rec.run(desired)
+    assert rec.summary == dict(servers=dict(new=1, changed=1, skipped=1, removed=1))
+    assert [item["error"] for item in report] == [None] * 3
+    assert sorted(writes(sim)) == [("DELETE", "servers/srv-c"), ("PUT", "servers/srv-b"), ("PUT", "servers/srv-new")]
+
+
+def test_no_remove(sim, snapshot):
+    load_snapshot(snapshot)
+    rec = Reconciler(MurcsRest(), snapshot, remove=False)
+    rec.run(dict(servers=[dict(serverId="srv-a", hostName="srv-a")]))
+    assert rec.summary["servers"]["removed"] == 0
+    assert writes(sim) == []
+
+
+def test_keys_are_normalized(sim, snapshot):
+    snapshot.insert_rows("solinstcomp", [dict(solutionInstanceId="1", softwareInstanceId="2", solutionId="sol-1",
+                                              serverId="srv-a", softwareId="soft-1")])
+    desired = dict(solinstcomp=[dict(solutionInstanceId=1, softwareInstanceId=2, solutionId="sol-1",
+                                     serverId="srv-a", softwareId="soft-1")])
+    rec = Reconciler(MurcsRest(), snapshot)
+    rec.run(desired)
+    assert rec.summary["solinstcomp"] == dict(new=0, changed=0, skipped=1, removed=0)
+    assert writes(sim) == []
+
+
+@pytest.mark.parametrize("record", [dict(hostName="no-key"), dict(serverId=None, hostName="none-key")])
+def test_record_without_key_is_rejected(sim, snapshot, record):
+    # Regression: a missing key was a bare KeyError, and a None key was compared as the string "None".
+    load_snapshot(snapshot)
+    desired = dict(softinst=[], servers=[dict(serverId="srv-a", hostName="new"), record])
+    with pytest.raises(ValueError, match="Record 2 of servers has no value for key column serverId"):
+        Reconciler(MurcsRest(), snapshot).run(desired)
+    assert writes(sim) == []
+
+
+def test_dry_run_sends_nothing(sim, snapshot, caplog):
+    caplog.set_level("INFO")
+    load_snapshot(snapshot)
+    rec = Reconciler(MurcsRest(), snapshot)
+    assert rec.run(dict(servers=[dict(serverId="srv-new")]), dry_run=True) == []
+    assert rec.summary["servers"] == dict(new=1, changed=0, skipped=0, removed=3)
+    assert "Dry run, 4 calls not sent" in caplog.text
+    assert writes(sim) == []
+
+
+def test_removes_in_reverse_dependency_order(sim, snapshot):
+    load_snapshot(snapshot)
+    desired = dict(servers=[dict(serverId="srv-a", hostName="srv-a"), dict(serverId="srv-b", hostName="srv-b")],
+                   softinst=[], solinstcomp=[])
+    Reconciler(MurcsRest(), snapshot).run(desired)
+    assert writes(sim) == [("DELETE", "solutionInstanceComponents"),
+                           ("DELETE", "softwareInstances/srv-c/soft-1/soft-1 srv-c"),
+                           ("DELETE", "servers/srv-c")]
@@ -0,0 +1,84 @@
+import gzip
+import json
+import pytest
+import requests
+from lib.murcsreplay import Anonymizer
+from lib.murcsrest import MurcsRest
+
+
+def record(murcs_env, filename, calls, anonymize=False):
+    murcs_env.setenv("MURCS_RECORD", filename)
+    if anonymize:
+        murcs_env.setenv("MURCS_RECORD_ANONYMIZE", "1")
+    client = MurcsRest()
+    res = calls(client)
+    client.session.hooks["response"][0].close()
+    murcs_env.delenv("MURCS_RECORD")
+    murcs_env.delenv("MURCS_RECORD_ANONYMIZE", raising=False)
+    return res
+
+
+def replay_client(murcs_env, filename):
+    murcs_env.setenv("MURCS_REPLAY", filename)
+    murcs_env.setenv("MURCS_REPLAY_SPEED", "0")
+    return MurcsRest()
+
+
+def test_replay_without_murcs(sim, murcs_env, tmp_path):
+    filename = str(tmp_path / "run.jsonl.gz")
+    recorded = record(murcs_env, filename, lambda c: (c.get_data("servers", limit=10), c.get_server("srv000002")))
+    sim.stop()
+    client = replay_client(murcs_env, filename)
+    assert (client.get_data("servers", limit=10), client.get_server("srv000002")) == recorded
+    adapter = client.session.get_adapter(client.url_base)
+    assert adapter.get_stats() == dict(replayed=4, missing=0)
+
+
+def test_call_not_in_recording_is_404(sim, murcs_env, tmp_path):
+    filename = str(tmp_path / "run.jsonl")
+    record(murcs_env, filename, lambda c: c.get_server("srv000002"))
+    client = replay_client(murcs_env, filename)
+    with pytest.raises(requests.HTTPError):
+        client.get_server("srv000003")
+    assert client.session.get_adapter(client.url_base).get_stats()["missing"] == 1
+
+
+def test_write_calls_are_matched_on_body(sim, murcs_env, tmp_path):
+    filename = str(tmp_path / "run.jsonl")
+    record(murcs_env, filename, lambda c: c.add_site("site-a", dict(town="A")))
+    client = replay_client(murcs_env, filename)
+    client.add_site("site-a", dict(town="A"))
+    with pytest.raises(requests.HTTPError):
+        client.add_site("site-a", dict(town="B"))
+
+
+def test_recording_is_anonymized(sim, murcs_env, tmp_path):
+    filename = str(tmp_path / "run.jsonl.gz")
+    email = sim.data.persons[0]["email"]
+    fqdn = sim.data.servers["srv000002"]["fqdn"]
+    record(murcs_env, filename, lambda c: (c.get_data("persons"), c.get_server("srv000002"), c.remove_person(email)),
+           anonymize=True)
+    with gzip.open(filename, "rt") as fh:
+        text = fh.read()
+    assert email not in text and fqdn not in text
+    assert "srv000002" in text
+    anonymizer = Anonymizer()
+    client = replay_client(murcs_env, filename)
+    persons = client.get_data("persons")
+    assert anonymizer.pseudonym("email", email) in [person["email"] for person in persons]
+    assert client.get_server("srv000002")["fqdn"] == anonymizer.pseudonym("fqdn", fqdn)
+    # The pseudonym in the url path matches the pseudonym in the recorded path.
+    client.remove_person(anonymizer.pseudonym("email", email))
+
+
+def test_pseudonyms_are_consistent_and_salted():
+    anonymizer = Anonymizer()
+    rec = dict(path="/murcs/rest/clients/sim/persons/a%40b.c", requestBody=None,
+               body=json.dumps(dict(email="a@b.c", serverId="srv1", items=[dict(fqdn="h.b.c", firstName=None)])))
+    rec = anonymizer(rec)
+    body = json.loads(rec["body"])
+    assert rec["path"].endswith("/persons/" + body["email"])
+    assert body["email"] == anonymizer.pseudonym("email", "a@b.c") != "a@b.c"
+    assert body["serverId"] == "srv1"
+    assert body["items"] == [dict(fqdn=anonymizer.pseudonym("fqdn", "h.b.c"), firstName=None)]
+    assert Anonymizer(salt="secret").pseudonym("email", "a@b.c") != body["email"]
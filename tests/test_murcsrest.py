@@ -0,0 +1,78 @@
+import threading
+import time
+from lib.murcsrest import AdaptiveLimiter, MurcsRest
+
+
+def count_inflight(sim):
+    """
+    GET calls on the stand-in take a little time, the highest number of calls in flight is in the returned dictionary.
+    """
+    get = sim.data.get
+    lock = threading.Lock()
+    state = dict(inflight=0, highest=0)
+
+    def counted(*args, **kwargs):
+        with lock:
+            state["inflight"] += 1
+            state["highest"] = max(state["highest"], state["inflight"])
+        time.sleep(0.02)
+        try:
+            return get(*args, **kwargs)
+        finally:
+            with lock:
+                state["inflight"] -= 1
+
+    sim.data.get = counted
+    return state
+
+
+def test_nested_fan_out_is_serial(sim, murcs_env):
+    # Regression: every inner fan-out started its own pool of max_workers threads.
+    murcs_env.setenv("MURCS_WORKERS", "3")
+    murcs_env.setenv("MURCS_MAX_INFLIGHT", "3")
+    client = MurcsRest()
+    solIds = [sol["solutionId"] for sol in client.get_data("solutions")]
+    expected = [client.get_solinst_from_solution(solId) for solId in solIds]
+    state = count_inflight(sim)
+    threads = set()
+    details = client.get_solinst_details_from_solution
+
+    def detail(solId, solInstId):
+        threads.add(threading.get_ident())
+        return details(solId, solInstId)
+
+    client.get_solinst_details_from_solution = detail
+    assert list(client.fan_out(client.get_solinst_from_solution, solIds)) == expected
+    assert len(threads) <= 3
+    assert state["highest"] <= 3
+
+
+def test_max_inflight_one_is_serial(sim, murcs_env):
+    murcs_env.setenv("MURCS_MAX_INFLIGHT", "1")
+    client = MurcsRest()
+    state = count_inflight(sim)
+    threads = set()
+
+    def get_server(serverId):
+        threads.add(threading.get_ident())
+        return client.get_server(serverId)
+
+    serverIds = ["srv00000{n}".format(n=n) for n in range(1, 6)]
+    assert [res["serverId"] for res in client.fan_out(get_server, serverIds)] == serverIds
+    assert len(client.get_data("servers", limit=5)) == 30
+    assert threads == {threading.get_ident()}
+    assert state["highest"] == 1
+
+
+def test_limiter_compares_latency_per_endpoint():
+    # Regression: the lowest latency of all endpoints was used, calls on a slower endpoint were always slow.
+    limiter = AdaptiveLimiter(4, 10)
+    for cnt in range(30):
+        limiter._adjust(cnt, cnt + 0.01, False, ("servers/{id}", "GET"))
+        limiter._adjust(cnt, cnt + 0.5, False, ("solutions/{id}", "GET"))
+    assert limiter.get_stats()["slow"] == 0
+    assert limiter.get_stats()["limit"] == 10
+    for cnt in range(30, 35):
+        limiter._adjust(cnt, cnt + 2.5, False, ("solutions/{id}", "GET"))
+    assert limiter.get_stats()["slow"] > 0
+    assert limiter.get_stats()["limit"] < 10
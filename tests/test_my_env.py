@@ -0,0 +1,59 @@
+import os
+import sys
+from lib import my_env
+
+
+def write(filename, content):
+    with open(filename, "w") as fh:
+        fh.write(content)
+
+
+def read(filename):
+    with open(filename) as fh:
+        return fh.read()
+
+
+def test_publish_file_replaces_destination(tmp_path):
+    src, dst = str(tmp_path / "a.db.tmp"), str(tmp_path / "a.db")
+    write(dst, "old")
+    write(src, "new")
+    my_env.publish_file(src, dst)
+    assert read(dst) == "new"
+    assert not os.path.exists(src)
+
+
+def test_publish_file_points_relative_link(tmp_path):
+    link = str(tmp_path / "latest.db")
+    for name in ["a.db", "b.db"]:
+        write(str(tmp_path / (name + ".tmp")), name)
+        my_env.publish_file(str(tmp_path / (name + ".tmp")), str(tmp_path / name), link=link)
+        assert os.readlink(link) == name
+        assert read(link) == name
+    assert sorted(os.listdir(str(tmp_path))) == ["a.db", "b.db", "latest.db"]
+
+
+def test_publish_file_link_in_other_directory(tmp_path):
+    (tmp_path / "data").mkdir()
+    src, dst, link = str(tmp_path / "a.tmp"), str(tmp_path / "data" / "a.db"), str(tmp_path / "latest.db")
+    write(src, "a")
+    my_env.publish_file(src, dst, link=link)
+    assert os.readlink(link) == os.path.join("data", "a.db")
+    assert read(link) == "a"
+
+
+def test_publish_file_removes_stale_temporary_link(tmp_path):
+    link = str(tmp_path / "latest.db")
+    os.symlink("gone.db", link + ".tmp")
+    write(str(tmp_path / "a.tmp"), "a")
+    my_env.publish_file(str(tmp_path / "a.tmp"), str(tmp_path / "a.db"), link=link)
+    assert read(link) == "a"
+    assert not os.path.lexists(link + ".tmp")
+
+
+def test_run_script_returns_completed_process(tmp_path):
+    write(str(tmp_path / "ok.py"), "import sys\nsys.exit(0)\n")
+    write(str(tmp_path / "fail.py"), "import sys\nsys.exit(int(sys.argv[1]))\n")
+    assert my_env.run_script(str(tmp_path), "ok.py").returncode == 0
+    r = my_env.run_script(str(tmp_path), "fail.py", "3")
+    assert r.returncode == 3
+    assert r.args == [sys.executable, str(tmp_path / "fail.py"), "3"]